@@ -9,8 +9,19 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
+from uploadmanager.bodylimit import RequestBodyLimit
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# The whole body is buffered before Django sees it, so oversize bodies are refused here
+application = RequestBodyLimit(application)
+
+# runserver served the static files in development; uvicorn does not
+if settings.DEBUG:
+    application = ASGIStaticFilesHandler(application)
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # third party app
     'crispy_forms',
@@ -53,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'uploadmanager.metrics.MetricsMiddleware',
+    'uploadmanager.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,10 +96,28 @@ DATABASES = {
         'PASSWORD': env('DB_PASSWORD'),
         'HOST': 'db',  # docker-compose database service name
         'PORT': '5432',
-
+        # Under uvicorn, the sync ORM work of each request runs in a thread of its own, so persistent
+        # connections would not be reused by later requests but pile up until their thread is collected.
+        # Connections are closed after each request; pool them outside Django, e.g. with pgbouncer.
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=0),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas: DB_REPLICA_HOSTS=replica1,replica2:5433 adds streaming replicas of the database, which serve
+# the GET requests of the listing, search and download views and of the admin. Clients read from the primary for
+# REPLICA_STICKY_SECONDS after they wrote, which should exceed the replication lag. Tests mirror the replicas to
+# the test database; pointing DB_REPLICA_HOSTS at the primary itself exercises the routing locally.
+DATABASE_REPLICAS = []
+for number, replica_host in enumerate(env.list('DB_REPLICA_HOSTS', default=[]), start=1):
+    host, _, port = replica_host.partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'], 'HOST': host, 'PORT': port or '5432', 'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['uploadmanager.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = env.int('REPLICA_STICKY_SECONDS', default=15)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -138,6 +159,75 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static'), ]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Downloads: 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd) hands the byte transfer to the
+# front proxy; leave empty to stream from Django. For nginx, DOWNLOAD_ACCEL_PREFIX must be an `internal`
+# location aliased to MEDIA_ROOT. Under uvicorn, downloads streamed from Django are read in Python block by block,
+# with no sendfile, so docker-compose puts nginx in front and defaults to 'x-accel-redirect'.
+DOWNLOAD_OFFLOAD = env('DOWNLOAD_OFFLOAD', default='')
+DOWNLOAD_ACCEL_PREFIX = '/protected-media/'
+
+# Metrics: /metrics requires 'Authorization: Bearer <METRICS_TOKEN>' when the token is set. With several
+# web or job worker processes, point PROMETHEUS_MULTIPROC_DIR at a directory they share to add up their metrics.
+# The directory must be emptied before they start, as the metrics-init service of docker-compose does.
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+# Upload profiling: a sampled share of uploads is traced stage by stage (receiving the body, validation,
+# inspection, storage, insertion, thumbnail), and each trace is passed to the UPLOAD_PROFILING_HOOKS.
+# UPLOAD_PROFILING_TRACEMALLOC adds the peak memory of each stage, at a noticeable cost in speed, and
+# UPLOAD_PROFILING_SLOWEST keeps cProfile dumps of that many of the slowest uploads in UPLOAD_PROFILING_DIR.
+UPLOAD_PROFILING = env.bool('UPLOAD_PROFILING', default=False)
+UPLOAD_PROFILING_SAMPLE_RATE = env.float('UPLOAD_PROFILING_SAMPLE_RATE', default=1.0)
+UPLOAD_PROFILING_TRACEMALLOC = env.bool('UPLOAD_PROFILING_TRACEMALLOC', default=False)
+UPLOAD_PROFILING_SLOWEST = env.int('UPLOAD_PROFILING_SLOWEST', default=0)
+UPLOAD_PROFILING_DIR = env('UPLOAD_PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+UPLOAD_PROFILING_HOOKS = [
+    'uploadmanager.profiling.log_trace',
+    'uploadmanager.metrics.record_upload_trace',
+]
+
+# Uploads are checked while they arrive, before the default handlers store them
+FILE_UPLOAD_HANDLERS = [
+    'uploadmanager.uploadhandlers.ValidatingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Bulk uploads send a whole camera roll or directory in one request
+DATA_UPLOAD_MAX_NUMBER_FILES = 1000
+# Under ASGI, Django buffers the whole body to disk before the upload handlers run, so their size and quota
+# checks no longer save bandwidth or temporary disk there. Bodies larger than MAX_REQUEST_BODY_SIZE (0 for no
+# limit) are refused by uploadmanager.bodylimit.RequestBodyLimit before they are read; a front proxy should
+# enforce the same limit, e.g. nginx's client_max_body_size.
+MAX_REQUEST_BODY_SIZE = env.int('MAX_REQUEST_BODY_MB', default=1024) * 1024 * 1024
+
+# Listing caches are invalidated by the web and worker processes alike, so the cache must be
+# shared by them, e.g. CACHE_URL=redis://redis:6379/1 in production
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default=f'filecache://{BASE_DIR / "cache"}'),
+}
+
+# Slow queries: queries slower than SLOW_QUERY_THRESHOLD_MS (0 to disable) are recorded by fingerprint and
+# shown in the admin, with the EXPLAIN (ANALYZE, BUFFERS) plan of one of them per fingerprint and process every
+# SLOW_QUERY_EXPLAIN_INTERVAL seconds. Queries slower than SLOW_QUERY_ANALYZE_MAX_MS are not run a second time
+# for ANALYZE, and only get their estimated plan. The values queries ran with are personal data, e.g. emails and
+# file names, so plans only keep them with SLOW_QUERY_STORE_PARAMS; otherwise their string literals are redacted.
+SLOW_QUERY_THRESHOLD_MS = env.int('SLOW_QUERY_THRESHOLD_MS', default=200)
+SLOW_QUERY_SAMPLE_RATE = env.float('SLOW_QUERY_SAMPLE_RATE', default=1.0)
+SLOW_QUERY_EXPLAIN_INTERVAL = env.int('SLOW_QUERY_EXPLAIN_INTERVAL', default=60 * 60)
+SLOW_QUERY_ANALYZE_MAX_MS = env.int('SLOW_QUERY_ANALYZE_MAX_MS', default=5000)
+SLOW_QUERY_PLANS_KEPT = 5
+SLOW_QUERY_STORE_PARAMS = env.bool('SLOW_QUERY_STORE_PARAMS', default=False)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'uploadmanager.profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
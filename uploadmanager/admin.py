@@ -1,18 +1,174 @@
+from django import forms
 from django.contrib import admin
-from .models import File, Folder
+from django.contrib.admin.views.main import IS_FACETS_VAR, ORDER_VAR, PAGE_VAR
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .models import Blob, File, Folder, Job, SlowQuery, SlowQueryPlan, StorageUsage
+
+ESTIMATED_COUNT_THRESHOLD = 100_000  # Tables with fewer rows are counted exactly
+ESTIMATED_COUNT_MAX_TRASH_SHARE = 0.1  # Tables with more of their rows in the trash are counted exactly
+SIZE_RANGES_MB = ((0, 1), (1, 10), (10, 50), (50, None))
+
+
+def get_estimated_rows(relation, using="default"):
+    """
+    Returns the number of rows in a table, or of entries in an index, as estimated by
+    PostgreSQL's statistics, which is read from pg_class instead of scanning it, or 0 if it was
+    never analyzed.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [relation])
+        row = cursor.fetchone()
+    return max(row[0], 0) if row else 0
+
+
+def get_estimated_count(model, using="default"):
+    """
+    Returns the estimated number of rows in the table of a model.
+    """
+    return get_estimated_rows(model._meta.db_table, using=using)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator using the estimated number of rows of a large table instead of an exact
+    COUNT(*), which reads the whole table.
+
+    The estimate is only used for unfiltered changelists, as it is that of the whole table.
+    The table also holds the soft-deleted rows the changelist hides, so the estimated entries
+    of `deleted_index`, a partial index on them, are taken out of it. If a large share of the
+    table is in the trash, the rows are counted exactly instead. Rows hidden because their
+    folder is in the trash still count until they are purged.
+    """
+
+    def __init__(self, *args, estimate=False, deleted_index=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.estimate = estimate
+        self.deleted_index = deleted_index
+
+    @cached_property
+    def count(self):
+        if self.estimate:
+            using = self.object_list.db
+            estimated = get_estimated_count(self.object_list.model, using=using)
+            deleted = get_estimated_rows(self.deleted_index, using=using) if self.deleted_index else 0
+            if (estimated >= ESTIMATED_COUNT_THRESHOLD
+                    and deleted <= estimated * ESTIMATED_COUNT_MAX_TRASH_SHARE):
+                return estimated - deleted
+        return super().count
+
+
+class UserAutocompleteFilter(admin.SimpleListFilter):
+    """
+    Filters by owner with an autocomplete box searching users by email, instead of listing
+    every user in the sidebar.
+    """
+    title = 'user'
+    parameter_name = 'user__id__exact'
+    template = 'admin/uploadmanager/autocomplete_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        user_field = model._meta.get_field('user')
+        # Only the selected user is loaded, to show its email in the box
+        field = forms.ModelChoiceField(user_field.remote_field.model.objects.all(), required=False,
+                                       widget=AutocompleteSelect(user_field, model_admin.admin_site))
+        self.widget_html = field.widget.render(self.parameter_name, self.value(),
+                                               attrs={'id': f'filter_{self.parameter_name}'})
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(user_id=self.value())
+        return queryset
+
+
+class SizeRangeFilter(admin.SimpleListFilter):
+    """
+    Filters by size range.
+    """
+    title = 'size'
+    parameter_name = 'size_mb'
+    field_name = 'size'
+
+    def lookups(self, request, model_admin):
+        return [(f"{low}-{high or ''}", f"{low}-{high} MB" if high else f"Over {low} MB")
+                for low, high in SIZE_RANGES_MB]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        low, _, high = self.value().partition('-')
+        queryset = queryset.filter(**{f'{self.field_name}__gte': int(low) * 1024 * 1024})
+        if high:
+            queryset = queryset.filter(**{f'{self.field_name}__lt': int(high) * 1024 * 1024})
+        return queryset
+
+
+class FolderSizeRangeFilter(SizeRangeFilter):
+    """
+    Filters folders by the size of their whole subtree.
+    """
+    field_name = 'total_size'
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables with millions of rows.
+
+    Unfiltered changelists of large tables show an estimated count, the filters run no query
+    to build the sidebar, and searches use an index: a term containing '@' finds the rows of
+    the user with that exact email, and any other term the names containing it, through the
+    trigram index on the name.
+    """
+    paginator = EstimatedCountPaginator
+    deleted_index = None  # Partial index on the soft-deleted rows, taken out of the estimated count
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    search_help_text = 'Search by name, or by the exact email of the owner.'
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        filtered = set(request.GET) - {PAGE_VAR, ORDER_VAR, IS_FACETS_VAR}
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, estimate=not filtered,
+                              deleted_index=self.deleted_index)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if '@' in search_term:
+            return queryset.filter(user__email=search_term), False
+        return queryset.filter(name__icontains=search_term), False
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(self.model._meta.get_field('user'), self.admin_site).media
 
 
 @admin.register(File)
-class FileAdmin(admin.ModelAdmin):
+class FileAdmin(ScalableModelAdmin):
     """
     Admin interface customization for the File model.
 
     This class customizes the File model's representation in the Django admin
     """
     list_display = ('name', 'type', 'get_size_in_mb', 'user', 'created_at', 'updated_at', 'get_folder')
-    list_filter = ('type', 'user', 'created_at')  # Adding filters for file type, user, and creation date
-    search_fields = ('name', 'user__username')  # Adding search by file name and user name
-    ordering = ('-created_at',)  # Ordering by newest first
+    list_select_related = ('user', 'folder')  # Joining the user and folder shown on every row
+    # Adding filters for file type, user, size and creation date
+    list_filter = ('type', UserAutocompleteFilter, SizeRangeFilter, 'created_at')
+    search_fields = ('name', 'user__email')  # Adding search by file name and user email
+    ordering = ('-id',)  # Ordering by newest first, along the primary key index
+    autocomplete_fields = ('user', 'folder')
+    deleted_index = 'file_deleted_idx'
+    raw_id_fields = ('blob',)
 
     def get_size_in_mb(self, obj):
         """
@@ -21,6 +177,7 @@ class FileAdmin(admin.ModelAdmin):
         return f"{obj.size / (1024 * 1024):.2f} MB"
 
     get_size_in_mb.short_description = 'Size'
+    get_size_in_mb.admin_order_field = 'size'
 
     def get_folder(self, obj):
         """
@@ -32,13 +189,125 @@ class FileAdmin(admin.ModelAdmin):
 
 
 @admin.register(Folder)
-class FolderAdmin(admin.ModelAdmin):
+class FolderAdmin(ScalableModelAdmin):
     """
     Admin interface customization for the Folder model.
 
     This class customizes the Folder model's representation in the Django admin
     """
     list_display = ('name', 'user', 'is_parent', 'created_at', 'updated_at')
-    list_filter = ('user', 'created_at')  # Adding filters for user and creation date
-    search_fields = ('name', 'user__username')  # Adding search by folder name and user name
+    list_select_related = ('user', 'is_parent')  # Joining the user and parent folder shown on every row
+    # Adding filters for user, size and creation date
+    list_filter = (UserAutocompleteFilter, FolderSizeRangeFilter, 'created_at')
+    search_fields = ('name', 'user__email')  # Adding search by folder name and user email
+    ordering = ('-id',)  # Ordering by newest first, along the primary key index
+    autocomplete_fields = ('user', 'is_parent')
+    deleted_index = 'folder_deleted_idx'
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """
+    Admin interface customization for the Job model.
+
+    This class lets staff inspect the background job queue and see why jobs failed
+    """
+    list_display = ('kind', 'status', 'attempts', 'run_at', 'locked_by', 'updated_at')
+    list_filter = ('status', 'kind')  # Adding filters for job status and kind
     ordering = ('-created_at',)  # Ordering by newest first
+    readonly_fields = ('locked_by', 'locked_at', 'last_error', 'created_at', 'updated_at')
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    """
+    Admin interface customization for the Blob model.
+
+    This class lets staff see the deduplicated content and how many files share it
+    """
+    list_display = ('checksum', 'size', 'ref_count', 'created_at')
+    search_fields = ('checksum',)  # Adding search by content checksum
+    ordering = ('-created_at',)  # Ordering by newest first
+    readonly_fields = ('checksum', 'file', 'size', 'thumbnail', 'ref_count', 'created_at')
+
+
+@admin.register(StorageUsage)
+class StorageUsageAdmin(admin.ModelAdmin):
+    """
+    Admin interface customization for the StorageUsage model.
+
+    This class shows how much space each user is using and lets staff change their quota
+    """
+    list_display = ('user', 'bytes_used', 'file_count', 'image_count', 'video_count', 'quota', 'updated_at')
+    search_fields = ('user__email',)  # Adding search by user email
+    ordering = ('-bytes_used',)  # Ordering by largest usage first
+    readonly_fields = ('bytes_used', 'file_count', 'image_bytes', 'image_count', 'video_bytes', 'video_count',
+                       'updated_at')
+
+
+class SlowQueryPlanInline(admin.StackedInline):
+    """
+    Shows the plans captured for a slow query, newest first.
+    """
+    model = SlowQueryPlan
+    extra = 0
+    can_delete = False
+    ordering = ('-captured_at',)
+    fields = ('captured_at', 'view', 'duration_ms', 'analyzed', 'seq_scans', 'plan', 'sql', 'params')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class SeqScanFilter(admin.SimpleListFilter):
+    """
+    Filters slow queries by whether their last captured plan has a sequential scan.
+    """
+    title = 'sequential scan'
+    parameter_name = 'seq_scan'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Yes'), ('no', 'No'))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.exclude(seq_scans='')
+        if self.value() == 'no':
+            return queryset.filter(seq_scans='')
+        return queryset
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    """
+    Admin interface customization for the SlowQuery model.
+
+    This class lets staff find the queries that got slow, the views running them and their plans
+    """
+    list_display = ('get_statement', 'view', 'calls', 'get_mean_ms', 'max_ms', 'seq_scans', 'last_seen')
+    list_filter = (SeqScanFilter, 'view')  # Adding filters for sequential scans and the view running the query
+    search_fields = ('statement', 'seq_scans')  # Adding search by statement and scanned table
+    ordering = ('-total_ms',)  # Ordering by the most time spent first
+    readonly_fields = ('fingerprint', 'statement', 'view', 'calls', 'total_ms', 'max_ms', 'last_ms', 'seq_scans',
+                       'first_seen', 'last_seen')
+    inlines = [SlowQueryPlanInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_statement(self, obj):
+        """
+        Returns the beginning of the normalized statement.
+        """
+        return obj.statement[:120]
+
+    get_statement.short_description = 'Statement'
+
+    def get_mean_ms(self, obj):
+        """
+        Returns the mean duration of the query in milliseconds.
+        """
+        return f"{obj.mean_ms:.1f}"
+
+    get_mean_ms.short_description = 'Mean ms'
@@ -0,0 +1,211 @@
+import hashlib
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
+from django.views import View
+from django.views.decorators.gzip import gzip_page
+
+from . import search
+from .caching import get_cached_listing_page, get_listing_etag
+from .models import File, Folder
+
+SEARCH_PAGE_SIZE = 50
+
+# The fields clients can select with ?fields=. They only use the columns fetched for listings,
+# so serializing a page never loads anything row by row.
+FOLDER_FIELDS = {
+    "id": lambda folder: folder.id,
+    "name": lambda folder: folder.name,
+    "slug": lambda folder: folder.slug,
+    "parent_id": lambda folder: folder.is_parent_id,
+    "total_size": lambda folder: folder.total_size,
+    "total_files": lambda folder: folder.total_files,
+    "total_folders": lambda folder: folder.total_folders,
+    "created_at": lambda folder: folder.created_at,
+    "url": lambda folder: reverse("uploadmanager:api_folder", args=[folder.slug]),
+}
+FILE_FIELDS = {
+    "id": lambda file: file.id,
+    "name": lambda file: file.name,
+    "type": lambda file: file.type,
+    "size": lambda file: file.size,
+    "folder_id": lambda file: file.folder_id,
+    "thumbnail_url": lambda file: file.thumbnail.url if file.thumbnail else None,
+    "created_at": lambda file: file.created_at,
+    "url": lambda file: reverse("uploadmanager:api_file", args=[file.id]),
+    "download_url": lambda file: reverse("uploadmanager:file_download", args=[file.id]),
+}
+
+
+class ApiError(Exception):
+    """
+    Raised for an invalid API request; turned into a JSON error response with its status.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def get_selected_fields(request):
+    """
+    Returns the fields selected with ?fields=name,size, or None if all fields are wanted.
+
+    Raises:
+        ApiError: If an unknown field is selected.
+    """
+    fields = [field for field in request.GET.get("fields", "").split(",") if field]
+    if not fields:
+        return None
+    unknown = set(fields) - FOLDER_FIELDS.keys() - FILE_FIELDS.keys()
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(sorted(unknown))}. "
+                       f"Folders have: {', '.join(FOLDER_FIELDS)}. Files have: {', '.join(FILE_FIELDS)}.")
+    return fields
+
+
+def serialize(instance, serializers, fields=None):
+    """
+    Serializes a file or folder to a dictionary holding the selected fields it has.
+
+    Args:
+        instance (Model): The file or folder.
+        serializers (dict): FILE_FIELDS or FOLDER_FIELDS.
+        fields (list, optional): The selected fields. Defaults to all of them.
+    """
+    return {field: serializers[field](instance) for field in (fields or serializers) if field in serializers}
+
+
+def api_response(request, data, etag=None, status=200):
+    """
+    Returns compact JSON, or 304 Not Modified if the client already has it.
+
+    Args:
+        request (HttpRequest): The request.
+        data (dict): The data to send.
+        etag (str, optional): The ETag of the data, if it can be told without building the data.
+            Defaults to a hash of the JSON.
+        status (int): The status of the response.
+    """
+    response = JsonResponse(data, status=status, json_dumps_params={"separators": (",", ":")})
+    if status != 200:
+        return response
+    etag = etag or quote_etag(hashlib.md5(response.content, usedforsecurity=False).hexdigest())
+    return _with_etag(get_conditional_response(request, etag=etag, response=response), etag)
+
+
+def _with_etag(response, etag):
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@method_decorator(gzip_page, name="dispatch")
+class ApiView(LoginRequiredMixin, View):
+    """
+    Base class of the JSON API views.
+
+    Requests that are not logged in get a 401 JSON error rather than a redirect to the login
+    page, responses are gzipped for clients that accept it, and ApiError becomes a JSON error.
+    The API only reads, so its GET requests are served by a read replica.
+    """
+    use_read_replica = True
+
+    def handle_no_permission(self):
+        return JsonResponse({"error": "Authentication required."}, status=401)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({"error": error.message}, status=error.status)
+
+
+class FolderListingApiView(ApiView):
+    """
+    Lists a folder, or the user's top level, as JSON.
+
+    GET request:
+        - Optional 'cursor': the 'next_cursor' of the previous page.
+        - Optional 'fields': the comma-separated fields to return for each file and folder.
+        - Returns the folder and its breadcrumbs, a page of its subfolders and files, and the
+          cursor of the next page, if any.
+
+    The listing comes from the same cache as the HTML pages, and its version makes the ETag,
+    so a client refreshing an unchanged folder gets a 304 without any listing query.
+    """
+
+    def get(self, request, slug=None):
+        folder = get_object_or_404(Folder, slug=slug, user=request.user) if slug else None
+        fields = get_selected_fields(request)
+        cursor = request.GET.get("cursor")
+        page, version = get_cached_listing_page(request.user, folder, cursor=cursor)
+        breadcrumbs = folder.get_nested_path() if folder else []
+
+        etag = get_listing_etag(request, "api", version, cursor, fields, breadcrumbs)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified:
+            return _with_etag(not_modified, etag)
+
+        return api_response(request, {
+            "folder": serialize(folder, FOLDER_FIELDS, fields) if folder else None,
+            "breadcrumbs": breadcrumbs,
+            "folders": [serialize(subfolder, FOLDER_FIELDS, fields) for subfolder in page.folders],
+            "files": [serialize(file, FILE_FIELDS, fields) for file in page.files],
+            "next_cursor": page.next_cursor,
+        }, etag=etag)
+
+
+class FileApiView(ApiView):
+    """
+    Returns the metadata of a file and the breadcrumbs of its folder as JSON.
+
+    GET request:
+        - Optional 'fields': the comma-separated fields to return.
+    """
+
+    def get(self, request, pk):
+        file = get_object_or_404(File.objects.select_related("folder"), pk=pk, user=request.user)
+        fields = get_selected_fields(request)
+        return api_response(request, {
+            "file": serialize(file, FILE_FIELDS, fields),
+            "breadcrumbs": file.folder.get_nested_path() if file.folder else [],
+        })
+
+
+class SearchApiView(ApiView):
+    """
+    Searches the user's files and folders by name and returns the ranked hits as JSON.
+
+    GET request:
+        - 'q': the text to search for.
+        - Optional 'cursor': the 'next_cursor' of the previous page.
+        - Optional 'fields': the comma-separated fields to return for each hit.
+        - Returns the hits of the page, each with its 'kind' and display 'path', and the
+          cursor of the next page, if any.
+    """
+    page_size = SEARCH_PAGE_SIZE
+
+    def get(self, request):
+        search_query = request.GET.get("q", "").strip()
+        if not search_query:
+            raise ApiError("The 'q' parameter is required.")
+        fields = get_selected_fields(request)
+
+        after = search.decode_search_cursor(request.GET.get("cursor"))
+        hits = list(search.search(request.user, search_query, after=after)[:self.page_size + 1])
+        next_cursor = search.encode_search_cursor(hits[self.page_size - 1]) if len(hits) > self.page_size else None
+
+        results = []
+        for result in search.resolve(hits[:self.page_size]):
+            serializers = FILE_FIELDS if result.kind == "file" else FOLDER_FIELDS
+            results.append({"kind": result.kind, "path": result.display_path,
+                            **serialize(result.object, serializers, fields)})
+
+        return api_response(request, {"results": results, "next_cursor": next_cursor})
@@ -1,3 +1,6 @@
+import atexit
+import os
+
 from django.apps import AppConfig
 
 
@@ -6,4 +9,8 @@ class UploadmanagerConfig(AppConfig):
     name = 'uploadmanager'
 
     def ready(self):
-        from . import signals
\ No newline at end of file
+        from . import signals
+        from .metrics import mark_process_dead
+
+        # Every web and job worker process, uvicorn's and runjobs' alike, cleans up after itself
+        atexit.register(mark_process_dead, os.getpid())
\ No newline at end of file
@@ -0,0 +1,142 @@
+import io
+import logging
+import mimetypes
+import zipfile
+from collections import namedtuple
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import File
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_CHUNK_SIZE = 256 * 1024
+# Formats that are already compressed; deflating them again costs CPU and gains nothing
+STORED_MIME_TYPES = {
+    "image/jpeg", "image/png", "image/gif", "image/webp", "image/heic",
+    "video/mp4", "video/quicktime", "video/x-matroska", "video/webm", "video/mpeg", "video/x-ms-wmv",
+}
+
+ArchiveEntry = namedtuple("ArchiveEntry", ["name", "path", "size", "modified_at"])
+
+
+class ZipStream(io.RawIOBase):
+    """
+    A write-only, unseekable buffer for `zipfile.ZipFile`.
+
+    ZipFile writes entries with data descriptors when it cannot seek back, so the archive can be
+    produced front to back. Whatever it has written is taken out with `drain` and sent right away,
+    so only about one chunk is ever held in memory.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        """
+        Returns and forgets the bytes written since the last call.
+        """
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def get_folder_entries(folder):
+    """
+    Lists the entries of a ZIP archive of a folder and its whole subtree.
+
+    The subfolders are fetched with a single query on the materialized path, and the files of
+    the whole subtree with another one, read in chunks from a server-side cursor.
+
+    Args:
+        folder (Folder): The folder to archive.
+
+    Yields:
+        ArchiveEntry: A directory entry (with a name ending in '/' and no path) for every folder,
+            and a file entry for every file, named by its path relative to the folder's parent.
+    """
+    names = {folder.pk: f"{folder.name}/"}
+    yield ArchiveEntry(names[folder.pk], None, 0, folder.updated_at)
+
+    for subfolder in folder.get_descendants().order_by("depth", "name").only("id", "name", "path", "updated_at"):
+        parent_id = subfolder.get_ancestor_ids()[-1]
+        names[subfolder.pk] = f"{names[parent_id]}{subfolder.name}/"
+        yield ArchiveEntry(names[subfolder.pk], None, 0, subfolder.updated_at)
+
+    files = (
+        File.objects.filter(Q(folder=folder) | Q(folder__path__startswith=folder.subtree_prefix), user=folder.user_id)
+        .only("id", "name", "file", "size", "folder_id", "updated_at")
+        .order_by("folder_id", "name")
+    )
+    for file in files.iterator(chunk_size=1000):
+        yield ArchiveEntry(f"{names[file.folder_id]}{file.name}", file.file.path, file.size, file.updated_at)
+
+
+def stream_zip(entries, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """
+    Generates a ZIP archive on the fly, without staging anything on disk.
+
+    Already-compressed media is stored as is and other files are deflated. ZIP64 extensions are
+    used where needed, so archives and entries may exceed 4 GB. Files that have disappeared from
+    storage since they were listed are left out.
+
+    Args:
+        entries (iterable): The ArchiveEntry objects to put in the archive.
+        chunk_size (int): The size of the blocks read from the files.
+
+    Yields:
+        bytes: The successive, non-empty parts of the archive.
+    """
+    return (part for part in _generate_zip(entries, chunk_size) if part)
+
+
+def _generate_zip(entries, chunk_size):
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w", allowZip64=True) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, date_time=_get_date_time(entry.modified_at))
+
+            if entry.path is None:
+                info.external_attr = 0o40755 << 16 | 0x10  # Directory, drwxr-xr-x
+                archive.writestr(info, b"")
+                yield stream.drain()
+                continue
+
+            mime_type, _ = mimetypes.guess_type(entry.name)
+            info.compress_type = zipfile.ZIP_STORED if mime_type in STORED_MIME_TYPES else zipfile.ZIP_DEFLATED
+            info.external_attr = 0o100644 << 16  # Regular file, -rw-r--r--
+            info.file_size = entry.size or 0
+
+            try:
+                source = open(entry.path, "rb")
+            except FileNotFoundError:
+                logger.warning("Leaving %s out of the archive: %s is missing.", entry.name, entry.path)
+                continue
+
+            with source, archive.open(info, "w") as target:
+                while chunk := source.read(chunk_size):
+                    target.write(chunk)
+                    yield stream.drain()
+            yield stream.drain()
+    yield stream.drain()
+
+
+def _get_date_time(moment):
+    """
+    Returns the ZIP timestamp of a datetime; ZIP cannot store dates before 1980.
+    """
+    return max(timezone.localtime(moment).timetuple()[:6], (1980, 1, 1, 0, 0, 0))
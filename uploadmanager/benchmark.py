@@ -0,0 +1,610 @@
+import csv
+import io
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files import File as DjangoFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from imageio_ffmpeg import get_ffmpeg_exe
+from PIL import Image
+
+from accounts.models import Profile
+from .deletion import _raw_delete
+from .models import Blob, File, Folder, Job, StorageUsage, UploadChunk, UploadSession, inspect_file
+
+# Benchmark users are recognized by this reserved domain, so they can be removed again
+BENCHMARK_EMAIL_DOMAIN = "benchmark.invalid"
+BENCHMARK_PASSWORD = "benchmark"
+BENCHMARK_UPLOAD_FOLDER = "Benchmark uploads"
+# Quota left to benchmark users on top of the seeded files, so uploads are not refused
+BENCHMARK_QUOTA_HEADROOM = 100 * 1024 ** 3
+
+COPY_BATCH_SIZE = 50_000
+TOP_LEVEL_FILE_SHARE = 0.1  # Share of the seeded files put at the top level rather than in a folder
+ENDPOINTS = ("home", "folder", "search", "upload")
+PERCENTILES = (50, 90, 95, 99)
+
+Fixture = namedtuple("Fixture", ["blob", "type", "extension"])
+Sample = namedtuple("Sample", ["seconds", "status", "queries"])
+
+
+class BenchmarkError(Exception):
+    """
+    Raised when a benchmark cannot be set up, e.g. because no dataset has been seeded.
+    """
+
+
+def create_fixtures(directory, images=4, videos=2):
+    """
+    Generates distinct image and video files to seed files from, without any network access.
+
+    Images are random noise, so they do not compress to nothing, and videos are short ffmpeg
+    test patterns encoded with the ffmpeg bundled with imageio-ffmpeg.
+
+    Args:
+        directory (str): The directory the fixtures are written to.
+        images (int): The number of JPEG images.
+        videos (int): The number of MP4 videos.
+
+    Returns:
+        list: The paths of the fixtures.
+    """
+    paths = []
+    for index in range(images):
+        path = os.path.join(directory, f"fixture-{index}.jpg")
+        Image.effect_noise((640, 480), 32 + index).convert("RGB").save(path, "JPEG", quality=85)
+        paths.append(path)
+
+    for index in range(videos):
+        path = os.path.join(directory, f"fixture-{index}.mp4")
+        subprocess.run([
+            get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+            "-f", "lavfi", "-i", "testsrc=duration=2:size=320x240:rate=15",
+            "-vf", f"hue=h={index * 60}", "-pix_fmt", "yuv420p", path,
+        ], check=True, timeout=120)
+        paths.append(path)
+    return paths
+
+
+def store_fixtures(paths):
+    """
+    Stores fixture files as blobs, with their thumbnails, for the seeded files to share.
+
+    Returns:
+        list: A Fixture for each path.
+    """
+    fixtures = []
+    for path in paths:
+        with open(path, "rb") as content:
+            upload = DjangoFile(content, name=os.path.basename(path))
+            inspection = inspect_file(upload)
+            with transaction.atomic():
+                blob = Blob.acquire(inspection.checksum, inspection.size, upload)
+        if not blob.thumbnail:
+            blob._create_thumbnail()
+        file_type = "video" if inspection.mime_type.startswith("video") else "image"
+        fixtures.append(Fixture(blob, file_type, os.path.splitext(path)[1]))
+    return fixtures
+
+
+def seed_dataset(users=10, folders=200, depth=8, files=100_000, images=4, videos=2, password=BENCHMARK_PASSWORD,
+                 seed=0, log=None):
+    """
+    Seeds a synthetic dataset: users, each with a deep folder tree, and many files.
+
+    Users and folders are created with `bulk_create`, and the file rows are streamed into the
+    database with COPY in batches, so millions of them take minutes rather than hours. The
+    files all share the content of a few generated fixtures, stored once as blobs. The counters
+    that signals maintain for single files (folder totals, storage usage and blob references)
+    are then set with a few statements per user, and the tables are analyzed, so the planner
+    sees the new data right away.
+
+    Args:
+        users (int): The number of users.
+        folders (int): The number of folders of each user.
+        depth (int): The number of levels the folders of each user are spread over.
+        files (int): The total number of files, shared evenly between the users.
+        images (int): The number of image fixtures.
+        videos (int): The number of video fixtures.
+        password (str): The password of the users, to log in with against a running server.
+        seed (int): The seed of the random generator, so datasets can be reproduced.
+        log (callable, optional): Called with progress messages.
+
+    Returns:
+        dict: The number of users, folders and files created.
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        log(f"Generating {images} image and {videos} video fixtures")
+        fixtures = store_fixtures(create_fixtures(directory, images=images, videos=videos))
+
+    new_users = _create_users(users, password)
+    log(f"Created {len(new_users)} users")
+
+    created_folders = created_files = 0
+    files_per_user = files // max(users, 1)
+    references = Counter()
+    for position, user in enumerate(new_users):
+        with transaction.atomic():
+            user_folders = _create_folder_tree(user, folders, depth, rng)
+            user_files = files_per_user + (1 if position < files % max(users, 1) else 0)
+            _copy_files(user, user_folders, user_files, fixtures, references, rng)
+        created_folders += len(user_folders)
+        created_files += user_files
+        log(f"User {user.email}: {len(user_folders)} folders, {user_files} files")
+
+    # Undo the references store_fixtures took, now that files hold them
+    for fixture in fixtures:
+        references[fixture.blob.pk] -= 1
+    for blob_id, count in references.items():
+        Blob.objects.filter(pk=blob_id).update(ref_count=Greatest(F("ref_count") + count, 0))
+
+    with connection.cursor() as cursor:
+        for model in (get_user_model(), Folder, File, Blob, StorageUsage):
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
+
+    return {"users": len(new_users), "folders": created_folders, "files": created_files}
+
+
+def _create_users(count, password):
+    User = get_user_model()
+    start = User.objects.filter(email__endswith=f"@{BENCHMARK_EMAIL_DOMAIN}").count()
+    hashed = make_password(password)
+    users = User.objects.bulk_create([
+        User(email=f"user{start + index}@{BENCHMARK_EMAIL_DOMAIN}", password=hashed) for index in range(count)
+    ])
+    Profile.objects.bulk_create([Profile(user=user, first_name="Benchmark", last_name=f"User {start + index}")
+                                 for index, user in enumerate(users)])
+    return users
+
+
+def _create_folder_tree(user, count, depth, rng):
+    """
+    Creates the folders of a user spread evenly over `depth` levels, each inside a random folder
+    of the level above, with one `bulk_create` per level.
+    """
+    per_level = max(math.ceil(count / max(depth, 1)), 1)
+    folders, parents = [], [None]
+    while len(folders) < count:
+        level = []
+        for _ in range(min(per_level, count - len(folders))):
+            parent = rng.choice(parents)
+            number = len(folders) + len(level)
+            level.append(Folder(
+                name=f"Folder {number}", slug=f"benchmark-{user.pk}-{number}", user=user, is_parent=parent,
+                path=parent.subtree_prefix if parent else "/", depth=parent.depth + 1 if parent else 0,
+            ))
+        Folder.objects.bulk_create(level)
+        folders += level
+        parents = level
+    return folders
+
+
+def _copy_files(user, folders, count, fixtures, references, rng):
+    """
+    Streams the file rows of a user into the database with COPY, then adds them to the
+    folder totals and to the user's storage usage.
+    """
+    columns = ("name", "file", "size", "checksum", "type", "thumbnail", "blob_id", "user_id", "folder_id",
+               "created_at", "updated_at")
+    sql = (f"COPY {connection.ops.quote_name(File._meta.db_table)} "
+           f"({', '.join(connection.ops.quote_name(column) for column in columns)}) FROM STDIN WITH (FORMAT csv)")
+    now = timezone.now()
+    amounts = defaultdict(lambda: [0, 0, 0])
+    usage = defaultdict(lambda: [0, 0])
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    with connection.cursor() as cursor:
+        for number in range(count):
+            fixture = rng.choice(fixtures)
+            folder = rng.choice(folders) if folders and rng.random() >= TOP_LEVEL_FILE_SHARE else None
+            created_at = (now - timedelta(seconds=rng.randrange(365 * 24 * 60 * 60))).isoformat()
+            prefix = "VID" if fixture.type == "video" else "IMG"
+            writer.writerow([
+                f"{prefix}_{number:07d}{fixture.extension}", fixture.blob.file.name, fixture.blob.size,
+                fixture.blob.checksum, fixture.type, fixture.blob.thumbnail.name or "", fixture.blob.pk, user.pk,
+                folder.pk if folder else "", created_at, created_at,
+            ])
+
+            references[fixture.blob.pk] += 1
+            usage[fixture.type][0] += fixture.blob.size
+            usage[fixture.type][1] += 1
+            if folder is not None:
+                for folder_id in folder.get_lineage_ids():
+                    amounts[folder_id][0] += fixture.blob.size
+                    amounts[folder_id][1] += 1
+
+            if (number + 1) % COPY_BATCH_SIZE == 0 or number + 1 == count:
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                buffer.seek(0)
+                buffer.truncate()
+
+    for folder in folders:
+        for folder_id in folder.get_ancestor_ids():
+            amounts[folder_id][2] += 1
+    Folder.add_to_totals(amounts)
+    for file_type, (size, file_count) in usage.items():
+        StorageUsage.add(user.pk, file_type, size, count=file_count)
+    StorageUsage.objects.get_or_create(user=user)
+    StorageUsage.objects.filter(user=user).update(quota=F("bytes_used") + BENCHMARK_QUOTA_HEADROOM)
+
+
+def delete_dataset():
+    """
+    Removes the benchmark users and everything they own, with plain SQL, and queues the removal
+    of the stored content no other file references.
+
+    Returns:
+        int: The number of users removed.
+    """
+    users = get_user_model().objects.filter(email__endswith=f"@{BENCHMARK_EMAIL_DOMAIN}")
+    user_ids = list(users.values_list("pk", flat=True))
+    if not user_ids:
+        return 0
+
+    with transaction.atomic():
+        files = File.all_objects.filter(user_id__in=user_ids)
+        references = dict(files.filter(blob__isnull=False).values_list("blob_id").annotate(count=Count("id")))
+        sessions = UploadSession.objects.filter(user_id__in=user_ids)
+        _raw_delete(UploadChunk.objects.filter(session__in=sessions))
+        _raw_delete(sessions)
+        _raw_delete(files)
+        _raw_delete(Folder.all_objects.filter(user_id__in=user_ids))
+        _raw_delete(StorageUsage.objects.filter(user_id__in=user_ids))
+        names = Blob.release_many(references)
+        users.delete()
+        if names:
+            Job.enqueue("remove_stored_files", names=names)
+    return len(user_ids)
+
+
+class InProcessClient:
+    """
+    Sends requests through Django's test client, in this process, and counts the queries each
+    of them runs. Must be used by a single thread.
+    """
+    counts_queries = True
+
+    def __init__(self, user):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def request(self, method, path, params=None, files=None):
+        data = dict(params or {})
+        for field, (name, content) in (files or {}).items():
+            data[field] = SimpleUploadedFile(name, content)
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(path, data)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            seconds = time.perf_counter() - start
+        return Sample(seconds, response.status_code, len(queries))
+
+
+class HttpClient:
+    """
+    Sends requests to a running server over HTTP, logged in as a benchmark user. The queries
+    run by the server cannot be counted from here.
+    """
+    counts_queries = False
+
+    def __init__(self, base_url, email, password):
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        login_url = f"{self.base_url}/accounts/login/"
+        self.session.get(login_url)
+        response = self.session.post(login_url, allow_redirects=False, headers={"Referer": login_url}, data={
+            "email": email, "password": password, "csrfmiddlewaretoken": self.session.cookies.get("csrftoken", ""),
+        })
+        if response.status_code != 302:
+            raise BenchmarkError(f"Could not log in to {self.base_url} as {email}.")
+
+    def request(self, method, path, params=None, files=None):
+        url = f"{self.base_url}{path}"
+        start = time.perf_counter()
+        if method == "get":
+            response = self.session.get(url, params=params, allow_redirects=False)
+        else:
+            response = self.session.request(method, url, data=params, files=files, allow_redirects=False,
+                                            headers={"X-CSRFToken": self.session.cookies.get("csrftoken", ""),
+                                                     "Referer": url})
+        seconds = time.perf_counter() - start
+        return Sample(seconds, response.status_code, None)
+
+
+class UserScenario:
+    """
+    What the requests of a benchmark user are made of: the user's folders, search terms
+    matching the user's files and folders, and content to upload.
+    """
+
+    def __init__(self, user, rng):
+        self.user = user
+        self.folder_slugs = list(Folder.objects.filter(user=user).order_by("?").values_list("slug", flat=True)[:100])
+        names = list(File.objects.filter(user=user).order_by("?").values_list("name", flat=True)[:50])
+        self.search_terms = [os.path.splitext(name)[0][:-2] for name in names] + [
+            name for name in Folder.objects.filter(user=user).order_by("?").values_list("name", flat=True)[:10]
+        ] + ["nothing matches this"]
+        self.upload_folder = Folder.get_or_create_tree(user, None, [(BENCHMARK_UPLOAD_FOLDER,)])[
+            (BENCHMARK_UPLOAD_FOLDER,)]
+        buffer = io.BytesIO()
+        Image.effect_noise((320, 240), 48).convert("RGB").save(buffer, "JPEG", quality=85)
+        self.upload_content = buffer.getvalue()
+        self.rng = rng
+
+    def get_request(self, endpoint):
+        """
+        Returns the (method, path, params, files) of a request to an endpoint.
+        """
+        if endpoint == "home":
+            return "get", "/", None, None
+        if endpoint == "folder":
+            if not self.folder_slugs:
+                return "get", f"/folder/{self.upload_folder.slug}/", None, None
+            return "get", f"/folder/{self.rng.choice(self.folder_slugs)}/", None, None
+        if endpoint == "search":
+            return "get", "/search/", {"search": self.rng.choice(self.search_terms)}, None
+        if endpoint == "upload":
+            # Bytes after the end of a JPEG are ignored by decoders, and make every upload new
+            # content that is stored, rather than a duplicate of an existing blob
+            content = self.upload_content + os.urandom(16)
+            return "post", "/file/upload/", {"parent_slug": self.upload_folder.slug}, {
+                "file": (f"upload-{uuid.uuid4().hex}.jpg", content)}
+        raise BenchmarkError(f"Unknown endpoint: {endpoint}")
+
+
+class Benchmark:
+    """
+    Drives endpoints with concurrent requests from the benchmark users and measures them.
+
+    Each endpoint is benchmarked on its own: `concurrency` threads, each logged in as one of the
+    users, send warm-up requests, wait for each other, then send requests back to back for
+    `duration` seconds or until `requests` have been sent in total.
+
+    Args:
+        endpoints (list): The names of the endpoints, among ENDPOINTS.
+        concurrency (int): The number of concurrent clients.
+        duration (float): Seconds each endpoint is driven for.
+        requests (int, optional): A number of requests after which an endpoint is done earlier.
+        warmup (int): Requests each client sends before the measurements start.
+        base_url (str, optional): The URL of a running server to send the requests to. By
+            default they go through Django's test client in this process, which also counts
+            the queries they run.
+        password (str): The password of the benchmark users, to log in to the server with.
+        use_cache (bool): Whether cached listings may be served. Without the cache, every
+            listing is queried and rendered, as on a cold cache. Only applies in process.
+        seed (int): The seed of the random generator picking folders and search terms.
+    """
+
+    def __init__(self, endpoints=ENDPOINTS, concurrency=8, duration=10, requests=None, warmup=2, base_url=None,
+                 password=BENCHMARK_PASSWORD, use_cache=True, seed=0):
+        self.endpoints = list(endpoints)
+        self.concurrency = max(concurrency, 1)
+        self.duration = duration
+        self.requests = requests
+        self.warmup = warmup
+        self.base_url = base_url
+        self.password = password
+        self.use_cache = use_cache
+        self.seed = seed
+
+    def run(self, log=None):
+        """
+        Runs the benchmark.
+
+        Returns:
+            dict: The report, with the settings, the dataset and the statistics of each endpoint.
+
+        Raises:
+            BenchmarkError: If no dataset has been seeded.
+        """
+        log = log or (lambda message: None)
+        users = list(get_user_model().objects.filter(email__endswith=f"@{BENCHMARK_EMAIL_DOMAIN}")
+                     .order_by("pk")[:self.concurrency])
+        if not users:
+            raise BenchmarkError("No benchmark users found; seed a dataset first.")
+
+        rng = random.Random(self.seed)
+        scenarios = [UserScenario(user, random.Random(rng.random())) for user in users]
+        report = {
+            "started_at": timezone.now().isoformat(),
+            "settings": {
+                "mode": "http" if self.base_url else "in-process",
+                "base_url": self.base_url,
+                "concurrency": self.concurrency,
+                "duration": self.duration,
+                "requests": self.requests,
+                "warmup": self.warmup,
+                "cache": self.use_cache,
+                "seed": self.seed,
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": f"{connection.vendor} {connection.pg_version if connection.vendor == 'postgresql' else ''}"
+                .strip(),
+            },
+            "dataset": get_dataset_size(),
+            "endpoints": {},
+        }
+
+        overrides = {"ALLOWED_HOSTS": ["*"]}
+        if not self.use_cache:
+            overrides["CACHES"] = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+        with override_settings(**overrides):
+            for endpoint in self.endpoints:
+                log(f"Benchmarking {endpoint} with {self.concurrency} concurrent clients")
+                report["endpoints"][endpoint] = self.run_endpoint(endpoint, scenarios)
+        return report
+
+    def run_endpoint(self, endpoint, scenarios):
+        """
+        Drives one endpoint and returns its statistics.
+        """
+        samples = []
+        lock = threading.Lock()
+        timing = {}
+        # The clock starts once every client has logged in and warmed up
+        barrier = threading.Barrier(self.concurrency, action=lambda: timing.update(start=time.perf_counter()))
+        remaining = [self.requests] if self.requests else None
+
+        def work(index):
+            scenario = scenarios[index % len(scenarios)]
+            setup_error = None
+            try:
+                client = self.get_client(scenario.user)
+                for _ in range(self.warmup):
+                    client.request(*scenario.get_request(endpoint))
+            except Exception as error:
+                setup_error = error
+            barrier.wait()
+            if setup_error:
+                raise setup_error
+
+            own = []
+            deadline = timing["start"] + self.duration
+            try:
+                while time.perf_counter() < deadline:
+                    if remaining is not None:
+                        with lock:
+                            if remaining[0] <= 0:
+                                break
+                            remaining[0] -= 1
+                    try:
+                        own.append(client.request(*scenario.get_request(endpoint)))
+                    except Exception:
+                        own.append(Sample(0, None, None))
+            finally:
+                with lock:
+                    samples.extend(own)
+                if not self.base_url:
+                    connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(work, index) for index in range(self.concurrency)]
+            for future in futures:
+                future.result()
+            elapsed = time.perf_counter() - timing["start"]
+
+        return summarize(samples, elapsed)
+
+    def get_client(self, user):
+        if self.base_url:
+            return HttpClient(self.base_url, user.email, self.password)
+        return InProcessClient(user)
+
+
+def get_dataset_size():
+    """
+    Returns the number of benchmark users, and of the folders and files they own.
+    """
+    users = get_user_model().objects.filter(email__endswith=f"@{BENCHMARK_EMAIL_DOMAIN}")
+    return {
+        "users": users.count(),
+        "folders": Folder.objects.filter(user__in=users).count(),
+        "files": File.objects.filter(user__in=users).count(),
+    }
+
+
+def percentile(values, percent):
+    """
+    Returns the nearest-rank percentile of sorted values, or None if there are none.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(math.ceil(percent / 100 * len(values)) - 1, 0))]
+
+
+def summarize(samples, elapsed):
+    """
+    Returns the statistics of the samples of an endpoint: request and error counts, status
+    codes, throughput, latency percentiles in milliseconds and, in process, query counts.
+    """
+    completed = [sample for sample in samples if sample.status is not None]
+    latencies = sorted(sample.seconds * 1000 for sample in completed)
+    queries = sorted(sample.queries for sample in completed if sample.queries is not None)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if sample.status is None or sample.status >= 400),
+        "status_codes": dict(sorted(Counter(str(sample.status) for sample in samples).items())),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput": round(len(completed) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            **{f"p{percent}": _round(percentile(latencies, percent)) for percent in PERCENTILES},
+            "max": _round(latencies[-1] if latencies else None),
+        },
+        "queries": {
+            "mean": round(sum(queries) / len(queries), 2),
+            "p95": percentile(queries, 95),
+            "max": queries[-1],
+        } if queries else None,
+    }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def compare_reports(baseline, current, threshold=0.2):
+    """
+    Compares a report with a baseline report, endpoint by endpoint.
+
+    Args:
+        baseline (dict): The report to compare with.
+        current (dict): The new report.
+        threshold (float): The relative change tolerated before a change counts as a regression.
+
+    Returns:
+        tuple: A line describing each endpoint's changes, and a line for each regression: a p95
+            latency or throughput worse by more than `threshold`, more queries, or new errors.
+    """
+    lines, regressions = [], []
+    for endpoint, stats in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if before is None:
+            continue
+
+        old_p95, new_p95 = before["latency_ms"]["p95"], stats["latency_ms"]["p95"]
+        old_throughput, new_throughput = before["throughput"], stats["throughput"]
+        lines.append(f"{endpoint}: p95 {old_p95} -> {new_p95} ms, throughput {old_throughput} -> {new_throughput} "
+                     f"req/s, errors {before['errors']} -> {stats['errors']}")
+
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + threshold):
+            regressions.append(f"{endpoint}: p95 latency rose from {old_p95} to {new_p95} ms")
+        if old_throughput and new_throughput is not None and new_throughput < old_throughput * (1 - threshold):
+            regressions.append(f"{endpoint}: throughput fell from {old_throughput} to {new_throughput} req/s")
+        if before.get("queries") and stats.get("queries") and stats["queries"]["max"] > before["queries"]["max"]:
+            regressions.append(f"{endpoint}: up to {stats['queries']['max']} queries per request instead of "
+                               f"{before['queries']['max']}")
+        if stats["errors"] > before["errors"]:
+            regressions.append(f"{endpoint}: {stats['errors']} errors instead of {before['errors']}")
+    return lines, regressions
@@ -0,0 +1,77 @@
+from django.conf import settings
+
+PAYLOAD_TOO_LARGE = b"Request body exceeds the maximum size."
+
+
+class RequestBodyLimit:
+    """
+    ASGI middleware refusing requests whose body exceeds MAX_REQUEST_BODY_SIZE bytes.
+
+    Django's ASGIHandler reads the whole body, to memory or a temporary file, before the view
+    and the upload handlers see any of it, so the size checks of ValidatingUploadHandler and of
+    the upload views save neither bandwidth nor temporary disk under uvicorn. This middleware
+    runs before the body is read: requests announcing a larger Content-Length are answered with
+    413 at once, and chunked requests are cut off as soon as they grow past the limit.
+
+    A front proxy should enforce the same limit, e.g. nginx's `client_max_body_size`, so the
+    bytes do not reach the application servers at all.
+    """
+
+    def __init__(self, application, max_size=None):
+        self.application = application
+        self.max_size = max_size
+
+    def get_max_size(self):
+        return self.max_size if self.max_size is not None else settings.MAX_REQUEST_BODY_SIZE
+
+    async def __call__(self, scope, receive, send):
+        max_size = self.get_max_size()
+        if scope["type"] != "http" or not max_size:
+            return await self.application(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        try:
+            if content_length is not None and int(content_length) > max_size:
+                return await self.refuse(send)
+        except ValueError:
+            pass
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_size:
+                    # The application sees a client that went away, and stops reading
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        await self.application(scope, limited_receive, tracking_send)
+        if exceeded and not response_started:
+            await self.refuse(send)
+
+    @staticmethod
+    async def refuse(send):
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(PAYLOAD_TOO_LARGE)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": PAYLOAD_TOO_LARGE})
@@ -0,0 +1,231 @@
+import os
+import random
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+from .caching import invalidate_listings
+from .models import (Blob, File, Folder, Job, StorageUsage, get_free_name, inspect_file, retry_on_conflict,
+                     validate_name)
+from .profiling import annotate_upload, stage
+
+BULK_UPLOAD_WORKERS = min(8, os.cpu_count() or 1)
+TAKEN_NAMES_CHUNK_SIZE = 100
+
+BulkUploadResult = namedtuple("BulkUploadResult", ["files", "errors"])
+BulkUploadError = namedtuple("BulkUploadError", ["path", "message"])
+
+
+def split_path(relative_path, default_name):
+    """
+    Splits the relative path of an uploaded file into its folder names and its file name.
+
+    Args:
+        relative_path (str): The path of the file relative to the uploaded directory, e.g.
+            'DCIM/2024/IMG_0001.JPG'. May be empty for a file without a directory.
+        default_name (str): The name used if the path has none.
+
+    Returns:
+        tuple: (folder names, file name).
+    """
+    parts = split_folder_path(relative_path)
+    if not parts:
+        return (), os.path.basename(default_name)
+    return tuple(parts[:-1]), parts[-1]
+
+
+def split_folder_path(relative_path):
+    """
+    Splits a relative folder path, e.g. 'DCIM/2024', into its folder names.
+    """
+    return tuple(part for part in relative_path.replace("\\", "/").split("/") if part not in ("", ".", ".."))
+
+
+def create_folder_tree(user, paths, parent=None):
+    """
+    Creates the folders at the given relative paths, and every folder on the way to them.
+
+    Folders that already exist are reused rather than numbered, so the call is idempotent and
+    clients syncing a tree can send all of its paths every time. Concurrent calls creating the
+    same folders end up with one copy of each. Either all the folders are created or none.
+
+    Args:
+        user (CustomUser): The owner of the folders.
+        paths (iterable): The relative paths, e.g. 'DCIM/2024'.
+        parent (Folder, optional): The folder the paths are relative to. Defaults to the top level.
+
+    Returns:
+        dict: The folder at the end of each non-empty path, keyed by path.
+
+    Raises:
+        ValidationError: If a folder name is invalid or too long.
+    """
+    trees = {path: split_folder_path(path) for path in paths}
+    max_length = Folder._meta.get_field("name").max_length
+    for names in trees.values():
+        for name in names:
+            if len(name) > max_length:
+                raise ValidationError(f"Folder names cannot be longer than {max_length} characters.")
+
+    with transaction.atomic():
+        folders = Folder.get_or_create_tree(user, parent, trees.values())
+    return {path: folders[names] for path, names in trees.items() if names}
+
+
+def _inspect(upload):
+    try:
+        return inspect_file(upload)
+    except ValidationError as error:
+        return error
+
+
+def _get_taken_names(user, folders, names):
+    """
+    Returns the names of the files of a user in the given folders that are among the given
+    names or may be numbered copies of them, e.g. 'IMG.jpg' and 'IMG (2).jpg'.
+
+    The names are looked up in chunks of TAKEN_NAMES_CHUNK_SIZE, each with one query for the
+    names themselves and prefix matches on their stems, e.g. 'IMG (', for the copies. Other
+    names sharing such a prefix may be returned as well; they are taken all the same.
+
+    Args:
+        user (CustomUser): The owner of the files.
+        folders (iterable): The folders, None standing for the top level.
+        names (iterable): The wanted file names.
+
+    Returns:
+        defaultdict: The set of taken names, keyed by folder id.
+    """
+    folder_ids = {target.pk for target in folders if target is not None}
+    in_targets = Q(folder_id__in=folder_ids)
+    if None in folders:
+        in_targets |= Q(folder__isnull=True)
+
+    taken = defaultdict(set)
+    names = sorted(set(names))
+    for start in range(0, len(names), TAKEN_NAMES_CHUNK_SIZE):
+        chunk = names[start:start + TAKEN_NAMES_CHUNK_SIZE]
+        matching = Q(name__in=chunk)
+        for stem in {os.path.splitext(name)[0] for name in chunk}:
+            matching |= Q(name__startswith=f"{stem} (")
+        rows = (File.all_objects.filter(in_targets, matching, user=user, deleted_at__isnull=True)
+                .values_list("folder_id", "name"))
+        for folder_id, name in rows:
+            taken[folder_id].add(name)
+    return taken
+
+
+def bulk_upload(user, uploads, folder=None):
+    """
+    Stores many uploaded files at once, recreating their directory tree.
+
+    The files are validated and checksummed concurrently on a thread pool, the folders of the
+    tree are looked up or created once each, new contents are written concurrently, and all
+    the rows are inserted with `bulk_create` in a single transaction. Counters that signals
+    maintain for single files are updated with one statement per kind of counter.
+
+    Invalid files are skipped and reported; the others are stored. A name already taken in
+    its folder, by an existing file or by an earlier file of the batch, gets the first free
+    number before its extension, e.g. 'IMG_0001 (2).jpg', as with single uploads. The rows are
+    inserted in a savepoint, and the names allocated again if a concurrent upload took one of
+    them first.
+
+    Args:
+        user (CustomUser): The owner of the files.
+        uploads (list): (relative path, UploadedFile) tuples.
+        folder (Folder, optional): The folder the paths are relative to. Defaults to the top level.
+
+    Returns:
+        BulkUploadResult: The created files, and an error for each skipped file.
+    """
+    errors = []
+    entries = []
+    for relative_path, upload in uploads:
+        folder_names, name = split_path(relative_path, upload.name)
+        try:
+            for folder_name in folder_names:
+                validate_name(folder_name)
+        except ValidationError as error:
+            errors.append(BulkUploadError(relative_path, error.messages[0]))
+            continue
+        entries.append((relative_path or name, folder_names, name, upload))
+    annotate_upload(files=len(entries), size=sum(upload.size for *_, upload in entries))
+
+    with ThreadPoolExecutor(max_workers=BULK_UPLOAD_WORKERS) as pool:
+        with stage("inspect_file"):
+            inspections = list(pool.map(_inspect, [upload for _, _, _, upload in entries]))
+
+        valid = []
+        for entry, inspection in zip(entries, inspections):
+            if isinstance(inspection, ValidationError):
+                errors.append(BulkUploadError(entry[0], inspection.messages[0]))
+            else:
+                valid.append((*entry, inspection))
+
+        if not valid:
+            return BulkUploadResult([], errors)
+
+        with transaction.atomic():
+            folders = Folder.get_or_create_tree(user, folder, [folder_names for _, folder_names, *_ in valid])
+
+            accepted = [(folders[folder_names], name, upload, inspection)
+                        for _, folder_names, name, upload, inspection in valid]
+
+            references = Counter(inspection.checksum for *_, inspection in accepted)
+            contents = {}
+            for _, _, upload, inspection in accepted:
+                contents.setdefault(inspection.checksum, (inspection.size, upload, references[inspection.checksum]))
+            with stage("store"):
+                blobs = Blob.acquire_many(contents, map_func=pool.map)
+
+            max_length = File._meta.get_field("name").max_length
+
+            def insert(attempt):
+                # Looked up again on every attempt, to see the names a concurrent upload took
+                taken = _get_taken_names(user, set(folders.values()), [name for _, name, *_ in accepted])
+                files = []
+                for target, name, _, inspection in accepted:
+                    names = taken[target.pk if target else None]
+                    skip = random.randrange(attempt) if name in names else 0
+                    name = get_free_name(name, names, keep_extension=True, max_length=max_length, skip=skip)
+                    names.add(name)
+                    blob = blobs[inspection.checksum]
+                    file = File(name=name, file=blob.file.name, size=inspection.size, checksum=inspection.checksum,
+                                thumbnail=blob.thumbnail, blob=blob, user=user, folder=target)
+                    file.type = file._choose_file_type(inspection.mime_type)
+                    files.append(file)
+                return File.objects.bulk_create(files)
+
+            with stage("insert"):
+                files = retry_on_conflict(insert)
+
+            _update_counters(user, files)
+            Job.objects.bulk_create([Job(kind="create_thumbnail", payload={"file_id": file.pk})
+                                     for file in files if not file.thumbnail])
+
+    return BulkUploadResult(files, errors)
+
+
+def _update_counters(user, files):
+    """
+    Adds bulk-created files to the storage usage of their owner and to the folder totals, and
+    invalidates the cached listings showing them.
+    """
+    by_type = defaultdict(lambda: [0, 0])
+    for file in files:
+        by_type[file.type][0] += file.size
+        by_type[file.type][1] += 1
+    for file_type, (size, count) in by_type.items():
+        StorageUsage.add(user.pk, file_type, size, count=count)
+
+    amounts = defaultdict(lambda: [0, 0, 0])
+    for file in files:
+        if file.folder is not None:
+            for folder_id in file.folder.get_lineage_ids():
+                amounts[folder_id][0] += file.size
+                amounts[folder_id][1] += 1
+    Folder.add_to_totals(amounts)
+    invalidate_listings(user.pk, {file.folder for file in files})
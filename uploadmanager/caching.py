@@ -0,0 +1,202 @@
+import hashlib
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from .listings import get_listing_page
+from .models import Folder
+from .replicas import use_primary
+
+LISTING_CACHE_TIMEOUT = 24 * 60 * 60  # Entries of old versions are never read again and just expire
+
+_VERSION_KEY = "uploadmanager:listing-version:{user_id}:{folder_id}"
+_PAGE_KEY = "uploadmanager:listing-page:{user_id}:{folder_id}:{version}:{cursor}"
+
+
+def _get_version_key(user_id, folder_id):
+    return _VERSION_KEY.format(user_id=user_id, folder_id=folder_id or "root")
+
+
+def _new_version():
+    # Versions start from the clock, so a version key that was evicted and created again does
+    # not go back to a number whose cached pages may still be around
+    return time.time_ns() // 1000
+
+
+def get_listing_version(user_id, folder_id=None):
+    """
+    Returns the current version of the listing of a folder, or of a user's top level.
+
+    Args:
+        user_id (int): The id of the owner of the folder.
+        folder_id (int, optional): The id of the folder. Defaults to the top level.
+
+    Returns:
+        int: The version, which changes whenever the listing does.
+    """
+    key = _get_version_key(user_id, folder_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_listing_version(user_id, folder_id=None):
+    """
+    Async version of `get_listing_version`.
+    """
+    key = _get_version_key(user_id, folder_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _new_version(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def invalidate_listings(user_id, folders):
+    """
+    Bumps the versions of the listings in which the given folders, or their contents, show up.
+
+    Besides a folder's own listing, the listings of all of its ancestors and of the top level
+    change with it, as they show the recursive totals of the folders leading to it. The
+    versions are bumped once the current transaction has been committed, so a concurrent
+    request cannot cache the old contents under the new version.
+
+    Args:
+        user_id (int): The id of the owner of the folders.
+        folders (iterable): The Folder instances, which only need their id and path; None
+            stands for the top level.
+    """
+    folder_ids = {None}
+    for folder in folders:
+        if folder is not None:
+            folder_ids.update(folder.get_lineage_ids())
+    keys = [_get_version_key(user_id, folder_id) for folder_id in folder_ids]
+    transaction.on_commit(lambda: _bump_versions(keys))
+
+
+def invalidate_file_listings(files):
+    """
+    Invalidates the cached listings showing the files of a queryset, which is about to be
+    updated in bulk without sending signals. The folders involved are read with a single query.
+
+    Must be called in the transaction of the update, or the versions are bumped before it.
+    """
+    folders = defaultdict(set)
+    for user_id, folder_id, path in files.values_list("user_id", "folder_id", "folder__path").distinct():
+        folders[user_id].add(Folder(id=folder_id, path=path) if folder_id else None)
+    for user_id, user_folders in folders.items():
+        invalidate_listings(user_id, user_folders)
+
+
+def _bump_versions(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not cached yet or evicted; nobody can hold pages of the version it will start from
+            cache.add(key, _new_version(), timeout=None)
+
+
+def get_cached_listing_page(user, folder=None, cursor=None):
+    """
+    Returns one page of the listing of a folder from the cache, querying it on a miss.
+
+    The version is read before the page, so a page cached under a version never predates it.
+    For the same reason, missing pages are queried on the primary rather than on a replica,
+    which may not have caught up with the write that bumped the version yet.
+
+    Args:
+        user (CustomUser): The owner of the listed files and folders.
+        folder (Folder, optional): The folder to list. Defaults to the top level.
+        cursor (str, optional): The `next_cursor` of the previous page.
+
+    Returns:
+        tuple: The ListingPage, and the listing version it belongs to.
+    """
+    version = get_listing_version(user.pk, folder.pk if folder else None)
+    key = _PAGE_KEY.format(user_id=user.pk, folder_id=folder.pk if folder else "root", version=version,
+                           cursor=_hash(cursor or ""))
+    page = cache.get(key)
+    if page is None:
+        page = _query_listing_page(user, folder, cursor)
+        cache.set(key, page, LISTING_CACHE_TIMEOUT)
+    return page, version
+
+
+async def aget_cached_listing_page(user, folder=None, cursor=None):
+    """
+    Async version of `get_cached_listing_page`. On a miss, the page is queried in a single
+    hop to the request's sync thread.
+    """
+    version = await aget_listing_version(user.pk, folder.pk if folder else None)
+    key = _PAGE_KEY.format(user_id=user.pk, folder_id=folder.pk if folder else "root", version=version,
+                           cursor=_hash(cursor or ""))
+    page = await cache.aget(key)
+    if page is None:
+        page = await sync_to_async(_query_listing_page)(user, folder, cursor)
+        await cache.aset(key, page, LISTING_CACHE_TIMEOUT)
+    return page, version
+
+
+def _query_listing_page(user, folder, cursor):
+    with use_primary():
+        return get_listing_page(user, folder, cursor=cursor)
+
+
+def get_listing_cache_key(user_id, folder_id, version, cursor):
+    """
+    Returns the key the rendered rows of a listing page are cached under by the template.
+    """
+    return f"{user_id}:{folder_id or 'root'}:{version}:{_hash(cursor or '')}"
+
+
+def get_listing_etag(request, *parts):
+    """
+    Returns the ETag of a listing page rendered for the requesting user from the given parts,
+    e.g. the listing version and the cursor.
+
+    The CSRF secret of the client is part of it too, as the page embeds a token derived from it
+    in its forms. A page rendered before the secret was rotated, e.g. by logging in again, is
+    sent anew rather than revalidated with a token that would be refused. A client without a
+    secret yet gets one here, before the page is rendered, or its first page could never be
+    revalidated.
+    """
+    get_token(request)
+    csrf_secret = request.META["CSRF_COOKIE"]
+    return quote_etag(_hash("|".join(map(str, (request.user.pk, csrf_secret, *parts)))))
+
+
+def get_conditional_listing_response(request, etag):
+    """
+    Returns a 304 Not Modified response if the client already has the listing page, or None.
+
+    Pages carrying flash messages are always sent, as the messages would be lost otherwise.
+    """
+    if len(get_messages(request)):
+        return None
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        set_listing_headers(response, etag)
+    return response
+
+
+def set_listing_headers(response, etag):
+    """
+    Sets the ETag of a listing page, and has browsers revalidate it on every visit.
+    """
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _hash(value):
+    return hashlib.md5(value.encode(), usedforsecurity=False).hexdigest()
@@ -0,0 +1,225 @@
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import invalidate_listings
+from .models import (DEFAULT_THUMBNAIL_PATH, FOLDER_TOTAL_FIELDS, Blob, File, Folder, Job, StorageUsage, UploadChunk,
+                     UploadSession)
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 1000
+PURGE_TIME_BUDGET = 60  # Seconds a purge job may run before handing the rest over to a new job
+
+
+def trash(user, folders=(), files=()):
+    """
+    Deletes folders and files of a user, as far as anybody can see, in a few statements.
+
+    Nothing is removed yet: the folders, their subtrees and the files are only marked as deleted,
+    which hides them, and taken out of the folder totals, and the cached listings showing them
+    are invalidated. Deleted folders and files are also detached from their parent, so their
+    names can be reused right away. A `purge_deleted`
+    job then removes the rows and the stored content in batches, in the background.
+
+    Args:
+        user (CustomUser): The owner of the folders and files.
+        folders (iterable): The Folder instances to delete, with their whole subtrees.
+        files (iterable): The ids of the files to delete.
+
+    Returns:
+        tuple: The number of folders and of files deleted, not counting the contents of the folders.
+    """
+    now = timezone.now()
+    folders = [folder for folder in folders if folder.user_id == user.pk]
+    # Folders inside other deleted folders go away with them
+    folder_ids = {folder.pk for folder in folders}
+    folders = [folder for folder in folders if not folder_ids.intersection(folder.get_ancestor_ids())]
+
+    with transaction.atomic():
+        file_rows = list(File.objects.filter(pk__in=list(files), user=user).values_list("id", "folder_id", "size"))
+        if file_rows:
+            paths = dict(Folder.objects.filter(id__in={folder_id for _, folder_id, _ in file_rows if folder_id})
+                         .values_list("id", "path"))
+            amounts = defaultdict(lambda: [0, 0, 0])
+            for _, folder_id, size in file_rows:
+                if folder_id in paths:
+                    for lineage_id in Folder(id=folder_id, path=paths[folder_id]).get_lineage_ids():
+                        amounts[lineage_id][0] -= size or 0
+                        amounts[lineage_id][1] -= 1
+            File.objects.filter(pk__in=[file_id for file_id, _, _ in file_rows]).update(deleted_at=now, folder=None)
+            Folder.add_to_totals(amounts)
+            invalidate_listings(user.pk, [Folder(id=folder_id, path=path) for folder_id, path in paths.items()])
+
+        for folder in folders:
+            totals = Folder.objects.filter(pk=folder.pk).values(*FOLDER_TOTAL_FIELDS).first()
+            if totals is None:
+                continue
+            Folder.all_objects.filter(path__startswith=folder.subtree_prefix).update(deleted_at=now)
+            Folder.all_objects.filter(pk=folder.pk).update(deleted_at=now, is_parent=None)
+            Folder.shift_totals(folder.get_ancestor_ids(), [], size=totals["total_size"],
+                                files=totals["total_files"], folders=totals["total_folders"] + 1)
+            invalidate_listings(user.pk, [folder])
+
+        if folders or file_rows:
+            Job.enqueue("purge_deleted", user_id=user.pk)
+
+    return len(folders), len(file_rows)
+
+
+def purge_deleted(user_id, batch_size=PURGE_BATCH_SIZE, time_budget=PURGE_TIME_BUDGET):
+    """
+    Removes the deleted folders and files of a user, one batch per transaction.
+
+    Files go first, then folders, deepest first. Each batch is locked with SKIP LOCKED, so
+    several purge jobs for the same user share the work instead of repeating it. Storage usage
+    and blob references are updated with each batch, and the stored content that is no longer
+    referenced is handed to `remove_stored_files` jobs once the batch has been committed.
+
+    Args:
+        user_id (int): The id of the user whose deleted content is removed.
+        batch_size (int): The maximum number of rows removed per transaction.
+        time_budget (float): Seconds after which the rest of the work is left to a new job.
+
+    Returns:
+        bool: True if everything was removed, False if a new job was queued for the rest.
+    """
+    deadline = time.monotonic() + time_budget
+    while _purge_batch(user_id, batch_size):
+        if time.monotonic() > deadline:
+            Job.enqueue("purge_deleted", user_id=user_id)
+            return False
+    return True
+
+
+def _purge_batch(user_id, batch_size):
+    """
+    Removes one batch of deleted files, or of deleted folders once no files are left.
+
+    Returns:
+        bool: Whether anything was removed.
+    """
+    with transaction.atomic():
+        deleted_folders = Folder.all_objects.filter(_in_trash_of(user_id), deleted_at__isnull=False)
+        files = list(
+            File.all_objects.select_for_update(skip_locked=True)
+            .filter(Q(deleted_at__isnull=False, user_id=user_id) | Q(folder__in=deleted_folders))
+            .values_list("id", "user_id", "type", "size", "blob_id", "file", "thumbnail")[:batch_size]
+        )
+        if files:
+            _remove_files(files)
+            return True
+
+        folder_ids = list(
+            deleted_folders.select_for_update(skip_locked=True)
+            .order_by("-depth")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if folder_ids:
+            _remove_folders(folder_ids)
+            return True
+
+    return False
+
+
+def _in_trash_of(user_id):
+    """
+    Returns the condition matching the deleted folders of a user, and every folder inside the
+    folders the user deleted, including those of other users.
+
+    Folders are looked up by slug when uploading or creating folders, so other users may have
+    added rows to a folder of the user; they go with it, or removing it would violate their
+    foreign keys.
+    """
+    condition = Q(user_id=user_id)
+    # The folders the user deleted themselves, rather than along with a parent, are detached
+    deleted_roots = Folder.all_objects.filter(user_id=user_id, deleted_at__isnull=False, is_parent__isnull=True)
+    for folder in deleted_roots.only("id", "path"):
+        condition |= Q(path__startswith=folder.subtree_prefix)
+    return condition
+
+
+def _remove_files(files):
+    """
+    Deletes a batch of file rows with plain SQL and takes them out of the storage usage of
+    their owners.
+    """
+    file_ids = [file_id for file_id, *_ in files]
+    names = []
+
+    UploadSession.objects.filter(file_id__in=file_ids).update(file=None)
+    _raw_delete(File.all_objects.filter(pk__in=file_ids))
+
+    usage = defaultdict(lambda: [0, 0])
+    references = Counter()
+    for _, owner_id, file_type, size, blob_id, file, thumbnail in files:
+        usage[owner_id, file_type][0] += size or 0
+        usage[owner_id, file_type][1] += 1
+        if blob_id:
+            references[blob_id] += 1
+        else:
+            # Files stored before blobs existed own their content
+            names.extend(name for name in (file, thumbnail) if name)
+
+    for (owner_id, file_type), (size, count) in usage.items():
+        StorageUsage.add(owner_id, file_type, -size, count=-count)
+    names += Blob.release_many(references)
+
+    if names:
+        Job.enqueue("remove_stored_files", names=names)
+
+
+def _remove_folders(folder_ids):
+    """
+    Deletes a batch of folder rows, and the upload sessions started in them, with plain SQL.
+    """
+    sessions = list(UploadSession.objects.filter(folder_id__in=folder_ids))
+    _raw_delete(UploadChunk.objects.filter(session__in=sessions))
+    _raw_delete(UploadSession.objects.filter(pk__in=[session.pk for session in sessions]))
+    _raw_delete(Folder.all_objects.filter(pk__in=folder_ids))
+
+    staging_names = [os.path.relpath(session.staging_path, settings.MEDIA_ROOT) for session in sessions]
+    if staging_names:
+        Job.enqueue("remove_stored_files", names=staging_names)
+
+
+def _raw_delete(queryset):
+    """
+    Deletes the rows of a queryset with a single DELETE, without fetching them and without
+    sending signals; the callers keep the counters up to date themselves.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def remove_stored_files(names):
+    """
+    Removes files from the media storage, ignoring those that are already gone and the shared
+    default thumbnail.
+
+    Args:
+        names (list): The storage names of the files, relative to MEDIA_ROOT.
+
+    Raises:
+        OSError: If some files could not be removed, after trying all of them. The job queue
+            then retries the job later.
+    """
+    failed = []
+    for name in names:
+        if name == DEFAULT_THUMBNAIL_PATH:
+            continue
+        try:
+            os.remove(os.path.join(settings.MEDIA_ROOT, name))
+        except FileNotFoundError:
+            pass
+        except OSError as error:
+            logger.warning(f"Could not remove {name}: {error}")
+            failed.append(name)
+
+    if failed:
+        raise OSError(f"Could not remove {len(failed)} of {len(names)} files: {', '.join(failed[:10])}")
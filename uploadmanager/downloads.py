@@ -0,0 +1,265 @@
+import io
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import get_random_string
+from django.utils.http import http_date, quote_etag
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 16  # Requests asking for more ranges than this get the whole file
+
+_range_re = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+class FileRange(io.RawIOBase):
+    """
+    A read-only view of a byte range of an open file.
+
+    It keeps the underlying file descriptor, so a WSGI server implementing `wsgi.file_wrapper`
+    with sendfile (such as gunicorn) still copies the range in the kernel: the descriptor is
+    positioned at the start of the range and the response's Content-Length bounds the copy.
+    Servers without sendfile fall back to the bounded `read`.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.start = start
+        self.length = length
+        self.position = 0
+        self.file.seek(start)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        self.position = min(max(offset, 0), self.length)
+        self.file.seek(self.start + self.position)
+        return self.position
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self.file.read(size)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def parse_range_header(header, size):
+    """
+    Parses an HTTP Range header into a list of byte ranges.
+
+    Args:
+        header (str): The value of the Range header, e.g. 'bytes=0-499,-500'.
+        size (int): The size of the file in bytes.
+
+    Returns:
+        list: (start, end) tuples with inclusive ends, an empty list if no range can be satisfied,
+            or None if the header is absent, malformed or asks for too many ranges, in which case
+            the whole file should be sent.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+
+    specs = header[len("bytes="):].split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        match = _range_re.match(spec)
+        if not match or match.groups() == ("", ""):
+            return None
+        first, last = match.groups()
+        if first == "":
+            # A suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        if start < size:
+            ranges.append((start, end))
+    return ranges
+
+
+async def iterate_in_thread(iterable, thread_sensitive=False):
+    """
+    Turns a blocking iterator, such as one reading a file, into an async iterator producing
+    each item in a worker thread.
+
+    Under ASGI, Django consumes synchronous streaming responses by loading them whole into
+    memory, so streamed bodies are handed to it through this instead.
+
+    Args:
+        iterable (iterable): The blocking iterable.
+        thread_sensitive (bool): Whether the items must be produced in the request's sync
+            thread, e.g. because the iterator reads from the database.
+
+    Yields:
+        The items of the iterable.
+    """
+    iterator = iter(iterable)
+    get_next = sync_to_async(next, thread_sensitive=thread_sensitive)
+    done = object()
+    try:
+        while (item := await get_next(iterator, done)) is not done:
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            await sync_to_async(close, thread_sensitive=thread_sensitive)()
+
+
+def serve_file(request, path, name, etag=None, as_attachment=False, asynchronous=False):
+    """
+    Builds the response serving a stored file to an already authorized user.
+
+    If DOWNLOAD_OFFLOAD is configured, only headers are returned and the front proxy sends the
+    bytes ('x-accel-redirect' for nginx, 'x-sendfile' for Apache/lighttpd). Otherwise the file is
+    streamed from Python with support for conditional requests (ETag, If-None-Match, Last-Modified,
+    If-Range) and single- or multi-range requests. Only WSGI servers with a sendfile-based
+    `wsgi.file_wrapper` then copy the file in the kernel; asynchronous responses are read in
+    Python, so ASGI deployments should offload the transfer.
+
+    Args:
+        request (HttpRequest): The request.
+        path (str): The absolute path of the file on disk.
+        name (str): The file name presented to the client.
+        etag (str, optional): A strong validator for the content, such as its checksum.
+        as_attachment (bool): Whether the browser should save the file instead of displaying it.
+        asynchronous (bool): Whether the body is streamed by an async iterator reading the file
+            in a worker thread, for async views.
+
+    Returns:
+        HttpResponse: The response.
+    """
+    stat = os.stat(path)
+    last_modified = int(stat.st_mtime)
+    etag = quote_etag(etag or f"{stat.st_size:x}-{last_modified:x}")
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    offload = getattr(settings, "DOWNLOAD_OFFLOAD", "")
+    if offload:
+        response = HttpResponse(content_type=content_type)
+        relative_path = os.path.relpath(path, settings.MEDIA_ROOT)
+        if offload == "x-accel-redirect":
+            response["X-Accel-Redirect"] = quote(settings.DOWNLOAD_ACCEL_PREFIX + relative_path)
+        else:
+            response["X-Sendfile"] = path
+    else:
+        response = _stream_file(request, path, stat.st_size, content_type, etag, last_modified, asynchronous)
+
+    disposition = "attachment" if as_attachment else "inline"
+    response["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{quote(name)}"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = "private, max-age=0, must-revalidate"
+    return response
+
+
+def _stream_file(request, path, size, content_type, etag, last_modified, asynchronous=False):
+    ranges = parse_range_header(request.headers.get("Range"), size)
+
+    # A Range is only honoured if the client's copy is still current
+    if_range = request.headers.get("If-Range")
+    if ranges is not None and if_range and if_range not in (etag, http_date(last_modified)):
+        ranges = None
+
+    if ranges is None:
+        response = _file_response(open(path, "rb"), size, content_type, asynchronous)
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    if not ranges:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = _file_response(FileRange(open(path, "rb"), start, end - start + 1), end - start + 1, content_type,
+                                  asynchronous)
+        response.status_code = 206
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    boundary = get_random_string(32)
+    parts = [
+        (
+            f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n".encode(),
+            start,
+            end,
+        )
+        for start, end in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+
+    body = _multipart_ranges(path, parts, closing)
+    response = StreamingHttpResponse(iterate_in_thread(body) if asynchronous else body, status=206,
+                                     content_type=f"multipart/byteranges; boundary={boundary}")
+    response["Content-Length"] = sum(len(header) + end - start + 1 for header, start, end in parts) + len(closing)
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def _file_response(file, length, content_type, asynchronous):
+    if not asynchronous:
+        return FileResponse(file, content_type=content_type)
+    response = StreamingHttpResponse(iterate_in_thread(_read_blocks(file)), content_type=content_type)
+    response["Content-Length"] = length
+    return response
+
+
+def _read_blocks(file):
+    with file:
+        while block := file.read(DOWNLOAD_CHUNK_SIZE):
+            yield block
+
+
+def _multipart_ranges(path, parts, closing):
+    with open(path, "rb") as file:
+        for header, start, end in parts:
+            yield header
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        yield closing
@@ -0,0 +1,175 @@
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import deletion
+from .caching import invalidate_file_listings
+from .metrics import record_job
+from .models import DEFAULT_THUMBNAIL_PATH, File, Job
+from .profiling import trace_upload
+
+logger = logging.getLogger(__name__)
+
+JOB_LEASE_TIMEOUT = 10 * 60  # Seconds before a running job is considered abandoned by a dead worker
+
+_handlers = {}
+
+
+def register(kind, on_failure=None):
+    """
+    Decorator registering a function as the handler for a job kind.
+
+    Args:
+        kind (str): The job kind handled by the decorated function.
+        on_failure (callable, optional): Called with the job payload once the job has used up all its attempts.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(func):
+        _handlers[kind] = (func, on_failure)
+        return func
+
+    return decorator
+
+
+def get_worker_id():
+    """
+    Returns an identifier for the current worker process, used to mark claimed jobs.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_jobs(worker_id, limit):
+    """
+    Claims up to `limit` runnable jobs for a worker.
+
+    Rows locked by other workers are skipped rather than waited on, so several workers can
+    poll the same queue without blocking each other. Jobs left running by a worker that died
+    are picked up again once their lease has expired.
+
+    Args:
+        worker_id (str): The identifier of the claiming worker.
+        limit (int): The maximum number of jobs to claim.
+
+    Returns:
+        list: The ids of the claimed jobs.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=JOB_LEASE_TIMEOUT)
+
+    with transaction.atomic():
+        job_ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=Job.PENDING, run_at__lte=now) | Q(status=Job.RUNNING, locked_at__lt=stale))
+            .order_by("run_at")
+            .values_list("id", flat=True)[:limit]
+        )
+        Job.objects.filter(id__in=job_ids).update(status=Job.RUNNING, locked_by=worker_id, locked_at=now)
+
+    return job_ids
+
+
+def run_job(job_id):
+    """
+    Runs a claimed job and records its outcome.
+
+    A failing job is put back in the queue with an exponential backoff until it reaches
+    its maximum number of attempts, after which it is marked as failed.
+
+    Args:
+        job_id (int): The id of the job to run.
+
+    Returns:
+        str: The final status of the job.
+    """
+    job = Job.objects.get(id=job_id)
+    job.attempts += 1
+
+    try:
+        handler, on_failure = _handlers[job.kind]
+    except KeyError:
+        handler, on_failure = None, None
+
+    start = time.perf_counter()
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        handler(**job.payload)
+    except Exception as error:
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.PENDING
+            job.run_at = timezone.now() + job.get_retry_delay()
+            logger.warning(f"Job {job} failed on attempt {job.attempts}, retrying at {job.run_at}: {error}")
+        else:
+            job.status = Job.FAILED
+            logger.error(f"Job {job} failed permanently after {job.attempts} attempts: {error}")
+            if on_failure:
+                on_failure(**job.payload)
+    else:
+        job.status = Job.DONE
+        job.last_error = ""
+
+    record_job(job.kind, job.status, time.perf_counter() - start)
+    job.locked_by = ""
+    job.locked_at = None
+    job.save(update_fields=["attempts", "status", "run_at", "last_error", "locked_by", "locked_at", "updated_at"])
+    return job.status
+
+
+def _use_default_thumbnail(file_id):
+    files = File.objects.filter(Q(thumbnail="") | Q(thumbnail__isnull=True), id=file_id)
+    # In a transaction, so the listing versions are only bumped once the update is committed
+    with transaction.atomic():
+        invalidate_file_listings(files)
+        files.update(thumbnail=DEFAULT_THUMBNAIL_PATH)
+
+
+@register("create_thumbnail", on_failure=_use_default_thumbnail)
+def create_thumbnail(file_id):
+    """
+    Gives an uploaded file a thumbnail, unless it was deleted or already has one.
+
+    The thumbnail is generated once per blob and shared by every file with the same content.
+    Its creation is traced by the upload profiling, as the last stage of the upload.
+    """
+    file = File.objects.select_related("blob").filter(id=file_id).first()
+    if file is None or file.thumbnail:
+        return
+
+    if file.blob is None:
+        with trace_upload("thumbnail", file_id=file_id, type=file.type, size=file.size):
+            file._create_thumbnail()
+        return
+
+    if not file.blob.thumbnail:
+        with trace_upload("thumbnail", file_id=file_id, type=file.type, size=file.size):
+            file.blob._create_thumbnail()
+    files = File.objects.filter(Q(thumbnail="") | Q(thumbnail__isnull=True), blob=file.blob)
+    with transaction.atomic():
+        invalidate_file_listings(files)
+        files.update(thumbnail=file.blob.thumbnail.name)
+
+
+@register("purge_deleted")
+def purge_deleted(user_id):
+    """
+    Removes the folders and files a user has deleted, in batches.
+    """
+    deletion.purge_deleted(user_id)
+
+
+@register("remove_stored_files")
+def remove_stored_files(names):
+    """
+    Removes content that is no longer referenced from the media storage.
+    """
+    deletion.remove_stored_files(names)
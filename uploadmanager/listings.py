@@ -0,0 +1,108 @@
+import base64
+import binascii
+from collections import namedtuple
+from datetime import datetime
+
+from django.db.models import Q
+
+from .models import File, Folder
+
+LISTING_PAGE_SIZE = 100
+
+# Only the columns shown in a listing row are fetched
+FOLDER_LISTING_FIELDS = ("id", "name", "slug", "user_id", "is_parent_id", "total_size", "total_files", "total_folders",
+                         "created_at")
+FILE_LISTING_FIELDS = ("id", "name", "type", "size", "thumbnail", "user_id", "folder_id", "created_at")
+
+ListingPage = namedtuple("ListingPage", ["folders", "files", "next_cursor"])
+
+
+def encode_cursor(kind, created_at, pk):
+    """
+    Encodes the position of the last row of a page into an opaque cursor string.
+
+    Args:
+        kind (str): 'folder' or 'file'.
+        created_at (datetime): The creation time of the row.
+        pk (int): The id of the row.
+
+    Returns:
+        str: The URL-safe cursor.
+    """
+    raw = f"{kind}|{created_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor produced by `encode_cursor`.
+
+    Returns:
+        tuple: (kind, created_at, pk), or None if the cursor is missing or invalid.
+    """
+    if not cursor:
+        return None
+    try:
+        kind, created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if kind not in ("folder", "file"):
+            return None
+        return kind, datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+
+def _after(queryset, created_at, pk):
+    """
+    Restricts a queryset ordered by (-created_at, -id) to the rows after the given position.
+    """
+    return queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+
+def get_listing_page(user, folder=None, cursor=None, page_size=LISTING_PAGE_SIZE):
+    """
+    Returns one page of the contents of a folder, or of the user's top level.
+
+    Subfolders come first, then files, each newest first. Pages are addressed by a keyset
+    cursor on (created_at, id) instead of an offset, so every page is read straight off the
+    (user, parent, created_at, id) indexes and costs the same however deep it is.
+
+    Args:
+        user (CustomUser): The owner of the listed files and folders.
+        folder (Folder, optional): The folder to list. Defaults to the top level.
+        cursor (str, optional): The `next_cursor` of the previous page.
+        page_size (int): The maximum number of rows on the page.
+
+    Returns:
+        ListingPage: The folders and files on the page, and the cursor of the next page, if any.
+    """
+    position = decode_cursor(cursor)
+
+    folders = Folder.objects.filter(user=user, is_parent=folder).only(*FOLDER_LISTING_FIELDS).order_by(
+        "-created_at", "-id")
+    files = File.objects.filter(user=user, folder=folder).only(*FILE_LISTING_FIELDS).order_by("-created_at", "-id")
+
+    page_folders = []
+    if position is None or position[0] == "folder":
+        if position is not None:
+            folders = _after(folders, position[1], position[2])
+        page_folders = list(folders[:page_size + 1])
+        if len(page_folders) > page_size:
+            last = page_folders[page_size - 1]
+            return ListingPage(page_folders[:page_size], [], encode_cursor("folder", last.created_at, last.id))
+
+    if position is not None and position[0] == "file":
+        files = _after(files, position[1], position[2])
+    remaining = page_size - len(page_folders)
+    page_files = list(files[:remaining + 1])
+
+    next_cursor = None
+    if len(page_files) > remaining:
+        page_files = page_files[:remaining]
+        if page_files:
+            last = page_files[-1]
+            next_cursor = encode_cursor("file", last.created_at, last.id)
+        else:
+            last = page_folders[-1]
+            next_cursor = encode_cursor("folder", last.created_at, last.id)
+
+    return ListingPage(page_folders, page_files, next_cursor)
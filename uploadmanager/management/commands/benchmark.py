@@ -0,0 +1,109 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from uploadmanager.benchmark import (BENCHMARK_PASSWORD, ENDPOINTS, Benchmark, BenchmarkError, compare_reports,
+                                     delete_dataset, seed_dataset)
+
+
+class Command(BaseCommand):
+    """
+    Management command seeding a synthetic dataset and benchmarking the main endpoints against it.
+
+    `seed` adds benchmark users with deep folder trees and many files, `run` drives the home,
+    folder, search and upload endpoints with concurrent clients and reports latency
+    percentiles, throughput and query counts per endpoint as JSON, and `reset` removes the
+    benchmark users and everything they own. Everything runs offline against the configured
+    database. A report can be compared with an earlier one to catch regressions.
+
+    Usage:
+        python manage.py benchmark seed --users 10 --folders 500 --depth 10 --files 1000000
+        python manage.py benchmark run --concurrency 16 --duration 30 --output report.json
+        python manage.py benchmark run --compare baseline.json --threshold 0.2
+        python manage.py benchmark run --url http://localhost:8000
+        python manage.py benchmark reset
+    """
+    help = "Seeds synthetic data and benchmarks the listing, search and upload endpoints."
+
+    def add_arguments(self, parser):
+        actions = parser.add_subparsers(dest="action", required=True)
+
+        seed = actions.add_parser("seed", help="Add benchmark users, folders and files.")
+        seed.add_argument("--users", type=int, default=10, help="Number of users to add.")
+        seed.add_argument("--folders", type=int, default=200, help="Number of folders per user.")
+        seed.add_argument("--depth", type=int, default=8, help="Number of levels the folders are spread over.")
+        seed.add_argument("--files", type=int, default=100_000, help="Total number of files, shared by the users.")
+        seed.add_argument("--images", type=int, default=4, help="Number of generated image fixtures.")
+        seed.add_argument("--videos", type=int, default=2, help="Number of generated video fixtures.")
+        seed.add_argument("--password", default=BENCHMARK_PASSWORD, help="Password of the users.")
+        seed.add_argument("--seed", type=int, default=0, help="Seed of the random generator.")
+        seed.add_argument("--reset", action="store_true", help="Remove the existing benchmark users first.")
+
+        run = actions.add_parser("run", help="Drive the endpoints and report the measurements as JSON.")
+        run.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS),
+                         help="Endpoints to benchmark.")
+        run.add_argument("--concurrency", type=int, default=8, help="Number of concurrent clients.")
+        run.add_argument("--duration", type=float, default=10, help="Seconds each endpoint is driven for.")
+        run.add_argument("--requests", type=int, help="Stop an endpoint after this many requests.")
+        run.add_argument("--warmup", type=int, default=2, help="Unmeasured requests each client sends first.")
+        run.add_argument("--url", dest="base_url",
+                         help="Send the requests to a running server, e.g. http://localhost:8000, instead of "
+                              "through the test client in this process. Queries are not counted then.")
+        run.add_argument("--password", default=BENCHMARK_PASSWORD, help="Password of the benchmark users.")
+        run.add_argument("--no-cache", action="store_true",
+                         help="Disable the listing cache, as on a cold cache. Only applies in process.")
+        run.add_argument("--seed", type=int, default=0, help="Seed of the random generator.")
+        run.add_argument("--output", help="Write the report to this file instead of the standard output.")
+        run.add_argument("--compare", help="A previous report to compare with; fails on regressions.")
+        run.add_argument("--threshold", type=float, default=0.2,
+                         help="Relative change in p95 latency or throughput counted as a regression.")
+
+        actions.add_parser("reset", help="Remove the benchmark users and everything they own.")
+
+    def handle(self, *args, **options):
+        getattr(self, f"handle_{options['action']}")(options)
+
+    def handle_seed(self, options):
+        if options["reset"]:
+            self.stderr.write(f"Removed {delete_dataset()} benchmark users")
+        created = seed_dataset(
+            users=options["users"], folders=options["folders"], depth=options["depth"], files=options["files"],
+            images=options["images"], videos=options["videos"], password=options["password"], seed=options["seed"],
+            log=self.stderr.write,
+        )
+        self.stderr.write(self.style.SUCCESS(
+            f"Seeded {created['users']} users, {created['folders']} folders and {created['files']} files."))
+
+    def handle_run(self, options):
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        benchmark = Benchmark(
+            endpoints=options["endpoints"], concurrency=options["concurrency"], duration=options["duration"],
+            requests=options["requests"], warmup=options["warmup"], base_url=options["base_url"],
+            password=options["password"], use_cache=not options["no_cache"], seed=options["seed"],
+        )
+        try:
+            report = benchmark.run(log=self.stderr.write)
+        except BenchmarkError as error:
+            raise CommandError(error)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            lines, regressions = compare_reports(baseline, report, threshold=options["threshold"])
+            for line in lines:
+                self.stderr.write(line)
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stderr.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def handle_reset(self, options):
+        self.stderr.write(self.style.SUCCESS(f"Removed {delete_dataset()} benchmark users."))
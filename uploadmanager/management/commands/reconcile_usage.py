@@ -0,0 +1,67 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from uploadmanager.models import File, StorageUsage
+
+
+class Command(BaseCommand):
+    """
+    Management command recomputing the storage usage counters of users from their files.
+
+    The counters are normally kept up to date incrementally; this repairs any drift, e.g. after
+    files were changed directly in the database. Each user's usage row is locked while it is
+    recomputed, so uploads and deletes running at the same time are not lost. Files in the trash
+    still count until they are purged, as the purge is what takes them out of the counters.
+
+    Usage:
+        python manage.py reconcile_usage [--user-id 42] [--dry-run]
+    """
+    help = "Recomputes the per-user storage usage counters from the stored files."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user-id", type=int, action="append", dest="user_ids",
+                            help="Only reconcile the given user. Can be repeated.")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Report the drift without fixing it.")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by("pk")
+        if options["user_ids"]:
+            users = users.filter(pk__in=options["user_ids"])
+
+        fixed = 0
+        for user_id in users.values_list("pk", flat=True).iterator():
+            with transaction.atomic():
+                StorageUsage.objects.get_or_create(user_id=user_id)
+                usage = StorageUsage.objects.select_for_update().get(user_id=user_id)
+                actual = self.get_actual_usage(user_id)
+
+                drift = {field: value for field, value in actual.items() if getattr(usage, field) != value}
+                if not drift:
+                    continue
+
+                fixed += 1
+                self.stdout.write(f"User {user_id}: " + ", ".join(
+                    f"{field} {getattr(usage, field)} -> {value}" for field, value in drift.items()))
+                if not options["dry_run"]:
+                    StorageUsage.objects.filter(user_id=user_id).update(**actual)
+
+        verb = "would be fixed" if options["dry_run"] else "fixed"
+        self.stdout.write(self.style.SUCCESS(f"{fixed} usage record(s) {verb}."))
+
+    @staticmethod
+    def get_actual_usage(user_id):
+        """
+        Returns the usage counters of a user computed from their files with a single query,
+        including the deleted files that have not been purged yet.
+        """
+        return File.all_objects.filter(user_id=user_id).aggregate(
+            bytes_used=Sum("size", default=0),
+            file_count=Count("id"),
+            image_bytes=Sum("size", filter=Q(type="image"), default=0),
+            image_count=Count("id", filter=Q(type="image")),
+            video_bytes=Sum("size", filter=Q(type="video"), default=0),
+            video_count=Count("id", filter=Q(type="video")),
+        )
@@ -0,0 +1,59 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+
+from uploadmanager.jobs import claim_jobs, get_worker_id, run_job
+
+
+class Command(BaseCommand):
+    """
+    Management command running background jobs from the database queue.
+
+    Jobs are claimed with `SELECT ... FOR UPDATE SKIP LOCKED` and executed on a process pool,
+    so the command can be started on as many nodes as needed against the same database.
+
+    Usage:
+        python manage.py runjobs --concurrency 4
+    """
+    help = "Runs queued background jobs such as thumbnail generation."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=multiprocessing.cpu_count(),
+                            help="Number of jobs to run in parallel.")
+        parser.add_argument("--poll-interval", type=float, default=1.0,
+                            help="Seconds to wait between polls when the queue is empty.")
+        parser.add_argument("--burst", action="store_true",
+                            help="Exit once the queue is empty instead of polling forever.")
+
+    def handle(self, *args, **options):
+        concurrency = max(options["concurrency"], 1)
+        poll_interval = options["poll_interval"]
+        worker_id = get_worker_id()
+        in_flight = set()
+
+        self.stdout.write(f"Worker {worker_id} running jobs with concurrency {concurrency}")
+
+        # Spawned (rather than forked) children never share the parent's database connection.
+        with ProcessPoolExecutor(max_workers=concurrency, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=django.setup) as pool:
+            while True:
+                free_slots = concurrency - len(in_flight)
+                if free_slots:
+                    for job_id in claim_jobs(worker_id, free_slots):
+                        in_flight.add(pool.submit(run_job, job_id))
+
+                if not in_flight:
+                    if options["burst"]:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                done, in_flight = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        future.result()
+                    except Exception as error:
+                        self.stderr.write(f"Job crashed the worker process: {error}")
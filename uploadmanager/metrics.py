@@ -0,0 +1,228 @@
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views import View
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest,
+                               multiprocess)
+
+# Metrics are written to memory-mapped files in this directory when it is set, so the values
+# of every web and job worker process are added up when /metrics is scraped from any of them.
+# It must be set before the first import of prometheus_client, i.e. in the environment.
+MULTIPROCESS_DIR_VARIABLE = "PROMETHEUS_MULTIPROC_DIR"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233)
+THROUGHPUT_BUCKETS = tuple(2 ** exponent for exponent in range(16, 32, 2))  # 64 KB/s to 1 GB/s
+KNOWN_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+REQUEST_DURATION = Histogram(
+    "uploadmanager_request_duration_seconds", "Time to produce the response of a request, by URL name.",
+    ["view", "method"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter(
+    "uploadmanager_requests", "Requests handled, by URL name and status code.", ["view", "method", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "uploadmanager_request_queries", "Database queries run per request, by URL name.",
+    ["view"], buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_QUERY_DURATION = Histogram(
+    "uploadmanager_request_query_duration_seconds", "Time spent in database queries per request, by URL name.",
+    ["view"], buckets=LATENCY_BUCKETS,
+)
+UPLOAD_BYTES = Counter(
+    "uploadmanager_upload_bytes", "Bytes of file content received, by kind of upload.", ["kind"],
+)
+UPLOAD_THROUGHPUT = Histogram(
+    "uploadmanager_upload_throughput_bytes_per_second", "Rate at which uploads were received, by kind of upload.",
+    ["kind"], buckets=THROUGHPUT_BUCKETS,
+)
+UPLOAD_STAGE_DURATION = Histogram(
+    "uploadmanager_upload_stage_duration_seconds", "Wall time of the stages of profiled uploads, by kind and stage.",
+    ["kind", "stage"], buckets=LATENCY_BUCKETS,
+)
+JOB_DURATION = Histogram(
+    "uploadmanager_job_duration_seconds", "Time to run a background job, by kind and outcome.",
+    ["kind", "status"], buckets=LATENCY_BUCKETS,
+)
+
+# The database activity of the request being handled. Context variables are copied into the
+# threads sync_to_async runs code in, so queries of async views are counted as well.
+_request_stats = ContextVar("uploadmanager_request_stats", default=None)
+
+
+class RequestStats:
+    """
+    The number of queries a request has run, and the time they took.
+    """
+    __slots__ = ("request", "queries", "query_seconds")
+
+    def __init__(self, request):
+        self.request = request
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+def get_view_name(request):
+    """
+    Returns the name of the URL pattern a request matched, or '<unresolved>' before it is resolved.
+    """
+    resolver_match = getattr(request, "resolver_match", None)
+    return resolver_match.view_name if resolver_match else "<unresolved>"
+
+
+def get_current_view_name():
+    """
+    Returns the name of the URL pattern of the request being handled, or '' outside of requests.
+    """
+    stats = _request_stats.get()
+    return get_view_name(stats.request) if stats is not None else ""
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding every query to the stats of the current request, if any.
+    """
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - start
+
+
+def install_query_timer(connection):
+    """
+    Installs `time_query` on a database connection, once.
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class MetricsMiddleware:
+    """
+    Middleware recording the latency, status and database queries of every request, labelled
+    with the name of the URL pattern it matched rather than its path, so label values stay few.
+
+    It should come first in MIDDLEWARE, to time the other middleware too. The latency runs up
+    to the response being returned; the bodies of streaming responses are sent afterwards.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, start = RequestStats(request), time.perf_counter()
+        token = _request_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        record_request(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats, start = RequestStats(request), time.perf_counter()
+        token = _request_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        record_request(request, response, stats, time.perf_counter() - start)
+        return response
+
+
+def record_request(request, response, stats, seconds):
+    """
+    Records the metrics of a handled request.
+    """
+    view = get_view_name(request)
+    method = request.method if request.method in KNOWN_METHODS else "other"
+    REQUEST_DURATION.labels(view, method).observe(seconds)
+    REQUESTS.labels(view, method, str(response.status_code)).inc()
+    REQUEST_QUERIES.labels(view).observe(stats.queries)
+    REQUEST_QUERY_DURATION.labels(view).observe(stats.query_seconds)
+
+
+def record_upload(kind, size, seconds):
+    """
+    Records received file content.
+
+    Args:
+        kind (str): 'multipart' for form and bulk uploads, 'chunked' for resumable uploads.
+        size (int): The number of bytes received.
+        seconds (float): The time it took to receive and store them.
+    """
+    UPLOAD_BYTES.labels(kind).inc(size)
+    if size and seconds > 0:
+        UPLOAD_THROUGHPUT.labels(kind).observe(size / seconds)
+
+
+def record_job(kind, status, seconds):
+    """
+    Records the run of a background job, e.g. a thumbnail being created.
+    """
+    JOB_DURATION.labels(kind, status).observe(seconds)
+
+
+def record_upload_trace(record):
+    """
+    Upload profiling hook recording the wall time of each stage of a profiled upload.
+    """
+    for stage in record["stages"]:
+        UPLOAD_STAGE_DURATION.labels(record["kind"], stage["stage"]).observe(stage["wall_ms"] / 1000)
+
+
+def get_registry():
+    """
+    Returns the registry to export: the values of all processes in multiprocess mode, or those
+    of this process otherwise.
+    """
+    if not os.environ.get(MULTIPROCESS_DIR_VARIABLE):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def mark_process_dead(pid):
+    """
+    Removes the files of the live gauges of an exited process from the multiprocess directory,
+    so they are no longer exported. Its counters and histograms are kept, as their values still
+    count towards the totals. Does nothing outside of multiprocess mode.
+
+    Args:
+        pid (int): The id of the process that exited.
+    """
+    if os.environ.get(MULTIPROCESS_DIR_VARIABLE):
+        multiprocess.mark_process_dead(pid)
+
+
+class MetricsView(View):
+    """
+    Exports the metrics in the Prometheus text format.
+
+    GET request:
+        - If METRICS_TOKEN is set, expects it in an 'Authorization: Bearer <token>' header.
+    """
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if token and not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return HttpResponse("Unauthorized", status=401, content_type="text/plain")
+        return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploadmanager', '0006_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='checksum',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:12
+
+import django.db.models.deletion
+import uploadmanager.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploadmanager', '0007_file_checksum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(max_length=255, upload_to=uploadmanager.models.blob_upload_to)),
+                ('size', models.BigIntegerField()),
+                ('thumbnail', models.ImageField(blank=True, max_length=255, null=True, upload_to='thumbnails/')),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            bases=(uploadmanager.models.ThumbnailMixin, models.Model),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='files', to='uploadmanager.blob'),
+        ),
+    ]
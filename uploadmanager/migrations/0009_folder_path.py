@@ -0,0 +1,49 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_folder_paths(apps, schema_editor):
+    """
+    Fills in the materialized path of existing folders, one tree level at a time.
+    """
+    Folder = apps.get_model('uploadmanager', 'Folder')
+
+    level = [(folder_id, '/') for folder_id in Folder.objects.filter(is_parent__isnull=True).values_list('id', flat=True)]
+    depth = 0
+    while level:
+        depth += 1
+        next_level = []
+        for parent_id, parent_path in level:
+            path = f"{parent_path}{parent_id}/"
+            children = Folder.objects.filter(is_parent_id=parent_id)
+            children.update(path=path, depth=depth)
+            next_level.extend((child_id, path) for child_id in children.values_list('id', flat=True))
+        level = next_level
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploadmanager', '0008_blob_file_blob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(default='/', editable=False, max_length=1024),
+        ),
+        migrations.RunPython(populate_folder_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['path'], name='folder_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
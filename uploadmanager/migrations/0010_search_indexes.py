@@ -0,0 +1,46 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:14
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploadmanager', '0009_folder_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='file',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector(models.Func(models.F('name'), models.Value('[\\W_]+'), models.Value(' '), models.Value('g'), function='regexp_replace'), config='simple'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector(models.Func(models.F('name'), models.Value('[\\W_]+'), models.Value(' '), models.Value('g'), function='regexp_replace'), config='simple'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='file_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='file_name_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='folder_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='folder_name_trgm_idx'),
+        ),
+    ]
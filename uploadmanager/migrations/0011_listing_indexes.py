@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploadmanager', '0010_search_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['user', 'folder', '-created_at', '-id'], name='file_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['user', 'is_parent', '-created_at', '-id'], name='folder_listing_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def populate_storage_usage(apps, schema_editor):
+    """
+    Computes the usage counters of every user who already has files, with a single query.
+    """
+    File = apps.get_model('uploadmanager', 'File')
+    StorageUsage = apps.get_model('uploadmanager', 'StorageUsage')
+
+    totals = File.objects.values('user_id').annotate(
+        bytes_used=Sum('size', default=0),
+        file_count=Count('id'),
+        image_bytes=Sum('size', filter=Q(type='image'), default=0),
+        image_count=Count('id', filter=Q(type='image')),
+        video_bytes=Sum('size', filter=Q(type='video'), default=0),
+        video_count=Count('id', filter=Q(type='video')),
+    ).order_by()
+    StorageUsage.objects.bulk_create([StorageUsage(**total) for total in totals], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_alter_profile_cover'),
+        ('uploadmanager', '0011_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('bytes_used', models.BigIntegerField(default=0)),
+                ('file_count', models.IntegerField(default=0)),
+                ('image_bytes', models.BigIntegerField(default=0)),
+                ('image_count', models.IntegerField(default=0)),
+                ('video_bytes', models.BigIntegerField(default=0)),
+                ('video_count', models.IntegerField(default=0)),
+                ('quota', models.BigIntegerField(blank=True, help_text='Quota in bytes. Empty for the default quota.', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_storage_usage, migrations.RunPython.noop),
+    ]
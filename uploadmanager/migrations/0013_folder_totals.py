@@ -0,0 +1,60 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:21
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_folder_totals(apps, schema_editor):
+    """
+    Computes the recursive totals of existing folders from their materialized paths.
+    """
+    File = apps.get_model('uploadmanager', 'File')
+    Folder = apps.get_model('uploadmanager', 'Folder')
+
+    lineages = {
+        folder_id: [int(ancestor_id) for ancestor_id in path.strip('/').split('/') if ancestor_id] + [folder_id]
+        for folder_id, path in Folder.objects.values_list('id', 'path')
+    }
+    totals = defaultdict(lambda: {'total_size': 0, 'total_files': 0, 'total_folders': 0})
+
+    for folder_id, lineage in lineages.items():
+        for ancestor_id in lineage[:-1]:
+            totals[ancestor_id]['total_folders'] += 1
+
+    file_totals = File.objects.filter(folder__isnull=False).values('folder_id').annotate(
+        size=Sum('size', default=0), count=Count('id')).order_by()
+    for row in file_totals:
+        for folder_id in lineages[row['folder_id']]:
+            totals[folder_id]['total_size'] += row['size']
+            totals[folder_id]['total_files'] += row['count']
+
+    folders = [Folder(id=folder_id, **values) for folder_id, values in totals.items()]
+    Folder.objects.bulk_update(folders, ['total_size', 'total_files', 'total_folders'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploadmanager', '0012_storageusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='total_files',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='total_folders',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='total_size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_folder_totals, migrations.RunPython.noop),
+    ]
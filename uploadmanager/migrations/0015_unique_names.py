@@ -0,0 +1,46 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:32
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+from uploadmanager.models import get_free_name
+
+
+def rename_top_level_duplicates(apps, schema_editor):
+    """
+    Numbers the top-level folders and files that share a name with an older one, which
+    nothing prevented before, so the new constraints can be created.
+    """
+    for model_name, parent_field, keep_extension in (('Folder', 'is_parent', False), ('File', 'folder', True)):
+        model = apps.get_model('uploadmanager', model_name)
+        top_level = model.objects.filter(**{f'{parent_field}__isnull': True}, deleted_at__isnull=True)
+        duplicates = top_level.values('user_id', 'name').annotate(count=Count('id')).filter(count__gt=1).order_by()
+
+        for duplicate in duplicates:
+            taken = set(top_level.filter(user_id=duplicate['user_id']).values_list('name', flat=True))
+            rows = top_level.filter(user_id=duplicate['user_id'], name=duplicate['name']).order_by('id')
+            for row_id in rows.values_list('id', flat=True)[1:]:
+                name = get_free_name(duplicate['name'], taken, keep_extension=keep_extension)
+                taken.add(name)
+                model.objects.filter(pk=row_id).update(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploadmanager', '0014_soft_delete'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_top_level_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='file',
+            constraint=models.UniqueConstraint(condition=models.Q(('deleted_at__isnull', True), ('folder__isnull', True)), fields=('user', 'name'), name='file_unique_top_level_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='folder',
+            constraint=models.UniqueConstraint(condition=models.Q(('deleted_at__isnull', True), ('is_parent__isnull', True)), fields=('user', 'name'), name='folder_unique_top_level_name'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploadmanager', '0015_unique_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=32, unique=True)),
+                ('statement', models.TextField()),
+                ('view', models.CharField(blank=True, max_length=255)),
+                ('calls', models.PositiveBigIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('last_ms', models.FloatField(default=0)),
+                ('seq_scans', models.CharField(blank=True, max_length=255)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-last_seen'], name='uploadmanag_last_se_b78f36_idx'), models.Index(fields=['-total_ms'], name='uploadmanag_total_m_a571e5_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SlowQueryPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sql', models.TextField()),
+                ('params', models.TextField(blank=True)),
+                ('duration_ms', models.FloatField()),
+                ('analyzed', models.BooleanField(default=True)),
+                ('plan', models.TextField()),
+                ('seq_scans', models.CharField(blank=True, max_length=255)),
+                ('view', models.CharField(blank=True, max_length=255)),
+                ('captured_at', models.DateTimeField(auto_now_add=True)),
+                ('query', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='plans', to='uploadmanager.slowquery')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['query', '-captured_at'], name='uploadmanag_query_i_003e22_idx')],
+            },
+        ),
+    ]
@@ -1,24 +1,133 @@
+import hashlib
 import os
 import random
-import string
+import re
+import threading
 import uuid
+from collections import namedtuple
+from datetime import timedelta
 
+from asgiref.sync import sync_to_async
+from django.utils import timezone
 from django.utils.text import slugify
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models import Case, F, Func, Q, Value, When
+from django.db.models.functions import Concat, Greatest, Substr, Upper
+from django.db.models.base import DEFERRED
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from PIL import Image
-from moviepy.editor import VideoFileClip
 import mimetypes
 import logging
 import magic
 
+from .profiling import stage
+from .thumbnails import extract_video_poster
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+FileInspection = namedtuple("FileInspection", ["mime_type", "size", "checksum"])
+
 DEFAULT_THUMBNAIL_PATH = "default-thumbnail.jpg"
 THUMBNAIL_SIZE = (100, 100)
 THUMBNAIL_FOLDER = "media/thumbnails"
+SEARCH_CONFIG = "simple"  # Text search configuration without stemming or stop words, suited to file names
+UPLOAD_STAGING_FOLDER = "uploads/staging"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MIME_SNIFF_BYTES = 2048
+MAX_IMAGE_SIZE_MB = 7  # Maximum size for images is 7 MB
+MAX_FILE_SIZE_MB = 50  # Maximum size for other files is 50 MB
+DEFAULT_STORAGE_QUOTA_MB = 1024  # Storage available to users without a quota of their own
+VALID_MIME_TYPES = {
+    "image/jpeg", "image/png", "image/gif", "image/bmp", "image/tiff",
+    "video/mp4", "video/mkv", "video/wmv", "video/mov", "video/avi",
+    "video/mpeg", "video/quicktime"
+}
+RESERVED_FOLDER_SLUGS = {"create", "tree"}  # Taken by the folder URLs
+FOLDER_TOTAL_FIELDS = ("total_size", "total_files", "total_folders")
+NAME_ALLOCATION_ATTEMPTS = 5  # Tries at saving under a free name before giving up on concurrent inserts
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 30  # Seconds before the first retry, doubled on every further attempt
+JOB_RETRY_BACKOFF_MAX = 60 * 60
+
+_mime_detector = None
+_mime_detector_lock = threading.Lock()
+
+
+def name_search_vector():
+    """
+    Returns the expression of the full-text search vector generated from a `name` column.
+
+    Punctuation such as '_', '-' and '.' is turned into spaces first, so each word of a
+    file name like 'summer_trip-2024.jpg' is indexed separately.
+    """
+    words = Func(F("name"), Value(r"[\W_]+"), Value(" "), Value("g"), function="regexp_replace")
+    return SearchVector(words, config=SEARCH_CONFIG)
+
+
+def get_copy_name_pattern(name, keep_extension=False):
+    """
+    Returns a regular expression matching a name and its numbered copies, e.g. 'Photos' and
+    'Photos (2)', or 'IMG.jpg' and 'IMG (2).jpg' when the extension is kept.
+    """
+    stem, extension = os.path.splitext(name) if keep_extension else (name, "")
+    return rf"^{re.escape(stem)}( \([0-9]+\))?{re.escape(extension)}$"
+
+
+def get_free_name(name, taken, keep_extension=False, max_length=255, skip=0):
+    """
+    Returns a name, or its first numbered copy that is not taken yet.
+
+    Args:
+        name (str): The wanted name.
+        taken (set): The names already in use, e.g. those matching `get_copy_name_pattern`.
+        keep_extension (bool): Whether the number goes before the extension of the name.
+        max_length (int): The maximum length of the name; the stem is shortened to fit the number.
+        skip (int): The number of free names to pass over, so that concurrent saves retrying
+            after a conflict do not all pick the same name again.
+
+    Returns:
+        str: `name` if it is free, else e.g. 'name (2)', 'name (3)', ...
+    """
+    stem, extension = os.path.splitext(name) if keep_extension else (name, "")
+    candidate, number = name, 1
+    while candidate in taken or skip:
+        if candidate not in taken:
+            skip -= 1
+        number += 1
+        suffix = f" ({number}){extension}"
+        candidate = stem[:max_length - len(suffix)] + suffix
+    return candidate
+
+
+def retry_on_conflict(operation, attempts=NAME_ALLOCATION_ATTEMPTS):
+    """
+    Runs an operation in a savepoint, and runs it again if it violates a unique constraint.
+
+    The operation must look up the free names again on every run, so it sees the rows that
+    concurrent transactions committed and that made the previous run fail.
+
+    Args:
+        operation (callable): The operation, called with the number of the run, starting at 1.
+        attempts (int): The maximum number of runs.
+
+    Returns:
+        The result of the operation.
+
+    Raises:
+        IntegrityError: If the last run failed as well.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic():
+                return operation(attempt)
+        except IntegrityError:
+            if attempt == attempts:
+                raise
+            logger.info(f"Retrying a save that conflicted with a concurrent one (attempt {attempt}).")
 
 
 # Custom validator for folder name field
@@ -39,50 +148,224 @@ def validate_name(value):
         )
 
 
+class FolderManager(models.Manager):
+    """
+    Manager hiding deleted folders, which only wait for the purger to remove them.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class FileManager(models.Manager):
+    """
+    Manager hiding deleted files, and the files of deleted folders, which only wait for the
+    purger to remove them.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            Q(folder__isnull=True) | Q(folder__deleted_at__isnull=True), deleted_at__isnull=True
+        )
+
+
 class Folder(models.Model):
     """
     A folder model for organizing files.
 
     Folders can have subfolders (is_parent) and are associated with a specific user.
     Each folder is uniquely identified by a combination of name and parent folder (if any).
+
+    Every folder also stores the ids of its ancestors as a materialized path, e.g. '/1/5/' for a
+    folder inside folder 5 inside folder 1, so ancestors and descendants are each fetched with a
+    single indexed query instead of one query per level.
+
+    Folders also carry the size and number of files and subfolders in their whole subtree.
+    These totals are adjusted incrementally on every ancestor at once, so listings can show
+    them without aggregating over the subtree.
     """
     name = models.CharField(max_length=255, validators=[validate_name])
     slug = models.SlugField(max_length=255, unique=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='folders', on_delete=models.CASCADE)
     is_parent = models.ForeignKey('self', related_name='subfolders', on_delete=models.CASCADE, null=True, blank=True)
+    path = models.CharField(max_length=1024, default="/", editable=False)
+    search_vector = models.GeneratedField(expression=name_search_vector(), output_field=SearchVectorField(),
+                                          db_persist=True)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    total_size = models.BigIntegerField(default=0, editable=False)
+    total_files = models.IntegerField(default=0, editable=False)
+    total_folders = models.IntegerField(default=0, editable=False)
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = FolderManager()
+    all_objects = models.Manager()
+
     def __str__(self):
         return self.name
 
-    def save(self, *args, **kwargs):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the parent the folder was loaded with, to detect moves on save
+        instance._loaded_parent_id = instance.__dict__.get("is_parent_id", DEFERRED)
+        return instance
+
+    def save(self, *args, allocate_name=True, **kwargs):
         """
         Override save method to generate unique slugs and ensure no duplicate folder names
         for the same user and parent folder.
 
+        A taken name gets the first free number, e.g. 'Photos (2)', and a taken slug a random
+        suffix; both are found with a single query. Concurrent saves may still pick the same
+        name or slug, so the row is written in a savepoint and, if it violates a unique
+        constraint, the allocation is done again.
+
+        The materialized path is set on creation. When the folder is moved to another parent,
+        the paths of the folder and of its whole subtree are rewritten in a single UPDATE, and
+        its totals are moved from its old ancestors to its new ones.
+
+        The recursive totals are never written from the instance, which may be stale; they are
+        only changed through `shift_totals`.
+
         Args:
             *args: Additional arguments passed to save.
+            allocate_name (bool): Whether to rename the folder if its name is taken. If False,
+                saving a folder under a taken name raises IntegrityError instead.
             **kwargs: Additional keyword arguments passed to save.
         """
         if not self.slug:
-            self.slug = slugify(self.name)
+            self.slug = slugify(self.name) or "folder"
+
+        is_new = self._state.adding
+        is_moved = not is_new and self.is_parent_id != self._get_loaded_parent_id()
+        old_subtree_prefix, old_depth = self.subtree_prefix, self.depth
+        old_ancestor_ids = self.get_ancestor_ids()
+
+        if not is_new and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and not field.generated and field.name not in FOLDER_TOTAL_FIELDS
+            ]
+
+        if is_new or is_moved:
+            self._set_path()
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "path", "depth"}
+
+        # Names only need checking when they or the parent change
+        update_fields = kwargs.get("update_fields")
+        needs_allocation = is_new or update_fields is None or bool({"name", "is_parent"} & set(update_fields))
+
+        wanted_name, wanted_slug = self.name, self.slug
+
+        def write(attempt):
+            if needs_allocation:
+                # Every attempt starts over from the wanted name, not from the one that conflicted
+                self.name, self.slug = wanted_name, wanted_slug
+                self._allocate_name_and_slug(allocate_name, skip=random.randrange(attempt))
+            super(Folder, self).save(*args, **kwargs)
+
+        with transaction.atomic():
+            retry_on_conflict(write, attempts=NAME_ALLOCATION_ATTEMPTS if allocate_name and needs_allocation else 1)
+
+            if is_new:
+                Folder.shift_totals([], self.get_ancestor_ids(), folders=1)
+
+            if is_moved:
+                Folder.objects.filter(path__startswith=old_subtree_prefix).update(
+                    path=Concat(Value(self.subtree_prefix), Substr("path", len(old_subtree_prefix) + 1),
+                                output_field=models.CharField()),
+                    depth=F("depth") + (self.depth - old_depth),
+                )
+                totals = Folder.objects.select_for_update().filter(pk=self.pk).values(*FOLDER_TOTAL_FIELDS).get()
+                Folder.shift_totals(old_ancestor_ids, self.get_ancestor_ids(), size=totals["total_size"],
+                                    files=totals["total_files"], folders=totals["total_folders"] + 1)
+
+        self._loaded_parent_id = self.is_parent_id
+
+    def _allocate_name_and_slug(self, allocate_name=True, skip=0):
+        """
+        Picks a free name among the folder's siblings and, for a new folder, a free slug.
+        With `skip`, one of the next free names is picked instead of the first.
+
+        The sibling names matching the folder's name or its numbered copies, and a folder using
+        the same slug, are fetched with a single query on the listing and slug indexes.
+        """
+        conditions = Q(user_id=self.user_id, is_parent_id=self.is_parent_id, deleted_at__isnull=True,
+                       name__regex=get_copy_name_pattern(self.name))
+        if self._state.adding:
+            conditions |= Q(slug=self.slug)
+        taken_names, slug_taken = set(), False
+        rows = (Folder.all_objects.filter(conditions).exclude(pk=self.pk)
+                .values_list("name", "slug", "user_id", "is_parent_id", "deleted_at"))
+        for name, slug, user_id, parent_id, deleted_at in rows:
+            # The folder using the slug may live anywhere, so only siblings count for the name
+            if (user_id, parent_id, deleted_at) == (self.user_id, self.is_parent_id, None):
+                taken_names.add(name)
+            slug_taken = slug_taken or slug == self.slug
+        slug_taken = slug_taken or (self._state.adding and self.slug in RESERVED_FOLDER_SLUGS)
+
+        if allocate_name:
+            self.name = get_free_name(self.name, taken_names, max_length=self._meta.get_field("name").max_length,
+                                      skip=skip)
+        if slug_taken:
+            slug_length = self._meta.get_field("slug").max_length - 9
+            self.slug = f"{self.slug[:slug_length]}-{uuid.uuid4().hex[:8]}"  # Append UUID to slug to make it unique
+
+    def _get_loaded_parent_id(self):
+        loaded_parent_id = getattr(self, "_loaded_parent_id", DEFERRED)
+        if loaded_parent_id is DEFERRED:
+            loaded_parent_id = Folder.objects.filter(pk=self.pk).values_list("is_parent_id", flat=True).first()
+        return loaded_parent_id
+
+    def _set_path(self):
+        """
+        Sets the materialized path and depth from the parent folder.
+
+        Raises:
+            ValidationError: If the folder would become its own ancestor.
+        """
+        parent = self.is_parent
+        if parent is None:
+            self.path, self.depth = "/", 0
+            return
+
+        if self.pk and (parent.pk == self.pk or f"/{self.pk}/" in parent.path):
+            raise ValidationError("A folder cannot be moved into itself or one of its subfolders.")
+        self.path, self.depth = parent.subtree_prefix, parent.depth + 1
+
+    @property
+    def subtree_prefix(self):
+        """
+        Returns the path prefix shared by every descendant of the folder.
+        """
+        return f"{self.path}{self.pk}/"
+
+    def get_ancestor_ids(self):
+        """
+        Returns the ids of the folder's ancestors, from the top-level folder down.
+        """
+        return [int(folder_id) for folder_id in self.path.strip("/").split("/") if folder_id]
 
-        # Preventing creation of duplicate folders in the same parent
-        count = 0
-        while Folder.objects.filter(
-                name=self.name, is_parent=self.is_parent, user=self.user
-        ).exists():
-            count += 1
-            if self.name[-1].isdigit():
-                self.name = self.name[:-1]
-            self.name += str(count)
+    def get_lineage_ids(self):
+        """
+        Returns the ids of the folder's ancestors followed by its own id.
+        """
+        return [*self.get_ancestor_ids(), self.pk]
 
-        # Ensure slug uniqueness by appending UUID if needed
-        if Folder.objects.filter(slug=self.slug).exists():
-            self.slug = f"{self.slug}-{uuid.uuid4().hex[:8]}"  # Append UUID to slug to make it unique
+    def get_ancestors(self):
+        """
+        Returns the folder's ancestors, from the top-level folder down, in a single query.
+        """
+        return Folder.objects.filter(id__in=self.get_ancestor_ids()).order_by("depth")
 
-        super().save(*args, **kwargs)
+    def get_descendants(self):
+        """
+        Returns every folder below this one, at any depth, in a single query.
+        """
+        return Folder.objects.filter(path__startswith=self.subtree_prefix)
 
     def get_nested_path(self):
         """
@@ -91,35 +374,279 @@ class Folder(models.Model):
         Returns:
             list: A list of dictionaries containing folder names and slugs.
         """
-        path = [{"name": self.name, "slug": self.slug}]
-        parent = self.is_parent
+        path = list(self.get_ancestors().values("name", "slug"))
+        path.append({"name": self.name, "slug": self.slug})
+        return path
 
-        while parent:
-            path.insert(0, {"name": parent.name, "slug": parent.slug})
-            parent = parent.is_parent
+    @classmethod
+    def shift_totals(cls, from_ids, to_ids, size=0, files=0, folders=0):
+        """
+        Moves an amount of bytes, files and folders from the totals of some folders to those
+        of others, in a single UPDATE.
 
-        return path
+        Folders found in both lists are left untouched, so moving content between two folders
+        of the same tree only changes the folders below their common ancestor.
+
+        Args:
+            from_ids (list): The ids of the folders the amounts are taken from, e.g. the
+                lineage of the folder a file is removed from. Empty when content is added.
+            to_ids (list): The ids of the folders the amounts are added to. Empty when
+                content is removed.
+            size (int): The number of bytes.
+            files (int): The number of files.
+            folders (int): The number of folders.
+        """
+        removed, added = set(from_ids) - set(to_ids), set(to_ids) - set(from_ids)
+        changes = {
+            field: Case(
+                When(id__in=added, then=F(field) + amount),
+                When(id__in=removed, then=F(field) - amount),
+                default=F(field),
+                output_field=cls._meta.get_field(field),
+            )
+            for field, amount in zip(FOLDER_TOTAL_FIELDS, (size, files, folders))
+            if amount
+        }
+        if changes and (removed or added):
+            cls.objects.filter(id__in=removed | added).update(**changes)
+
+    @classmethod
+    def add_to_totals(cls, amounts):
+        """
+        Adds a different amount to the totals of each of several folders, in a single UPDATE.
+
+        Args:
+            amounts (dict): (size, files, folders) tuples keyed by folder id. The amounts
+                are added to those folders only, not to their ancestors.
+        """
+        if not amounts:
+            return
+        changes = {
+            field: Case(
+                *[When(id=folder_id, then=F(field) + amount[index]) for folder_id, amount in amounts.items()],
+                default=F(field),
+                output_field=cls._meta.get_field(field),
+            )
+            for index, field in enumerate(FOLDER_TOTAL_FIELDS)
+            if any(amount[index] for amount in amounts.values())
+        }
+        if changes:
+            cls.objects.filter(id__in=amounts).update(**changes)
+
+    @classmethod
+    def get_or_create_tree(cls, user, parent, paths):
+        """
+        Returns the folders at the given relative paths below a parent, creating the missing ones.
+
+        The existing folders are looked up with one query per level of the tree, and each
+        missing folder is created once, however many paths go through it. Folders are never
+        renamed: if another request creates a folder of the tree at the same time, that folder
+        is used instead, so concurrent clients syncing the same tree end up with a single copy.
+
+        Args:
+            user (CustomUser): The owner of the folders.
+            parent (Folder): The folder the paths are relative to, or None for the top level.
+            paths (iterable): The paths, as tuples of folder names.
+
+        Returns:
+            dict: The folders keyed by path; the empty path maps to `parent`.
+
+        Raises:
+            ValidationError: If a folder name is invalid.
+        """
+        folders = {(): parent}
+        wanted = {path[:depth] for path in paths for depth in range(1, len(path) + 1)}
+        for path in wanted:
+            validate_name(path[-1])
+
+        for depth in range(1, max(map(len, wanted), default=0) + 1):
+            level = [path for path in wanted if len(path) == depth]
+            parent_ids = {folder.pk if folder else None for path, folder in folders.items() if len(path) == depth - 1}
+            in_parents = Q(is_parent_id__in=parent_ids - {None})
+            if None in parent_ids:
+                in_parents |= Q(is_parent__isnull=True)
+            existing = {
+                (folder.is_parent_id, folder.name): folder
+                for folder in cls.objects.filter(in_parents, user=user, name__in={path[-1] for path in level})
+            }
+            for path in sorted(level):
+                parent_folder = folders[path[:-1]]
+                folder = existing.get((parent_folder.pk if parent_folder else None, path[-1]))
+                folders[path] = folder or cls._get_or_create_child(user, parent_folder, path[-1])
+        return folders
+
+    @classmethod
+    def _get_or_create_child(cls, user, parent, name):
+        """
+        Creates a subfolder, or returns the one a concurrent request has just created under the
+        same name.
+        """
+        def create(attempt):
+            folder = cls(user=user, is_parent=parent, name=name)
+            folder.save(allocate_name=False)
+            return folder
+
+        try:
+            return retry_on_conflict(create, attempts=1)
+        except IntegrityError:
+            # Either the name or, far less likely, the slug was taken in the meantime
+            return cls.objects.filter(user=user, is_parent=parent, name=name).first() or retry_on_conflict(create)
+
+    @classmethod
+    def get_display_paths(cls, folders):
+        """
+        Returns the display path, e.g. "Parent / Subfolder / Folder", of several folders at once.
+
+        The names of all the ancestors involved are fetched with a single query.
+
+        Args:
+            folders (iterable): The Folder instances to get the paths of.
+
+        Returns:
+            dict: The display paths keyed by folder id.
+        """
+        folders = list(folders)
+        ancestor_ids = {folder_id for folder in folders for folder_id in folder.get_ancestor_ids()}
+        names = dict(cls.objects.filter(id__in=ancestor_ids).values_list("id", "name"))
+
+        return {
+            folder.id: " / ".join([names[folder_id] for folder_id in folder.get_ancestor_ids() if folder_id in names]
+                                  + [folder.name])
+            for folder in folders
+        }
 
     class Meta:
         unique_together = ("name", "is_parent", "user")
+        constraints = [
+            # unique_together does not apply to top-level folders, whose parent is NULL
+            models.UniqueConstraint(fields=["user", "name"], condition=Q(is_parent__isnull=True, deleted_at__isnull=True),
+                                    name="folder_unique_top_level_name"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "is_parent", "-created_at", "-id"], name="folder_listing_idx"),
+            models.Index(fields=["path"], name="folder_path_idx", opclasses=["varchar_pattern_ops"]),
+            models.Index(fields=["user", "-depth"], condition=Q(deleted_at__isnull=False), name="folder_deleted_idx"),
+            GinIndex(fields=["search_vector"], name="folder_search_vector_idx"),
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="folder_name_trgm_idx"),
+        ]
 
 
-def validate_file_type(value):
+def get_mime_detector():
     """
-    Validates the MIME type of a file to ensure it is an accepted image or video format.
+    Returns the libmagic handle shared by the whole process.
+
+    Opening a handle loads the magic database from disk, so it is done once per process
+    instead of once per validation. The handle is not thread-safe; use it through `sniff_mime_type`.
+    """
+    global _mime_detector
+    if _mime_detector is None:
+        _mime_detector = magic.Magic(mime=True)
+    return _mime_detector
+
+
+def sniff_mime_type(header):
+    """
+    Detects the MIME type of a file from its first bytes.
+
+    Args:
+        header (bytes): The beginning of the file. Only the first MIME_SNIFF_BYTES are used.
+
+    Returns:
+        str: The detected MIME type.
+    """
+    with _mime_detector_lock:
+        return get_mime_detector().from_buffer(header[:MIME_SNIFF_BYTES])
+
+
+def read_header(value):
+    """
+    Reads the bytes used for MIME sniffing from a file, leaving its position at the start.
+    """
+    value.seek(0)
+    header = value.read(MIME_SNIFF_BYTES)
+    value.seek(0)
+    return header
+
+
+def get_max_file_size(mime_type):
+    """
+    Returns the maximum allowed size in bytes for a file of the given MIME type.
+    """
+    if mime_type and mime_type.startswith("image"):
+        return MAX_IMAGE_SIZE_MB * 1024 * 1024
+    return MAX_FILE_SIZE_MB * 1024 * 1024
+
+
+def inspect_file(value, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Validates a file and computes its size and checksum in a single pass over its chunks.
+
+    The MIME type is sniffed from the first bytes, and the size limit for that type is enforced
+    while the chunks are read, so memory use is bounded by the chunk size rather than the file size.
+
+    Args:
+        value (File): The file to be inspected.
+        chunk_size (int): The size of the chunks read from the file.
+
+    Returns:
+        FileInspection: The detected MIME type, the size in bytes and the SHA-256 hex digest.
+
+    Raises:
+        ValidationError: If the file type is not supported or the file is too large.
     """
-    valid_mime_types = {
-        "image/jpeg", "image/png", "image/gif", "image/bmp", "image/tiff",
-        "video/mp4", "video/mkv", "video/wmv", "video/mov", "video/avi",
-        "video/mpeg", "video/quicktime"
-    }
+    header = b""
+    mime_type = None
+    max_size = None
+    size = 0
+    checksum = hashlib.sha256()
 
-    mime_detector = magic.Magic(mime=True)
-    mime_type = mime_detector.from_buffer(value.read())
+    for chunk in value.chunks(chunk_size):
+        if mime_type is None:
+            header += chunk[:MIME_SNIFF_BYTES - len(header)]
+            if len(header) == MIME_SNIFF_BYTES:
+                mime_type = validate_mime_type(header)
+                max_size = get_max_file_size(mime_type)
+
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise ValidationError(f"File size exceeds the maximum limit of {max_size // (1024 * 1024)} MB.")
+        checksum.update(chunk)
     value.seek(0)
 
-    if mime_type not in valid_mime_types:
+    if mime_type is None:
+        # The whole file is shorter than the sniffing window
+        mime_type = validate_mime_type(header)
+
+    return FileInspection(mime_type, size, checksum.hexdigest())
+
+
+def validate_mime_type(header):
+    """
+    Validates that the first bytes of a file belong to an accepted image or video format.
+
+    Args:
+        header (bytes): The beginning of the file.
+
+    Returns:
+        str: The detected MIME type.
+
+    Raises:
+        ValidationError: If the detected type is not supported.
+    """
+    mime_type = sniff_mime_type(header)
+    if mime_type not in VALID_MIME_TYPES:
         raise ValidationError(f"Unsupported file type. Detected type: {mime_type}. Only videos and images are supported.")
+    return mime_type
+
+
+def validate_file_type(value):
+    """
+    Validates the MIME type of a file to ensure it is an accepted image or video format.
+
+    Only the first MIME_SNIFF_BYTES of the file are read.
+    """
+    with stage("validate_file_type"):
+        validate_mime_type(read_header(value))
 
 
 def validate_file_size(value):
@@ -132,24 +659,224 @@ def validate_file_size(value):
     Raises:
         ValidationError: If the file size exceeds the allowed limit.
     """
-    mime_type, _ = mimetypes.guess_type(value.name)
+    with stage("validate_file_size"):
+        mime_type = sniff_mime_type(read_header(value))
+        max_size_bytes = get_max_file_size(mime_type)
 
-    if mime_type and mime_type.startswith("image"):
-        max_size_mb = 7  # Maximum size for images is 7 MB
-    else:
-        max_size_mb = 50  # Maximum size for other files is 50 MB
-
-    max_size_bytes = max_size_mb * 1024 * 1024
     if value.size > max_size_bytes:
-        raise ValidationError(f"File size exceeds the maximum limit of {max_size_mb} MB.")
+        raise ValidationError(f"File size exceeds the maximum limit of {max_size_bytes // (1024 * 1024)} MB.")
 
 
-class File(models.Model):
+class ThumbnailMixin:
+    """
+    Thumbnail generation shared by models with a `file` and a `thumbnail` field.
+    """
+
+    def _create_thumbnail(self):
+        """
+        Creates a thumbnail for the file, either from an image or video.
+
+        This method runs from the background job queue rather than the upload request.
+        Errors are propagated so that the queue can retry the job.
+        """
+        os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)
+        mime_type, _ = mimetypes.guess_type(self.file.name)
+
+        with stage("create_thumbnail"):
+            if mime_type and mime_type.startswith("image"):
+                self._create_image_thumbnail()
+            elif mime_type and mime_type.startswith("video"):
+                self._create_video_thumbnail()
+
+    def _create_image_thumbnail(self):
+        """
+        Creates a thumbnail for image files.
+
+        This method generates a 100x100 thumbnail for an image file and saves it.
+        """
+        with self.file.open("rb") as image_file:
+            image = Image.open(image_file)
+            image.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+
+            thumbnail_filename = os.path.join(THUMBNAIL_FOLDER, os.path.basename(self.file.name))
+            image.save(thumbnail_filename)
+
+        self.thumbnail = thumbnail_filename.replace("media/", "")
+        self.save(update_fields=["thumbnail"])
+
+    def _create_video_thumbnail(self):
+        """
+        Creates a thumbnail for video files.
+
+        This method generates a 100x100 thumbnail from the keyframe at the 1-second mark
+        (or the first frame of shorter clips) with ffmpeg and saves it as an image.
+        """
+        thumbnail_filename = os.path.join(THUMBNAIL_FOLDER, os.path.basename(self.file.name) + ".jpg")
+        poster = extract_video_poster(self.file.path, THUMBNAIL_SIZE)
+
+        with open(thumbnail_filename, "wb") as thumbnail_file:
+            thumbnail_file.write(poster)
+
+        self.thumbnail = thumbnail_filename.replace("media/", "")
+        self.save(update_fields=["thumbnail"])
+
+
+def blob_upload_to(instance, filename):
+    """
+    Returns the content-addressed storage path of a blob, e.g. 'blobs/ab/abcdef....jpg'.
+    """
+    _, extension = os.path.splitext(filename)
+    return f"blobs/{instance.checksum[:2]}/{instance.checksum}{extension.lower()}"
+
+
+class Blob(ThumbnailMixin, models.Model):
+    """
+    The stored content of one or more files, addressed by its SHA-256 checksum.
+
+    Files with identical content share a single blob, and with it a single stored copy and
+    thumbnail. The blob keeps a count of the files referencing it and is deleted, together with
+    its stored content, when the last of them goes away.
+    """
+    checksum = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=blob_upload_to, max_length=255)
+    size = models.BigIntegerField()
+    thumbnail = models.ImageField(upload_to='thumbnails/', max_length=255, blank=True, null=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.checksum
+
+    @classmethod
+    def acquire(cls, checksum, size, content):
+        """
+        Returns the blob holding the given content and adds a reference to it.
+
+        The content is only written to storage if no blob with the same checksum exists yet.
+        Must be called inside a transaction; the blob row stays locked until it ends.
+
+        Args:
+            checksum (str): The SHA-256 hex digest of the content.
+            size (int): The size of the content in bytes.
+            content (File): The content to store if it is not stored yet.
+
+        Returns:
+            Blob: The blob, with its reference count already incremented.
+        """
+        blob = cls.objects.select_for_update().filter(checksum=checksum).first()
+
+        if blob is None:
+            blob = cls(checksum=checksum, size=size)
+            blob.file.save(os.path.basename(content.name), content, save=False)
+            try:
+                with transaction.atomic():
+                    blob.save()
+            except IntegrityError:
+                # A concurrent upload of the same content created the blob first
+                blob.file.delete(save=False)
+                blob = cls.objects.select_for_update().get(checksum=checksum)
+
+        cls.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") + 1)
+        return blob
+
+    @classmethod
+    def acquire_many(cls, contents, map_func=map):
+        """
+        Returns the blobs holding several contents and adds references to them, like `acquire`,
+        with a fixed number of queries however many contents there are.
+
+        Must be called inside a transaction; the blob rows stay locked until it ends.
+
+        Args:
+            contents (dict): (size, content, references) tuples keyed by checksum, where
+                `references` is the number of references to add.
+            map_func (callable): The `map` used to store the new contents, e.g. the `map` of
+                a thread pool to write them concurrently.
+
+        Returns:
+            dict: The blobs keyed by checksum, with their reference counts already incremented.
+        """
+        blobs = cls.objects.select_for_update().in_bulk(list(contents), field_name="checksum")
+
+        def store(checksum):
+            size, content, _ = contents[checksum]
+            blob = cls(checksum=checksum, size=size)
+            blob.file.save(os.path.basename(content.name), content, save=False)
+            return blob
+
+        new_blobs = list(map_func(store, [checksum for checksum in contents if checksum not in blobs]))
+        if new_blobs:
+            cls.objects.bulk_create(new_blobs, ignore_conflicts=True)
+            blobs = cls.objects.select_for_update().in_bulk(list(contents), field_name="checksum")
+            for blob in new_blobs:
+                if blobs[blob.checksum].file.name != blob.file.name:
+                    # A concurrent upload of the same content created the blob first
+                    blob.file.delete(save=False)
+
+        cls.objects.filter(checksum__in=list(contents)).update(ref_count=Case(
+            *[When(checksum=checksum, then=F("ref_count") + references)
+              for checksum, (_, _, references) in contents.items()],
+            default=F("ref_count"),
+            output_field=cls._meta.get_field("ref_count"),
+        ))
+        return blobs
+
+    @classmethod
+    def release(cls, blob_id):
+        """
+        Removes a reference to a blob, deleting it once no file references it anymore.
+
+        Args:
+            blob_id (int): The id of the blob.
+        """
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(pk=blob_id).first()
+            if blob is None:
+                return
+            if blob.ref_count <= 1:
+                blob.delete()
+            else:
+                cls.objects.filter(pk=blob_id).update(ref_count=F("ref_count") - 1)
+
+    @classmethod
+    def release_many(cls, references):
+        """
+        Removes references to several blobs at once, deleting those no file references anymore,
+        with a fixed number of queries.
+
+        Unlike `release`, the blob rows are deleted with plain SQL and their stored content is
+        left in place; the caller removes it once the transaction has been committed. Must be
+        called inside a transaction, after the files referencing the blobs have been deleted.
+
+        Args:
+            references (dict): The number of references to remove, keyed by blob id.
+
+        Returns:
+            list: The storage names of the content and thumbnails of the deleted blobs.
+        """
+        if not references:
+            return []
+
+        cls.objects.filter(pk__in=list(references)).update(ref_count=Case(
+            *[When(pk=blob_id, then=Greatest(F("ref_count") - count, 0)) for blob_id, count in references.items()],
+            default=F("ref_count"),
+            output_field=cls._meta.get_field("ref_count"),
+        ))
+
+        orphans = list(cls.objects.filter(pk__in=list(references), ref_count=0).values_list("id", "file", "thumbnail"))
+        # Plain SQL, without fetching the rows and sending a post_delete signal for each of them
+        orphan_blobs = cls.objects.filter(pk__in=[blob_id for blob_id, _, _ in orphans])
+        orphan_blobs._raw_delete(orphan_blobs.db)
+        return [name for _, file, thumbnail in orphans for name in (file, thumbnail) if name]
+
+
+class File(ThumbnailMixin, models.Model):
     """
     A file model for storing user files such as images and videos.
 
     Each file is associated with a specific folder and user, and includes information such as file size,
-    type, and a thumbnail if applicable.
+    type, and a thumbnail if applicable. The stored content and thumbnail belong to the file's blob
+    and may be shared with other files.
     """
     FILE_TYPE_CHOICE = (
         ('img', 'Image'),
@@ -159,41 +886,113 @@ class File(models.Model):
     name = models.CharField(max_length=255, blank=True, null=True)
     file = models.FileField(upload_to='files/', validators=[validate_file_type, validate_file_size])
     size = models.IntegerField(blank=True, null=True)
+    checksum = models.CharField(max_length=64, blank=True)
     type = models.CharField(max_length=20, choices=FILE_TYPE_CHOICE)
     thumbnail = models.ImageField(upload_to='thumbnails/', blank=True, null=True)
+    blob = models.ForeignKey('Blob', on_delete=models.PROTECT, related_name='files', null=True, blank=True)
+    search_vector = models.GeneratedField(expression=name_search_vector(), output_field=SearchVectorField(),
+                                          db_persist=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='files', on_delete=models.CASCADE)
     folder = models.ForeignKey('Folder', on_delete=models.CASCADE, related_name='files', null=True, blank=True)
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = FileManager()
+    all_objects = models.Manager()
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the folder the file was loaded with, to move its size between folder totals on save
+        instance._loaded_folder_id = instance.__dict__.get("folder_id", DEFERRED)
+        return instance
+
     def save(self, *args, **kwargs):
         """
         Override save method to assign file name, size, and type.
-        Also, it generates a thumbnail for images and videos if not already present.
+        New files are validated and checksummed in a single streaming pass, and their content is
+        stored in the shared `Blob` with the same checksum instead of as a separate copy.
+        Also, it queues a thumbnail job for new images and videos if no thumbnail is present.
+
+        A name already taken in the folder gets the first free number before its extension,
+        e.g. 'IMG_0001 (2).jpg', found with a single query. The row is written in a savepoint
+        and the name allocated again if a concurrent save took it first.
 
         Args:
             *args: Additional arguments passed to save.
             **kwargs: Additional keyword arguments passed to save.
         """
         self.name = self.name or os.path.basename(self.file.name)
+
+        if self._state.adding and not self.checksum:
+            with stage("inspect_file"):
+                inspection = inspect_file(self.file)
+            self.size = inspection.size
+            self.checksum = inspection.checksum
+            self.type = self.type or self._choose_file_type(inspection.mime_type)
+
         self.size = self.size or self.file.size
         self.type = self.type or self._choose_file_type()
 
-        super().save(*args, **kwargs)
+        is_new = self._state.adding
+        loaded_folder_id = None if is_new else getattr(self, "_loaded_folder_id", DEFERRED)
+        with transaction.atomic():
+            if is_new and not self.blob_id:
+                with stage("store"):
+                    self.blob = Blob.acquire(self.checksum, self.size, self.file)
+                self.file = self.blob.file.name
+                self.thumbnail = self.thumbnail or self.blob.thumbnail
+            update_fields = kwargs.get("update_fields")
+            if is_new or update_fields is None or {"name", "folder"} & set(update_fields):
+                save, wanted_name = super().save, self.name
+
+                def write(attempt):
+                    self.name = wanted_name
+                    self._allocate_name(skip=random.randrange(attempt))
+                    save(*args, **kwargs)
+
+                with stage("insert" if is_new else "update"):
+                    retry_on_conflict(write)
+            else:
+                super().save(*args, **kwargs)
 
-        if not self.thumbnail:
-            self._create_thumbnail()
+            if not is_new and loaded_folder_id is not DEFERRED and loaded_folder_id != self.folder_id:
+                old_folder = Folder.objects.filter(pk=loaded_folder_id).first()
+                Folder.shift_totals(old_folder.get_lineage_ids() if old_folder else [],
+                                    self.folder.get_lineage_ids() if self.folder else [],
+                                    size=self.size or 0, files=1)
+        self._loaded_folder_id = self.folder_id
 
-    def _choose_file_type(self):
+        if is_new and not self.thumbnail:
+            Job.enqueue("create_thumbnail", file_id=self.pk)
+
+    def _allocate_name(self, skip=0):
+        """
+        Picks a free name among the other files of the folder, with a single query.
+        With `skip`, one of the next free names is picked instead of the first.
+        """
+        taken = set(
+            File.all_objects.filter(user_id=self.user_id, folder_id=self.folder_id, deleted_at__isnull=True,
+                                    name__regex=get_copy_name_pattern(self.name, keep_extension=True))
+            .exclude(pk=self.pk).values_list("name", flat=True)
+        )
+        self.name = get_free_name(self.name, taken, keep_extension=True,
+                                  max_length=self._meta.get_field("name").max_length, skip=skip)
+
+    def _choose_file_type(self, mime_type=None):
         """
         Determines the file type (image or video) based on the file's MIME type.
+
+        Args:
+            mime_type (str, optional): The already detected MIME type. If not given, it is
+                sniffed from the beginning of the file.
         """
-        mime_detector = magic.Magic(mime=True)
-        mime_type = mime_detector.from_buffer(self.file.read())
-        self.file.seek(0)  # Reset file pointer after reading
+        with stage("choose_file_type"):
+            mime_type = mime_type or sniff_mime_type(read_header(self.file))
 
         if mime_type.startswith("image"):
             return "image"
@@ -213,64 +1012,359 @@ class File(models.Model):
             size /= 1024.0
         return f"{size:.2f} PB"
 
-    def _create_thumbnail(self):
+    class Meta:
+        unique_together = ("name", "folder", "user")
+        constraints = [
+            # unique_together does not apply to top-level files, whose folder is NULL
+            models.UniqueConstraint(fields=["user", "name"], condition=Q(folder__isnull=True, deleted_at__isnull=True),
+                                    name="file_unique_top_level_name"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "folder", "-created_at", "-id"], name="file_listing_idx"),
+            models.Index(fields=["user"], condition=Q(deleted_at__isnull=False), name="file_deleted_idx"),
+            GinIndex(fields=["search_vector"], name="file_search_vector_idx"),
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="file_name_trgm_idx"),
+        ]
+
+
+class StorageUsage(models.Model):
+    """
+    The storage used by a user, kept up to date as files are added and deleted.
+
+    The counters are adjusted with `F()` expressions in the same transaction as the file row
+    itself, so reading a user's usage or checking their quota is a single primary key lookup
+    instead of a `SUM` over all of their files. The `reconcile_usage` management command
+    recomputes the counters from the files if they ever drift.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True, related_name='storage_usage',
+                                on_delete=models.CASCADE)
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    image_bytes = models.BigIntegerField(default=0)
+    image_count = models.IntegerField(default=0)
+    video_bytes = models.BigIntegerField(default=0)
+    video_count = models.IntegerField(default=0)
+    quota = models.BigIntegerField(blank=True, null=True, help_text="Quota in bytes. Empty for the default quota.")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user} ({self.bytes_used} bytes)"
+
+    @classmethod
+    def for_user(cls, user):
         """
-        Creates a thumbnail for the file, either from an image or video.
+        Returns the usage record of a user, creating an empty one if needed.
+        """
+        usage, _ = cls.objects.get_or_create(user=user)
+        return usage
 
-        This method creates a thumbnail image for image files and video files.
+    @classmethod
+    async def afor_user(cls, user):
         """
-        os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)
-        mime_type, _ = mimetypes.guess_type(self.file.name)
+        Async version of `for_user`.
+        """
+        usage, _ = await cls.objects.aget_or_create(user=user)
+        return usage
 
-        if mime_type and mime_type.startswith("image"):
-            self._create_image_thumbnail()
-        elif mime_type and mime_type.startswith("video"):
-            self._create_video_thumbnail()
+    @classmethod
+    def add(cls, user_id, file_type, size, count=1):
+        """
+        Atomically adjusts the usage of a user by a number of files of the given type.
 
-    def _create_image_thumbnail(self):
+        Args:
+            user_id (int): The id of the user.
+            file_type (str): The type of the files, 'image' or 'video'.
+            size (int): The total size of the files in bytes; negative when files are removed.
+            count (int): The number of files; negative when files are removed.
         """
-        Creates a thumbnail for image files.
+        changes = {
+            "bytes_used": F("bytes_used") + size,
+            "file_count": F("file_count") + count,
+            "updated_at": timezone.now(),
+        }
+        if file_type in ("image", "video"):
+            changes[f"{file_type}_bytes"] = F(f"{file_type}_bytes") + size
+            changes[f"{file_type}_count"] = F(f"{file_type}_count") + count
 
-        This method generates a 100x100 thumbnail for an image file and saves it.
-        If the thumbnail creation fails, a default thumbnail is used.
+        if cls.objects.filter(user_id=user_id).update(**changes) or count < 0:
+            # Nothing to take away from a user without a record, e.g. while the user is being deleted
+            return
+        cls.objects.get_or_create(user_id=user_id)
+        cls.objects.filter(user_id=user_id).update(**changes)
+
+    def get_quota(self):
         """
-        try:
-            image = Image.open(self.file)
-            image.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+        Returns the storage quota of the user in bytes.
+        """
+        return self.quota if self.quota is not None else DEFAULT_STORAGE_QUOTA_MB * 1024 * 1024
 
-            thumbnail_filename = os.path.join(THUMBNAIL_FOLDER, os.path.basename(self.file.name))
-            image.save(thumbnail_filename)
+    def get_available_bytes(self):
+        """
+        Returns the number of bytes the user can still upload.
+        """
+        return max(self.get_quota() - self.bytes_used, 0)
 
-            self.thumbnail = thumbnail_filename.replace("media/", "")
-            self.save()
-        except Exception as error:
-            logger.error(f"Failed to create image thumbnail for {self.file.name}: {error}")
-            self.thumbnail = DEFAULT_THUMBNAIL_PATH
-            self.save()
 
-    def _create_video_thumbnail(self):
+class UploadSession(models.Model):
+    """
+    A resumable, chunked upload in progress.
+
+    The client declares the total length up front, then sends the bytes in chunks at explicit
+    offsets. Chunks are written straight into a preallocated staging file so they can be retried
+    or sent in parallel, and the `File` row is only created once the upload is finalized.
+    Both the session row and the staging file live outside the worker process, so an upload
+    can be resumed after a restart.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='upload_sessions', on_delete=models.CASCADE)
+    folder = models.ForeignKey('Folder', on_delete=models.CASCADE, related_name='upload_sessions', null=True,
+                               blank=True)
+    filename = models.CharField(max_length=255)
+    length = models.BigIntegerField()
+    file = models.OneToOneField('File', on_delete=models.SET_NULL, related_name='upload_session', null=True,
+                                blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.id})"
+
+    @property
+    def staging_path(self):
         """
-        Creates a thumbnail for video files.
+        Returns the absolute path of the staging file the chunks are written into.
+        """
+        return os.path.join(settings.MEDIA_ROOT, UPLOAD_STAGING_FOLDER, f"{self.id}.part")
 
-        This method generates a 100x100 thumbnail by extracting a frame from the video
-        at the 1-second mark and saves it as an image.
+    @property
+    def is_complete(self):
         """
-        try:
-            file_path = self.file.path
-            thumbnail_filename = os.path.join(THUMBNAIL_FOLDER, os.path.basename(self.file.name) + ".jpg")
-
-            with VideoFileClip(file_path) as clip:
-                frame = clip.get_frame(1)  # Capture frame at 1 second
-                thumbnail = Image.fromarray(frame)
-                thumbnail.thumbnail(THUMBNAIL_SIZE)
-                thumbnail.save(thumbnail_filename)
-
-            self.thumbnail = thumbnail_filename.replace("media/", "")
-            self.save()
-        except Exception as error:
-            logger.error(f"Failed to create video thumbnail for {self.file.name}: {error}")
-            self.thumbnail = DEFAULT_THUMBNAIL_PATH
-            self.save()
+        Returns True once every byte of the declared length has been received.
+        """
+        return self.get_offset() >= self.length
+
+    def allocate(self):
+        """
+        Creates the staging file and preallocates it to the declared length, so chunks can be
+        written at any offset regardless of the order they arrive in.
+        """
+        os.makedirs(os.path.dirname(self.staging_path), exist_ok=True)
+        with open(self.staging_path, "wb") as staging_file:
+            staging_file.truncate(self.length)
+
+    def write_chunk(self, offset, stream, chunk_size=UPLOAD_CHUNK_SIZE):
+        """
+        Copies a chunk from a readable stream into the staging file at the given offset.
+
+        The chunk is recorded only after its bytes are on disk, so a failed or interrupted
+        chunk can simply be sent again at the same offset.
+
+        Args:
+            offset (int): The byte offset the chunk starts at.
+            stream: A file-like object to read the chunk body from.
+            chunk_size (int): The size of the blocks read from the stream.
+
+        Returns:
+            int: The number of bytes written.
+
+        Raises:
+            ValidationError: If the chunk would extend past the declared upload length.
+        """
+        written = self._copy_chunk(offset, stream, chunk_size)
+        if written:
+            UploadChunk.objects.update_or_create(session=self, offset=offset, defaults={"length": written})
+        return written
+
+    async def awrite_chunk(self, offset, stream, chunk_size=UPLOAD_CHUNK_SIZE):
+        """
+        Async version of `write_chunk`. The bytes are copied and synced to disk in a worker
+        thread, so the event loop keeps serving other requests in the meantime.
+        """
+        written = await sync_to_async(self._copy_chunk, thread_sensitive=False)(offset, stream, chunk_size)
+        if written:
+            await UploadChunk.objects.aupdate_or_create(session=self, offset=offset, defaults={"length": written})
+        return written
+
+    def _copy_chunk(self, offset, stream, chunk_size):
+        if offset < 0 or offset > self.length:
+            raise ValidationError(f"Invalid offset {offset} for an upload of {self.length} bytes.")
+
+        written = 0
+        with stage("write_chunk"), open(self.staging_path, "r+b") as staging_file:
+            staging_file.seek(offset)
+            while True:
+                block = stream.read(chunk_size)
+                if not block:
+                    break
+                if offset + written + len(block) > self.length:
+                    raise ValidationError("Chunk exceeds the declared upload length.")
+                staging_file.write(block)
+                written += len(block)
+            staging_file.flush()
+            os.fsync(staging_file.fileno())
+        return written
+
+    def get_offset(self):
+        """
+        Returns the end of the contiguous run of bytes received from the start of the upload.
+
+        Chunks received out of order past a gap do not count until the gap is filled.
+        """
+        return self._get_contiguous_end(self.chunks.order_by("offset").values_list("offset", "length"))
+
+    async def aget_offset(self):
+        """
+        Async version of `get_offset`.
+        """
+        chunks = [chunk async for chunk in self.chunks.order_by("offset").values_list("offset", "length")]
+        return self._get_contiguous_end(chunks)
+
+    @staticmethod
+    def _get_contiguous_end(chunks):
+        offset = 0
+        for start, length in chunks:
+            if start > offset:
+                break
+            offset = max(offset, start + length)
+        return offset
+
+    def discard(self):
+        """
+        Removes the staging file, if any.
+        """
+        if os.path.isfile(self.staging_path):
+            os.remove(self.staging_path)
+
+
+class UploadChunk(models.Model):
+    """
+    A chunk of an `UploadSession` that has been written to the staging file.
+    """
+    session = models.ForeignKey('UploadSession', on_delete=models.CASCADE, related_name='chunks')
+    offset = models.BigIntegerField()
+    length = models.BigIntegerField()
 
     class Meta:
-        unique_together = ("name", "folder", "user")
+        unique_together = ("session", "offset")
+
+
+class Job(models.Model):
+    """
+    A unit of background work, such as generating a thumbnail.
+
+    Jobs are stored in the database and claimed by the `runjobs` management command with
+    `SELECT ... FOR UPDATE SKIP LOCKED`, so any number of workers on any number of nodes
+    can share the same queue. Failed jobs are retried with exponential backoff.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=JOB_MAX_ATTEMPTS)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, kind, run_at=None, **payload):
+        """
+        Adds a job to the queue.
+
+        The job is inserted in the caller's transaction, so it only becomes visible to
+        workers once the work that scheduled it has been committed.
+
+        Args:
+            kind (str): The name of the registered job handler.
+            run_at (datetime, optional): The earliest time the job may run. Defaults to now.
+            **payload: Keyword arguments passed to the job handler.
+
+        Returns:
+            Job: The created job.
+        """
+        return cls.objects.create(kind=kind, payload=payload, run_at=run_at or timezone.now())
+
+    def get_retry_delay(self):
+        """
+        Returns the delay before the next attempt, doubling with every failed attempt.
+        """
+        delay = JOB_RETRY_BACKOFF * 2 ** max(self.attempts - 1, 0)
+        return timedelta(seconds=min(delay, JOB_RETRY_BACKOFF_MAX))
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_at"]),
+        ]
+
+
+class SlowQuery(models.Model):
+    """
+    A kind of database query that ran slower than SLOW_QUERY_THRESHOLD_MS, recorded by the
+    slow-query sampler.
+
+    Queries differing only in their literal values share a fingerprint and a row, which adds up
+    how often and how long they were slow. The plans captured for some of them are kept in
+    `SlowQueryPlan`.
+    """
+    fingerprint = models.CharField(max_length=32, unique=True)
+    statement = models.TextField()
+    view = models.CharField(max_length=255, blank=True)
+    calls = models.PositiveBigIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    last_ms = models.FloatField(default=0)
+    seq_scans = models.CharField(max_length=255, blank=True)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.statement[:100]
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.calls if self.calls else 0
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-last_seen"]),
+            models.Index(fields=["-total_ms"]),
+        ]
+
+
+class SlowQueryPlan(models.Model):
+    """
+    The plan of a slow query, captured with EXPLAIN (ANALYZE, BUFFERS) right after it ran.
+    """
+    query = models.ForeignKey(SlowQuery, on_delete=models.CASCADE, related_name='plans')
+    sql = models.TextField()
+    params = models.TextField(blank=True)
+    duration_ms = models.FloatField()
+    analyzed = models.BooleanField(default=True)
+    plan = models.TextField()
+    seq_scans = models.CharField(max_length=255, blank=True)
+    view = models.CharField(max_length=255, blank=True)
+    captured_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Plan of {self.query_id} at {self.captured_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["query", "-captured_at"]),
+        ]
@@ -0,0 +1,261 @@
+import cProfile
+import functools
+import glob
+import json
+import logging
+import os
+import random
+import re
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DUMP_PATTERN = re.compile(r"^upload-(\d+)ms-")
+
+# The trace of the upload being handled, if it is sampled. Context variables are copied into
+# the threads sync_to_async runs code in, so stages running there join the same trace.
+_current_trace = ContextVar("uploadmanager_upload_trace", default=None)
+
+
+class UploadTrace:
+    """
+    The stages an upload went through, with the wall time, CPU time and, if tracemalloc
+    sampling is switched on, the peak memory allocated during each of them.
+
+    CPU time is that of the thread a stage ran in. Memory peaks are process-wide, so they are
+    only exact while a single upload is running in the process.
+    """
+
+    def __init__(self, kind, fields, request=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.fields = dict(fields)
+        self.request = request
+        self.stages = []
+        self.open_stages = []
+        self.started_at = time.perf_counter()
+        self.trace_memory = settings.UPLOAD_PROFILING_TRACEMALLOC
+        self.profile = cProfile.Profile() if settings.UPLOAD_PROFILING_SLOWEST > 0 else None
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def annotate(self, **fields):
+        """
+        Adds fields describing the upload to its trace, e.g. its size and type.
+        """
+        self.fields.update(fields)
+
+    def add_stage(self, name, wall_seconds, **fields):
+        """
+        Adds a stage that was timed elsewhere, e.g. by an upload handler.
+        """
+        self.stages.append({"stage": name, "wall_ms": _ms(wall_seconds), **fields})
+
+    @contextmanager
+    def stage(self, name):
+        outermost = not self.open_stages
+        entry = {"peak": 0}
+        self.open_stages.append(entry)
+        memory_at_start = self._reset_memory_peak() if self.trace_memory else None
+        profiling = outermost and self._enable_profile()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            if profiling:
+                self.profile.disable()
+            self.open_stages.pop()
+            record = {"stage": name, "wall_ms": _ms(wall), "cpu_ms": _ms(cpu)}
+            if memory_at_start is not None:
+                peak = max(tracemalloc.get_traced_memory()[1], entry["peak"])
+                record["peak_bytes"] = max(peak - memory_at_start, 0)
+                if self.open_stages:
+                    # An inner stage resets the peak its enclosing stages are measured with
+                    self.open_stages[-1]["peak"] = max(self.open_stages[-1]["peak"], peak)
+            if failed:
+                record["failed"] = True
+            if self.open_stages:
+                record["depth"] = len(self.open_stages)
+            self.stages.append(record)
+
+    @staticmethod
+    def _reset_memory_peak():
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        return current
+
+    def _enable_profile(self):
+        if self.profile is None:
+            return False
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Another profiler is active in this thread, e.g. that of a concurrent upload
+            return False
+        return True
+
+    def finish(self):
+        """
+        Completes the trace: passes it to the hooks and keeps its profile if the upload is
+        among the slowest.
+        """
+        wall = time.perf_counter() - self.started_at
+        receive_timings = getattr(self.request, "upload_timings", None) or []
+        stages = [{"stage": "receive", "wall_ms": _ms(seconds), "size": size} for seconds, size in receive_timings]
+        record = {
+            "event": "upload_trace",
+            "id": self.id,
+            "kind": self.kind,
+            **self.fields,
+            "wall_ms": _ms(wall),
+            "cpu_ms": _ms(sum(stage.get("cpu_ms", 0) for stage in self.stages if "depth" not in stage) / 1000),
+            "stages": stages + self.stages,
+        }
+        if self.profile is not None and self.stages:
+            record["profile"] = keep_profile_if_slowest(self.profile, wall, self.kind, self.id)
+
+        for hook in get_hooks():
+            try:
+                hook(record)
+            except Exception:
+                logger.exception("Upload profiling hook %r failed", hook)
+        return record
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+@functools.cache
+def _load_hooks(paths):
+    return [import_string(path) for path in paths]
+
+
+def get_hooks():
+    """
+    Returns the callables finished traces are passed to, from UPLOAD_PROFILING_HOOKS.
+    """
+    return _load_hooks(tuple(settings.UPLOAD_PROFILING_HOOKS))
+
+
+def log_trace(record):
+    """
+    Hook writing a finished trace to the log as a single line of JSON.
+    """
+    logger.info(json.dumps(record, separators=(",", ":")), extra={"upload_trace": record})
+
+
+@contextmanager
+def trace_upload(kind, request=None, **fields):
+    """
+    Traces an upload, if upload profiling is switched on and the upload is sampled.
+
+    Args:
+        kind (str): The kind of upload, e.g. 'form' or 'chunk'.
+        request (HttpRequest, optional): The request carrying the upload; the time its files
+            took to arrive is added as 'receive' stages.
+        **fields: Fields describing the upload, added to its trace.
+
+    Yields:
+        UploadTrace: The trace, or None if the upload is not traced.
+    """
+    if not settings.UPLOAD_PROFILING or random.random() >= settings.UPLOAD_PROFILING_SAMPLE_RATE:
+        yield None
+        return
+
+    trace = UploadTrace(kind, fields, request=request)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+
+
+def traced_upload(kind):
+    """
+    Decorator tracing the uploads handled by a view method, sync or async.
+    """
+    def decorator(method):
+        if iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def wrapper(view, request, *args, **kwargs):
+                with trace_upload(kind, request=request):
+                    return await method(view, request, *args, **kwargs)
+        else:
+            @functools.wraps(method)
+            def wrapper(view, request, *args, **kwargs):
+                with trace_upload(kind, request=request):
+                    return method(view, request, *args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def stage(name):
+    """
+    Times a stage of the upload being traced. Does nothing if no upload is being traced.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+def annotate_upload(**fields):
+    """
+    Adds fields to the trace of the upload being traced, if any.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotate(**fields)
+
+
+def keep_profile_if_slowest(profile, wall_seconds, kind, trace_id):
+    """
+    Dumps the profile of an upload if it is among the UPLOAD_PROFILING_SLOWEST slowest ones
+    dumped in UPLOAD_PROFILING_DIR, and removes the dump it replaces.
+
+    The dumps are named after the duration of their upload, so the processes sharing the
+    directory keep the slowest uploads of them all. They can be read with pstats.
+
+    Returns:
+        str: The path of the dump, or None if the upload was not slow enough.
+    """
+    keep = settings.UPLOAD_PROFILING_SLOWEST
+    directory = settings.UPLOAD_PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+
+    dumps = sorted(((_get_dump_ms(path), path) for path in glob.glob(os.path.join(directory, "upload-*.prof"))),
+                   reverse=True)
+    wall_ms = round(wall_seconds * 1000)
+    if len(dumps) >= keep and dumps[keep - 1][0] >= wall_ms:
+        return None
+
+    path = os.path.join(directory, f"upload-{wall_ms:09d}ms-{kind}-{trace_id}.prof")
+    profile.dump_stats(path)
+    for _, stale_path in dumps[keep - 1:]:
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+    return path
+
+
+def _get_dump_ms(path):
+    match = PROFILE_DUMP_PATTERN.match(os.path.basename(path))
+    return int(match.group(1)) if match else 0
@@ -0,0 +1,169 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Set on responses to requests that wrote to the database. Until the time it holds, the
+# requests of that client read from the primary, so they see their own writes even when the
+# replicas lag behind.
+STICKY_COOKIE = "use_primary_until"
+SAFE_METHODS = {"GET", "HEAD"}
+# Bookkeeping written while serving any request, which is not data of the client's own and so
+# does not make it read from the primary afterwards
+UNTRACKED_WRITES = {"sessions.Session", "uploadmanager.Job", "uploadmanager.SlowQuery", "uploadmanager.SlowQueryPlan"}
+
+# The routing state of the request being handled. Context variables are copied into the
+# threads sync_to_async runs code in, so the queries of async views are routed as well.
+_request_routing = ContextVar("uploadmanager_request_routing", default=None)
+_primary_only = ContextVar("uploadmanager_primary_only", default=False)
+
+
+class RequestRouting:
+    """
+    Whether the queries of a request may read from a replica, and whether it wrote.
+
+    The decision is taken on the first read, once the URL has been resolved, as it depends
+    on the view. A request that wrote reads from the primary from then on.
+    """
+    __slots__ = ("request", "sticky", "replica", "wrote")
+
+    def __init__(self, request, sticky):
+        self.request = request
+        self.sticky = sticky
+        self.replica = None
+        self.wrote = False
+
+    def get_replica(self):
+        if self.replica is None:
+            self.replica = choose_replica(self.request) if not self.sticky else ""
+        return self.replica
+
+
+def get_replicas():
+    """
+    Returns the aliases of the read replicas in DATABASES.
+    """
+    return settings.DATABASE_REPLICAS
+
+
+def choose_replica(request):
+    """
+    Returns the replica a request reads from, or '' if it reads from the primary.
+
+    Only GET and HEAD requests to views with `use_read_replica = True` and to the admin are
+    served from a replica.
+    """
+    replicas = get_replicas()
+    resolver_match = getattr(request, "resolver_match", None)
+    if not replicas or resolver_match is None or request.method not in SAFE_METHODS:
+        return ""
+    view_class = getattr(resolver_match.func, "view_class", None)
+    if getattr(view_class, "use_read_replica", False) or resolver_match.namespace == "admin":
+        return random.choice(replicas)
+    return ""
+
+
+@contextmanager
+def use_primary():
+    """
+    Makes the reads in its block go to the primary, e.g. to fill a cache other requests read.
+    """
+    token = _primary_only.set(True)
+    try:
+        yield
+    finally:
+        _primary_only.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Database router sending the reads of read-only requests to the replicas in
+    DATABASE_REPLICAS, and everything else to the primary.
+
+    Reads go to the primary outside of requests, e.g. in the job workers, inside transactions,
+    after the request wrote, and for REPLICA_STICKY_SECONDS after a request of the same client
+    wrote. Migrations only run on the primary.
+
+    Only the writes of requests other than GET and HEAD count, and not those of the bookkeeping
+    models in UNTRACKED_WRITES, so a GET saving its session or recording a slow
+    query keeps reading from the replicas.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = _request_routing.get()
+        if routing is None or routing.wrote or _primary_only.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return routing.get_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        routing = _request_routing.get()
+        if (routing is not None and routing.request.method not in SAFE_METHODS
+                and model._meta.label not in UNTRACKED_WRITES):
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replicas():
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Middleware tracking the routing state of every request for `ReplicaRouter`, and making
+    the client read from the primary for a while after it wrote.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        routing = self.start(request)
+        token = _request_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_routing.reset(token)
+        return self.finish(routing, response)
+
+    async def __acall__(self, request):
+        routing = self.start(request)
+        token = _request_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_routing.reset(token)
+        return self.finish(routing, response)
+
+    @staticmethod
+    def start(request):
+        try:
+            sticky = float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        return RequestRouting(request, sticky)
+
+    @staticmethod
+    def finish(routing, response):
+        if routing.wrote and get_replicas():
+            until = time.time() + settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(STICKY_COOKIE, f"{until:.0f}", max_age=settings.REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite="Lax")
+        return response
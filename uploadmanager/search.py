@@ -0,0 +1,126 @@
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Cast
+
+from .models import SEARCH_CONFIG, File, Folder
+
+SearchResult = namedtuple("SearchResult", ["kind", "object", "display_path"])
+
+
+def encode_search_cursor(hit):
+    """
+    Encodes the position of the last hit of a page of search results into an opaque cursor.
+    """
+    raw = json.dumps([hit["rank"], hit["name"], hit["kind"], hit["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_search_cursor(cursor):
+    """
+    Decodes a cursor produced by `encode_search_cursor`.
+
+    Returns:
+        tuple: (rank, name, kind, id), or None if the cursor is missing or invalid.
+    """
+    if not cursor:
+        return None
+    try:
+        rank, name, kind, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if kind not in ("file", "folder"):
+            return None
+        return float(rank), str(name), kind, int(pk)
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        return None
+
+
+def _after(hits, kind, position):
+    """
+    Restricts ranked hits of one kind to those coming after a position in the order of
+    `search`, i.e. (-rank, name, kind, id). The rank is compared exactly, as it is computed
+    the same way every time.
+    """
+    rank, name, after_kind, pk = position
+    following = Q(rank__lt=rank) | Q(rank=rank, name__gt=name)
+    if kind > after_kind:
+        following |= Q(rank=rank, name=name)
+    elif kind == after_kind:
+        following |= Q(rank=rank, name=name, id__gt=pk)
+    return hits.filter(following)
+
+
+def _ranked(queryset, kind, search_query):
+    """
+    Filters a File or Folder queryset by name and annotates each hit with its relevance.
+
+    A row matches if the query matches whole words of its name (through the `search_vector`
+    GIN index) or appears anywhere in its name (through the trigram GIN index on UPPER(name),
+    which also serves `icontains`). Whole-word matches rank above partial ones, and names
+    closer to the query rank higher.
+    """
+    query = SearchQuery(search_query, search_type="websearch", config=SEARCH_CONFIG)
+    return (
+        queryset.filter(Q(search_vector=query) | Q(name__icontains=search_query))
+        .annotate(
+            kind=Value(kind),
+            rank=Cast(SearchRank(F("search_vector"), query) + TrigramSimilarity("name", search_query), FloatField()),
+        )
+        .values("kind", "id", "name", "rank")
+    )
+
+
+def search(user, search_query, after=None):
+    """
+    Searches a user's files and folders by name.
+
+    Args:
+        user (CustomUser): The owner of the files and folders.
+        search_query (str): The text to search for.
+        after (tuple, optional): A position decoded by `decode_search_cursor`; only the hits
+            after it are returned, so results can be paged through with keyset cursors.
+
+    Returns:
+        QuerySet: A single ranked list of hits, as dictionaries with 'kind' ('file' or 'folder'),
+            'id', 'name' and 'rank' keys, most relevant first. It can be paginated directly.
+    """
+    files = _ranked(File.objects.filter(user=user), "file", search_query)
+    folders = _ranked(Folder.objects.filter(user=user), "folder", search_query)
+    if after is not None:
+        files, folders = _after(files, "file", after), _after(folders, "folder", after)
+    return files.union(folders, all=True).order_by("-rank", "name", "kind", "id")
+
+
+def resolve(hits):
+    """
+    Loads the files and folders behind a page of search hits, with their display paths.
+
+    Only a fixed number of queries is run, however many hits there are: one for the files,
+    one for the folders and one for the names of all their ancestors.
+
+    Args:
+        hits (iterable): Hits as returned by `search`.
+
+    Returns:
+        list: A SearchResult for each hit, in the same order.
+    """
+    hits = list(hits)
+    file_ids = [hit["id"] for hit in hits if hit["kind"] == "file"]
+    folder_ids = [hit["id"] for hit in hits if hit["kind"] == "folder"]
+
+    files = File.objects.select_related("folder").in_bulk(file_ids)
+    folders = Folder.objects.in_bulk(folder_ids)
+
+    paths = Folder.get_display_paths({file.folder for file in files.values() if file.folder} | set(folders.values()))
+
+    results = []
+    for hit in hits:
+        if hit["kind"] == "file" and hit["id"] in files:
+            file = files[hit["id"]]
+            results.append(SearchResult("file", file, paths[file.folder_id] if file.folder_id else "Home"))
+        elif hit["kind"] == "folder" and hit["id"] in folders:
+            results.append(SearchResult("folder", folders[hit["id"]], paths[hit["id"]]))
+    return results
@@ -1,46 +1,172 @@
-import os
-import time
+from django.contrib.auth import get_user_model
 from django.dispatch import receiver
-from django.db.models.signals import post_delete
-from .models import File
+from django.db.backends.signals import connection_created
+from django.db.models.base import DEFERRED
+from django.db.models.signals import post_delete, post_save, pre_delete
+from .caching import invalidate_listings
+from .metrics import install_query_timer
+from .models import FOLDER_TOTAL_FIELDS, Blob, File, Folder, Job, StorageUsage
+from .slowqueries import install_slow_query_sampler
 
 
 @receiver(post_delete, sender=File)
 def delete_file_on_model_delete(sender, instance, **kwargs):
     """
-    Signal handler to delete the file and its thumbnail from the filesystem
-    when a File model instance is deleted.
+    Signal handler to release the stored content of a File model instance when it is deleted.
 
     Args:
         sender (Model): The model class that sent the signal (File).
         instance (File): The instance of the File model being deleted.
         **kwargs: Additional keyword arguments.
 
-    This function attempts to delete the file and its associated thumbnail.
-    It will retry up to 5 times if the file is being used (i.e., a `PermissionError` occurs).
-    """
-    if instance.file:
-        file_path = instance.file.path
-        attempts = 5
-        for _ in range(attempts):
-            try:
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-                break
-            except PermissionError as e:
-                time.sleep(0.1)  # Wait and retry if file is being used
-            else:
-                raise e
-
-    if instance.thumbnail:
-        thumbnail_path = instance.thumbnail.path
-        attempts = 5
-        for _ in range(attempts):
-            try:
-                if os.path.isfile(thumbnail_path):
-                    os.remove(thumbnail_path)
-                break
-            except PermissionError as e:
-                time.sleep(0.1)  # Wait and retry if file is being used
-            else:
-                raise e
+    Content shared through a blob is only removed once the last file referencing it is deleted.
+    Files stored before blobs existed own their content, which is removed right away by a
+    background job once the deletion has been committed.
+    """
+    if instance.blob_id:
+        Blob.release(instance.blob_id)
+        return
+
+    names = [field.name for field in (instance.file, instance.thumbnail) if field]
+    if names:
+        Job.enqueue("remove_stored_files", names=names)
+
+
+@receiver(post_save, sender=File)
+def add_file_to_storage_usage(sender, instance, created, **kwargs):
+    """
+    Signal handler to count a newly created file in the storage usage of its owner.
+
+    It runs inside the transaction saving the file, so the file and the counters are
+    committed together.
+    """
+    if created:
+        StorageUsage.add(instance.user_id, instance.type, instance.size or 0)
+
+
+@receiver(post_delete, sender=File)
+def remove_file_from_storage_usage(sender, instance, **kwargs):
+    """
+    Signal handler to take a deleted file out of the storage usage of its owner.
+
+    It also runs for files deleted through the cascade of a folder.
+    """
+    StorageUsage.add(instance.user_id, instance.type, -(instance.size or 0), count=-1)
+
+
+@receiver(post_save, sender=File)
+def add_file_to_folder_totals(sender, instance, created, **kwargs):
+    """
+    Signal handler to add a newly created file to the totals of its folder and all of its ancestors.
+    """
+    if created and instance.folder_id:
+        Folder.shift_totals([], instance.folder.get_lineage_ids(), size=instance.size or 0, files=1)
+
+
+@receiver(post_delete, sender=File)
+def remove_file_from_folder_totals(sender, instance, origin=None, **kwargs):
+    """
+    Signal handler to take a deleted file out of the totals of its folder and all of its ancestors.
+
+    Files deleted along with a folder are skipped: the folder takes its whole subtree out of
+    the totals of its ancestors at once. Files deleted along with their owner are skipped too,
+    as all of the owner's folders are going away.
+    """
+    if not instance.folder_id or isinstance(origin, (Folder, get_user_model())):
+        return
+
+    folder = Folder.objects.filter(pk=instance.folder_id).only("path").first()
+    if folder:
+        Folder.shift_totals(folder.get_lineage_ids(), [], size=instance.size or 0, files=1)
+
+
+@receiver(pre_delete, sender=Folder)
+def remove_folder_from_folder_totals(sender, instance, origin=None, **kwargs):
+    """
+    Signal handler to take a deleted folder out of the totals of its ancestors.
+
+    When the folder is the one being deleted, its whole subtree is removed with a single
+    UPDATE of its ancestors, and the folders and files deleted with it are skipped. Folders
+    deleted some other way, e.g. in bulk from a queryset, only remove themselves, and their
+    files remove themselves.
+    """
+    if isinstance(origin, get_user_model()):
+        return
+
+    if isinstance(origin, Folder):
+        if instance.pk != origin.pk:
+            return
+        totals = Folder.objects.filter(pk=instance.pk).values(*FOLDER_TOTAL_FIELDS).first()
+        if totals:
+            Folder.shift_totals(instance.get_ancestor_ids(), [], size=totals["total_size"],
+                                files=totals["total_files"], folders=totals["total_folders"] + 1)
+        return
+
+    Folder.shift_totals(instance.get_ancestor_ids(), [], folders=1)
+
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+def invalidate_file_listings(sender, instance, origin=None, **kwargs):
+    """
+    Signal handler to invalidate the cached listings showing a saved or deleted file, including
+    those of the folder it was moved out of.
+
+    Files deleted along with a folder or their owner are skipped: the folder invalidates the
+    listings of its ancestors itself, and nobody can see the others anymore.
+    """
+    if isinstance(origin, (Folder, get_user_model())):
+        return
+
+    folder_ids = {instance.folder_id}
+    loaded_folder_id = getattr(instance, "_loaded_folder_id", DEFERRED)
+    if loaded_folder_id is not DEFERRED:
+        folder_ids.add(loaded_folder_id)
+    folders = Folder.all_objects.filter(pk__in=folder_ids - {None}).only("id", "path")
+    invalidate_listings(instance.user_id, [None, *folders])
+
+
+@receiver(post_save, sender=Folder)
+@receiver(post_delete, sender=Folder)
+def invalidate_folder_listings(sender, instance, origin=None, **kwargs):
+    """
+    Signal handler to invalidate the cached listings showing a saved or deleted folder, including
+    those of the parent it was moved out of.
+
+    Subfolders deleted along with a folder, and folders deleted along with their owner, are
+    skipped, as nobody can see their listings anymore.
+    """
+    if isinstance(origin, get_user_model()) or (isinstance(origin, Folder) and origin.pk != instance.pk):
+        return
+
+    folders = [instance]
+    loaded_parent_id = getattr(instance, "_loaded_parent_id", DEFERRED)
+    if loaded_parent_id not in (DEFERRED, None, instance.is_parent_id):
+        folders += Folder.all_objects.filter(pk=loaded_parent_id).only("id", "path")
+    invalidate_listings(instance.user_id, folders)
+
+
+@receiver(post_delete, sender=Blob)
+def delete_blob_on_model_delete(sender, instance, **kwargs):
+    """
+    Signal handler to have the stored content and thumbnail of a blob removed from the filesystem
+    by a background job once the blob itself is deleted.
+
+    Args:
+        sender (Model): The model class that sent the signal (Blob).
+        instance (Blob): The instance of the Blob model being deleted.
+        **kwargs: Additional keyword arguments.
+    """
+    names = [field.name for field in (instance.file, instance.thumbnail) if field]
+    if names:
+        Job.enqueue("remove_stored_files", names=names)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    """
+    Signal handler timing the queries of every new database connection, in any thread, for
+    the per-request query metrics and the slow-query sampler.
+    """
+    install_query_timer(connection)
+    install_slow_query_sampler(connection)
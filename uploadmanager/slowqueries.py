@@ -0,0 +1,244 @@
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .metrics import get_current_view_name
+from .models import SlowQuery, SlowQueryPlan
+
+logger = logging.getLogger(__name__)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w.\"])-?\d+(?:\.\d+)?\b")
+VALUE_LIST = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+WHITESPACE = re.compile(r"\s+")
+SEQ_SCAN = re.compile(r"Seq Scan on (\w+)")
+# EXPLAIN ANALYZE runs the query again, so it is only used for queries that do not lock rows or
+# have other side effects. The others get a plain EXPLAIN, with estimated costs only.
+UNSAFE_TO_ANALYZE = re.compile(r"\bFOR\s+(?:UPDATE|SHARE|NO\s+KEY\s+UPDATE|KEY\s+SHARE)\b|\bnextval\s*\(|\bpg_advisory",
+                               re.IGNORECASE)
+
+SLOW_QUERY_QUEUE_SIZE = 100  # Slow queries waiting for the recorder thread; further ones are dropped
+
+# Set while the sampler runs its own queries, so they are not sampled in turn
+_sampling = ContextVar("uploadmanager_slow_query_sampling", default=False)
+
+# Records the slow queries of this process, one at a time
+_recorder = None
+_recorder_lock = threading.Lock()
+_queue_slots = threading.BoundedSemaphore(SLOW_QUERY_QUEUE_SIZE)
+
+# When each fingerprint was last explained by this process
+_explained_at = {}
+_explained_at_lock = threading.Lock()
+
+
+def fingerprint(sql):
+    """
+    Normalizes a query so queries differing only in their literal values, or in the length of
+    their IN lists, look the same.
+
+    Returns:
+        tuple: The normalized statement and its MD5 hex digest.
+    """
+    statement = STRING_LITERAL.sub("?", sql)
+    statement = NUMBER_LITERAL.sub("?", statement)
+    statement = VALUE_LIST.sub("(...)", statement)
+    statement = WHITESPACE.sub(" ", statement).strip()
+    return statement, hashlib.md5(statement.encode(), usedforsecurity=False).hexdigest()
+
+
+def redact_plan(plan):
+    """
+    Replaces the string literals of a plan, e.g. the values of its filter conditions, with '?'.
+    """
+    return STRING_LITERAL.sub("'?'", plan)
+
+
+def get_seq_scans(plan):
+    """
+    Returns the comma-separated tables a plan reads with a sequential scan.
+    """
+    return ",".join(sorted(set(SEQ_SCAN.findall(plan))))[:255]
+
+
+def sample_slow_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper recording the queries slower than SLOW_QUERY_THRESHOLD_MS, and
+    capturing the plans of some of them.
+
+    Only a share of the slow queries, SLOW_QUERY_SAMPLE_RATE, is recorded. Each fingerprint is
+    explained at most once every SLOW_QUERY_EXPLAIN_INTERVAL seconds per process, by the
+    recorder thread. A failure of the sampler is logged, and never affects the query.
+    """
+    threshold = settings.SLOW_QUERY_THRESHOLD_MS
+    if not threshold or many or _sampling.get():
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration_ms = (time.perf_counter() - start) * 1000
+
+    if duration_ms >= threshold and random.random() < settings.SLOW_QUERY_SAMPLE_RATE:
+        token = _sampling.set(True)
+        try:
+            record_slow_query(context["connection"], sql, params, duration_ms)
+        except Exception:
+            logger.exception("Could not record a slow query")
+        finally:
+            _sampling.reset(token)
+    return result
+
+
+def install_slow_query_sampler(connection):
+    """
+    Installs `sample_slow_query` on a database connection, once. Only PostgreSQL is supported.
+    """
+    if connection.vendor == "postgresql" and sample_slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sample_slow_query)
+
+
+def record_slow_query(connection, sql, params, duration_ms):
+    """
+    Hands a slow query to the recorder thread, which adds it to the `SlowQuery` of its
+    fingerprint, with a plan if it is due for one.
+
+    The EXPLAIN and the writes run off the request path, on connections of their own, once
+    the current transaction of the connection the query ran on, if any, is committed: a
+    request is neither slowed down by the EXPLAIN ANALYZE running its query again, nor seen as
+    writing by the replica router. Queries arriving while SLOW_QUERY_QUEUE_SIZE others are
+    waiting are dropped.
+
+    The values the query ran with, e.g. emails and file names, are only stored with its plan if
+    SLOW_QUERY_STORE_PARAMS is set. Otherwise the plan keeps the normalized statement, and the
+    string literals of the plan itself are redacted.
+    """
+    statement, digest = fingerprint(sql)
+    view = get_current_view_name()
+    analyze = None
+    if sql.lstrip("( \n")[:6].upper() == "SELECT" and _is_due_for_plan(digest):
+        analyze = duration_ms <= settings.SLOW_QUERY_ANALYZE_MAX_MS and not UNSAFE_TO_ANALYZE.search(sql)
+    sample = (connection.alias, digest, statement, view, duration_ms, sql, params, analyze)
+
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: submit_sample(sample), using=connection.alias)
+    else:
+        submit_sample(sample)
+
+
+def submit_sample(sample):
+    """
+    Queues a slow query for the recorder thread, unless the queue is full.
+    """
+    if not _queue_slots.acquire(blocking=False):
+        logger.warning("Dropped a slow query sample, as %d others are waiting", SLOW_QUERY_QUEUE_SIZE)
+        return
+    _get_recorder().submit(_record_sample, sample)
+
+
+def _get_recorder():
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-recorder")
+        return _recorder
+
+
+def _record_sample(sample):
+    alias, digest, statement, view, duration_ms, sql, params, analyze = sample
+    # The recorder's own queries are not sampled
+    token = _sampling.set(True)
+    try:
+        plan = None
+        if analyze is not None:
+            plan = (explain(connections[alias], sql, params, analyze=analyze), analyze)
+        if settings.SLOW_QUERY_STORE_PARAMS:
+            params = repr(params)
+        else:
+            sql, params = statement, ""
+            if plan is not None:
+                plan = (redact_plan(plan[0]), plan[1])
+        _save(digest, statement, view, duration_ms, sql, params, plan)
+    except Exception:
+        logger.exception("Could not record a slow query")
+    finally:
+        _sampling.reset(token)
+        _queue_slots.release()
+        close_old_connections()
+
+
+def _is_due_for_plan(digest):
+    now = time.monotonic()
+    with _explained_at_lock:
+        if now - _explained_at.get(digest, float("-inf")) < settings.SLOW_QUERY_EXPLAIN_INTERVAL:
+            return False
+        _explained_at[digest] = now
+        return True
+
+
+def explain(connection, sql, params, analyze=True):
+    """
+    Returns the plan of a query as text.
+
+    The query is explained with a cursor of the underlying driver, so the execute wrappers are
+    not run again.
+
+    Args:
+        connection (BaseDatabaseWrapper): A connection to the database the query ran on.
+        sql (str): The query, with placeholders.
+        params: The parameters of the query.
+        analyze (bool): Run the query with EXPLAIN (ANALYZE, BUFFERS) for actual times and
+            buffer counts, rather than only estimating its costs.
+    """
+    options = "ANALYZE, BUFFERS, FORMAT TEXT" if analyze else "FORMAT TEXT"
+    connection.ensure_connection()
+    with connection.connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN ({options}) {sql}", params)
+        rows = cursor.fetchall()
+    return "\n".join(row[0] for row in rows)
+
+
+def _save(digest, statement, view, duration_ms, sql, params, plan):
+    changes = {
+        "calls": F("calls") + 1,
+        "total_ms": F("total_ms") + duration_ms,
+        "max_ms": Greatest(F("max_ms"), duration_ms),
+        "last_ms": duration_ms,
+        "last_seen": timezone.now(),
+    }
+    if view:
+        changes["view"] = view
+    if plan is not None:
+        changes["seq_scans"] = get_seq_scans(plan[0])
+
+    with transaction.atomic():
+        queries = SlowQuery.objects.filter(fingerprint=digest)
+        if not queries.update(**changes):
+            try:
+                with transaction.atomic():
+                    SlowQuery.objects.create(
+                        fingerprint=digest, statement=statement, view=view, calls=1, total_ms=duration_ms,
+                        max_ms=duration_ms, last_ms=duration_ms, seq_scans=changes.get("seq_scans", ""),
+                    )
+            except IntegrityError:
+                # Another process recorded the first one at the same time
+                queries.update(**changes)
+
+        if plan is not None:
+            query_id = queries.values_list("id", flat=True).get()
+            text, analyzed = plan
+            SlowQueryPlan.objects.create(query_id=query_id, sql=sql, params=params, duration_ms=duration_ms,
+                                         analyzed=analyzed, plan=text, seq_scans=get_seq_scans(text), view=view)
+            stale = (SlowQueryPlan.objects.filter(query_id=query_id).order_by("-captured_at")
+                     .values_list("id", flat=True)[settings.SLOW_QUERY_PLANS_KEPT:])
+            SlowQueryPlan.objects.filter(id__in=list(stale)).delete()
@@ -1,3 +1,299 @@
-from django.test import TestCase
+import os
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from .caching import get_listing_version, invalidate_listings
+from .deletion import purge_deleted, trash
+from .downloads import MAX_RANGES, parse_range_header, serve_file
+from .listings import decode_cursor, encode_cursor, get_listing_page
+from .models import Blob, File, Folder, SlowQuery, StorageUsage, get_free_name, retry_on_conflict
+from .replicas import STICKY_COOKIE, ReplicaMiddleware
+from .slowqueries import _get_recorder
+
+
+class ReconcileUsageTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="owner@example.com", password="password")
+        self.image, self.video = File.all_objects.bulk_create([
+            File(user=self.user, name="photo.jpg", file="files/photo.jpg", size=100, type="image"),
+            File(user=self.user, name="clip.mp4", file="files/clip.mp4", size=50, type="video"),
+        ])
+        StorageUsage.add(self.user.pk, "image", 100)
+        StorageUsage.add(self.user.pk, "video", 50)
+
+    def reconcile(self):
+        call_command("reconcile_usage", user_ids=[self.user.pk], stdout=StringIO())
+        return StorageUsage.objects.get(user=self.user)
+
+    def test_trashed_files_count_until_purged(self):
+        trash(self.user, files=[self.image.pk])
+
+        usage = self.reconcile()
+        self.assertEqual((usage.bytes_used, usage.file_count, usage.image_count), (150, 2, 1))
+
+        purge_deleted(self.user.pk)
+        usage = StorageUsage.objects.get(user=self.user)
+        self.assertEqual((usage.bytes_used, usage.file_count, usage.image_count), (50, 1, 0))
+
+        usage = self.reconcile()
+        self.assertEqual((usage.bytes_used, usage.file_count, usage.image_bytes, usage.video_bytes), (50, 1, 0, 50))
+
+
+class PurgeDeletedTests(TestCase):
+    def test_rows_of_other_users_inside_trashed_folders_are_purged(self):
+        owner = get_user_model().objects.create_user(email="owner@example.com", password="password")
+        other = get_user_model().objects.create_user(email="other@example.com", password="password")
+        folder = Folder.objects.create(name="Shared", user=owner)
+        subfolder = Folder.objects.create(name="Added", user=other, is_parent=folder)
+        File.all_objects.bulk_create([
+            File(user=owner, folder=folder, name="photo.jpg", file="files/photo.jpg", size=100, type="image"),
+            File(user=other, folder=subfolder, name="clip.mp4", file="files/clip.mp4", size=50, type="video"),
+        ])
+        StorageUsage.add(owner.pk, "image", 100)
+        StorageUsage.add(other.pk, "video", 50)
+
+        trash(owner, folders=[folder])
+        purge_deleted(owner.pk)
+        connection.check_constraints()
+
+        self.assertFalse(Folder.all_objects.filter(pk__in=[folder.pk, subfolder.pk]).exists())
+        self.assertFalse(File.all_objects.filter(user__in=[owner, other]).exists())
+        usage = StorageUsage.objects.get(user=other)
+        self.assertEqual((usage.bytes_used, usage.file_count, usage.video_count), (0, 0, 0))
+
+
+@override_settings(DATABASE_REPLICAS=["default"], SLOW_QUERY_THRESHOLD_MS=0.001, SLOW_QUERY_SAMPLE_RATE=1.0)
+class ReplicaStickinessTests(TestCase):
+    def tearDown(self):
+        # The recorder thread commits its rows on a connection of its own
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0):
+            _get_recorder().submit(lambda: SlowQuery.objects.all().delete()).result()
+
+    def handle(self, request, view):
+        def get_response(request):
+            with self.captureOnCommitCallbacks(execute=True):
+                view()
+            return HttpResponse()
+
+        return ReplicaMiddleware(get_response)(request)
+
+    def test_get_recording_a_slow_query_is_not_sticky(self):
+        response = self.handle(RequestFactory().get("/"), lambda: list(File.objects.filter(name="photo.jpg")))
+        _get_recorder().submit(lambda: None).result()
+
+        self.assertTrue(SlowQuery.objects.exists())
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_post_writing_is_sticky(self):
+        def create_user():
+            get_user_model().objects.create_user(email="new@example.com", password="password")
+
+        response = self.handle(RequestFactory().post("/"), create_user)
+
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+
+class ListingPaginationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="owner@example.com", password="password")
+        for name in ("A", "B", "C"):
+            Folder.objects.create(name=name, user=self.user)
+        File.all_objects.bulk_create([
+            File(user=self.user, name=f"{name}.jpg", file=f"files/{name}.jpg", size=1, type="image")
+            for name in ("a", "b", "c", "d")
+        ])
+        # Rows created at the same time are told apart by their id
+        created_at = timezone.now()
+        Folder.objects.filter(user=self.user).update(created_at=created_at)
+        File.objects.filter(user=self.user, name__in=["b.jpg", "c.jpg"]).update(created_at=created_at)
+
+    def test_cursor_round_trip(self):
+        created_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor("file", created_at, 42)), ("file", created_at, 42))
+
+    def test_invalid_cursors_start_over(self):
+        for cursor in (None, "", "not base64!", "Zm9v", encode_cursor("user", timezone.now(), 1)):
+            self.assertIsNone(decode_cursor(cursor))
+
+    def test_pages_cover_folders_then_files_newest_first(self):
+        rows, cursor = [], None
+        while True:
+            page = get_listing_page(self.user, cursor=cursor, page_size=2)
+            rows += [*page.folders, *page.files]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+        folders = Folder.objects.filter(user=self.user).order_by("-created_at", "-id")
+        files = File.objects.filter(user=self.user).order_by("-created_at", "-id")
+        self.assertEqual(rows, [*folders, *files])
+
+
+class RangeHeaderTests(TestCase):
+    def test_parse_range_header(self):
+        cases = [
+            (None, None),
+            ("items=0-9", None),
+            ("bytes=0-9", [(0, 9)]),
+            ("bytes=90-", [(90, 99)]),
+            ("bytes=-10", [(90, 99)]),
+            ("bytes=-1000", [(0, 99)]),
+            ("bytes=0-1000", [(0, 99)]),
+            ("bytes=0-0,-1", [(0, 0), (99, 99)]),
+            ("bytes=9-0", None),
+            ("bytes=-", None),
+            ("bytes=100-", []),
+            ("bytes=-0", []),
+            ("bytes=" + ",".join(["0-0"] * (MAX_RANGES + 1)), None),
+        ]
+        for header, expected in cases:
+            with self.subTest(header=header):
+                self.assertEqual(parse_range_header(header, 100), expected)
+
+
+@override_settings(DOWNLOAD_OFFLOAD="")
+class ServeFileTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "data.bin")
+        self.content = bytes(range(100))
+        with open(self.path, "wb") as file:
+            file.write(self.content)
+
+    def serve(self, headers):
+        response = serve_file(RequestFactory().get("/", headers=headers), self.path, "data.bin", etag="abc")
+        self.addCleanup(response.close)
+        return response
+
+    def test_range(self):
+        response = self.serve({"Range": "bytes=10-19"})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+
+    def test_multiple_ranges(self):
+        response = self.serve({"Range": "bytes=0-0,-1"})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response["Content-Type"].startswith("multipart/byteranges; boundary="))
+        body = b"".join(response.streaming_content)
+        self.assertEqual(len(body), int(response["Content-Length"]))
+        self.assertIn(b"Content-Range: bytes 99-99/100\r\n\r\n" + self.content[99:], body)
+
+    def test_if_range_current(self):
+        response = self.serve({"Range": "bytes=10-19", "If-Range": '"abc"'})
+
+        self.assertEqual(response.status_code, 206)
+
+    def test_if_range_stale_sends_whole_file(self):
+        response = self.serve({"Range": "bytes=10-19", "If-Range": '"old"'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_unsatisfiable_range(self):
+        response = self.serve({"Range": "bytes=100-"})
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */100")
+
+
+class NameAllocationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="owner@example.com", password="password")
+        self.blob = Blob.objects.create(checksum="0" * 64, file="blobs/photo.jpg", size=1)
+
+    def create_file(self, name, folder=None):
+        file = File(user=self.user, folder=folder, name=name, file=self.blob.file.name, size=1, type="image",
+                    checksum=self.blob.checksum, blob=self.blob, thumbnail="thumbnails/photo.jpg")
+        file.save()
+        return file
+
+    def test_get_free_name(self):
+        taken = {"IMG.jpg", "IMG (2).jpg", "IMG (4).jpg"}
+
+        self.assertEqual(get_free_name("new.jpg", taken, keep_extension=True), "new.jpg")
+        self.assertEqual(get_free_name("IMG.jpg", taken, keep_extension=True), "IMG (3).jpg")
+        self.assertEqual(get_free_name("IMG.jpg", taken, keep_extension=True, skip=1), "IMG (5).jpg")
+        self.assertEqual(get_free_name("IMG.jpg", taken), "IMG.jpg (2)")
+        self.assertEqual(get_free_name("abcdef.jpg", {"abcdef.jpg"}, keep_extension=True, max_length=10),
+                         "ab (2).jpg")
+
+    def test_taken_names_are_numbered(self):
+        folder = Folder.objects.create(name="Photos", user=self.user)
+
+        names = [self.create_file("IMG.jpg").name for _ in range(3)]
+        names.append(self.create_file("IMG.jpg", folder=folder).name)
+
+        self.assertEqual(names, ["IMG.jpg", "IMG (2).jpg", "IMG (3).jpg", "IMG.jpg"])
+
+    def test_names_of_trashed_files_are_free(self):
+        trash(self.user, files=[self.create_file("IMG.jpg").pk])
+
+        self.assertEqual(self.create_file("IMG.jpg").name, "IMG.jpg")
+
+    def test_retry_on_conflict(self):
+        self.create_file("IMG.jpg")
+        attempts = []
+
+        def insert(attempt):
+            # The first run misses the existing name, as if a concurrent save had just taken it
+            attempts.append(attempt)
+            name = "IMG.jpg" if attempt == 1 else "IMG (2).jpg"
+            return File.all_objects.bulk_create([File(user=self.user, name=name, file="files/IMG.jpg", size=1)])
+
+        [file] = retry_on_conflict(insert)
+
+        self.assertEqual((attempts, file.name), ([1, 2], "IMG (2).jpg"))
+
+    def test_retry_on_conflict_gives_up(self):
+        self.create_file("IMG.jpg")
+
+        def insert(attempt):
+            File.all_objects.bulk_create([File(user=self.user, name="IMG.jpg", file="files/IMG.jpg", size=1)])
+
+        with self.assertRaises(IntegrityError):
+            retry_on_conflict(insert, attempts=2)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ListingCacheTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="owner@example.com", password="password")
+        self.folder = Folder.objects.create(name="Photos", user=self.user)
+        self.subfolder = Folder.objects.create(name="2024", user=self.user, is_parent=self.folder)
+
+    def get_versions(self):
+        return [get_listing_version(self.user.pk, folder_id) for folder_id in (None, self.folder.pk, self.subfolder.pk)]
+
+    def test_versions_are_bumped_on_commit(self):
+        versions = self.get_versions()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_listings(self.user.pk, [self.subfolder])
+            self.assertEqual(self.get_versions(), versions)
+
+        self.assertTrue(all(new != old for new, old in zip(self.get_versions(), versions)))
+
+    def test_unchanged_listing_is_not_modified(self):
+        self.client.force_login(self.user)
+        response = self.client.get("/")
+        etag = response["ETag"]
+
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Folder.objects.create(name="Videos", user=self.user)
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
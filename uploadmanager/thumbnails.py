@@ -0,0 +1,55 @@
+import subprocess
+
+from imageio_ffmpeg import get_ffmpeg_exe
+
+POSTER_TIMEOUT = 15  # Seconds before a poster extraction is abandoned
+
+
+class PosterExtractionError(Exception):
+    """
+    Raised when no frame could be extracted from a video.
+    """
+
+
+def _run_ffmpeg(path, position, size, timeout):
+    width, height = size
+    command = [
+        get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-nostdin",
+        # Input options: seek on the demuxer to the keyframe before `position` and decode keyframes only
+        "-skip_frame", "nokey", "-noaccurate_seek", "-ss", str(position), "-i", path,
+        # Output options: one frame, downscaled by ffmpeg, as a JPEG on stdout
+        "-an", "-sn", "-frames:v", "1",
+        "-vf", f"scale=w={width}:h={height}:force_original_aspect_ratio=decrease",
+        "-f", "image2pipe", "-vcodec", "mjpeg", "-",
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, check=False)
+    return result.stdout, result.stderr.decode(errors="replace").strip()
+
+
+def extract_video_poster(path, size, position=1, timeout=POSTER_TIMEOUT):
+    """
+    Extracts a small poster image from a video with ffmpeg.
+
+    ffmpeg seeks straight to the keyframe nearest before `position` without decoding the frames
+    leading up to it, and scales the frame down itself, so the full-resolution frame never
+    reaches Python. Clips shorter than `position` fall back to their first frame.
+
+    Args:
+        path (str): The path of the video file.
+        size (tuple): The maximum (width, height) of the poster; the aspect ratio is kept.
+        position (float): The time in seconds to take the frame from.
+        timeout (float): The maximum number of seconds each ffmpeg run may take.
+
+    Returns:
+        bytes: The poster as a JPEG image.
+
+    Raises:
+        PosterExtractionError: If ffmpeg produced no frame.
+        subprocess.TimeoutExpired: If ffmpeg ran for longer than `timeout`.
+    """
+    poster, error = _run_ffmpeg(path, position, size, timeout)
+    if not poster and position:
+        poster, error = _run_ffmpeg(path, 0, size, timeout)
+    if not poster:
+        raise PosterExtractionError(f"ffmpeg extracted no frame from {path}: {error}")
+    return poster
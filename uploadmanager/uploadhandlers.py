@@ -0,0 +1,118 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+
+from .metrics import record_upload
+from .models import MIME_SNIFF_BYTES, StorageUsage, get_max_file_size, validate_mime_type
+
+
+class ValidatingUploadHandler(FileUploadHandler):
+    """
+    Upload handler rejecting unsupported or oversize files while they are still arriving.
+
+    It must come first in FILE_UPLOAD_HANDLERS. The MIME type is sniffed as soon as the first
+    MIME_SNIFF_BYTES of a file have arrived, and the size limit for that type is checked on every
+    chunk. A file breaking either rule aborts the upload and resets the connection, so the rest of
+    the request body is neither read nor written to disk. The reason is stored in
+    `request.upload_errors` so the view can report it.
+
+    Views receiving many files at once set `skip_invalid_files = True`. For them only the
+    offending file is skipped, and the rest of the request is still processed. Skipped files are
+    recorded in `request.rejected_uploads`, keyed by their field name and their position among
+    the files of that field.
+
+    For views with `enforce_quota = True`, the size of the whole request is checked against the
+    user's available storage before its body is parsed. If it cannot fit, the user's
+    `StorageUsage` is set as `request.quota_exceeded` and the upload is aborted at its first
+    file, so only the form fields before it are read.
+
+    Chunks are passed on unchanged to the next handler, which does the actual storing.
+    Only requests routed to the uploadmanager app are checked. The size of each complete file,
+    and the time between its first and last chunk, are recorded in the upload metrics and in
+    `request.upload_timings`, for the upload profiling to report as 'receive' stages.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.positions = {}
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Raising StopUpload here would not be handled by Django, so the upload is only
+        # stopped once its first file starts
+        resolver_match = getattr(self.request, 'resolver_match', None)
+        view_class = getattr(resolver_match.func, 'view_class', None) if resolver_match else None
+        user = getattr(self.request, 'user', None)
+        if getattr(view_class, 'enforce_quota', False) and user is not None and user.is_authenticated:
+            usage = StorageUsage.for_user(user)
+            if content_length > usage.get_available_bytes():
+                self.request.quota_exceeded = usage
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        resolver_match = getattr(self.request, 'resolver_match', None)
+        self.active = resolver_match is not None and resolver_match.app_name == 'uploadmanager'
+        view_class = getattr(resolver_match.func, 'view_class', None) if resolver_match else None
+        self.skip_invalid = getattr(view_class, 'skip_invalid_files', False)
+        self.position = self.positions[self.field_name] = self.positions.get(self.field_name, -1) + 1
+        self.header = b""
+        self.max_size = None
+        self.started_at = time.perf_counter()
+
+        if self.active and getattr(self.request, 'quota_exceeded', None) is not None:
+            # None of the files can be stored, so the rest of the request is not read
+            raise StopUpload(connection_reset=True)
+
+        if self.active and self.content_length and self.content_length > get_max_file_size(None):
+            self.reject(f"File size exceeds the maximum limit of {get_max_file_size(None) // (1024 * 1024)} MB.")
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+
+        if self.max_size is None:
+            self.header += raw_data[:MIME_SNIFF_BYTES - len(self.header)]
+            if len(self.header) == MIME_SNIFF_BYTES:
+                try:
+                    self.max_size = get_max_file_size(validate_mime_type(self.header))
+                except ValidationError as error:
+                    self.reject(error.messages[0])
+
+        if self.max_size is not None and start + len(raw_data) > self.max_size:
+            self.reject(f"File size exceeds the maximum limit of {self.max_size // (1024 * 1024)} MB.")
+
+        return raw_data
+
+    def file_complete(self, file_size):
+        # Files shorter than the sniffing window are left to the model validators.
+        if self.active:
+            seconds = time.perf_counter() - self.started_at
+            record_upload('multipart', file_size, seconds)
+            if not hasattr(self.request, 'upload_timings'):
+                self.request.upload_timings = []
+            self.request.upload_timings.append((seconds, file_size))
+        return None
+
+    def reject(self, message):
+        """
+        Records why the current file was rejected and aborts the rest of the upload, or only
+        skips the file for views accepting many files.
+
+        Args:
+            message (str): The validation error reported for the file's form field.
+
+        Raises:
+            SkipFile: For views with `skip_invalid_files`, asking Django to drop only this file.
+            StopUpload: Otherwise, asking Django not to read the rest of the request body.
+        """
+        if self.skip_invalid:
+            if not hasattr(self.request, 'rejected_uploads'):
+                self.request.rejected_uploads = {}
+            self.request.rejected_uploads[(self.field_name, self.position)] = (self.file_name, message)
+            raise SkipFile()
+
+        if not hasattr(self.request, 'upload_errors'):
+            self.request.upload_errors = {}
+        self.request.upload_errors[self.field_name] = message
+        raise StopUpload(connection_reset=True)
@@ -1,17 +1,31 @@
 from django.urls import path
-from . import views
+from . import api, metrics, views
 
 app_name = "uploadmanager"
 
 urlpatterns = [
     path('', views.HomeView.as_view(), name='home'),
     path('file/upload/', views.FileUploadView.as_view(), name="file_upload"),
+    path('file/upload/bulk/', views.FileBulkUploadView.as_view(), name="file_bulk_upload"),
+    path('file/upload/sessions/', views.UploadSessionCreateView.as_view(), name="upload_session_create"),
+    path('file/upload/sessions/<uuid:session_id>/', views.UploadSessionView.as_view(), name="upload_session"),
+    path('file/upload/sessions/<uuid:session_id>/finalize/', views.UploadSessionFinalizeView.as_view(),
+         name="upload_session_finalize"),
     path('file/<int:pk>/update/', views.FileUpdateView.as_view(), name="file_update"),
     path('file/<int:pk>/delete/', views.FileDeleteView.as_view(), name='file_delete'),
     path('file/<int:file_id>/', views.FileDetailView.as_view(), name='file_detail'),
+    path('file/<int:pk>/download/', views.FileDownloadView.as_view(), name='file_download'),
     path('folder/create/', views.FolderCreateView.as_view(), name='folder_create'),
+    path('folder/tree/', views.FolderTreeCreateView.as_view(), name='folder_tree_create'),
     path('folder/<slug:slug>/', views.FolderDetailView.as_view(), name='folder_detail'),
+    path('folder/<slug:slug>/download/', views.FolderDownloadView.as_view(), name='folder_download'),
     path('folder/<slug:slug>/update/', views.FolderUpdateView.as_view(), name='folder_update'),
     path('folder/<slug:slug>/delete/', views.FolderDeleteView.as_view(), name='folder_delete'),
+    path('delete/', views.BulkDeleteView.as_view(), name='bulk_delete'),
     path('search/', views.SearchView.as_view(), name='search'),
+    path('api/folders/', api.FolderListingApiView.as_view(), name='api_home'),
+    path('api/folders/<slug:slug>/', api.FolderListingApiView.as_view(), name='api_folder'),
+    path('api/files/<int:pk>/', api.FileApiView.as_view(), name='api_file'),
+    path('api/search/', api.SearchApiView.as_view(), name='api_search'),
+    path('metrics', metrics.MetricsView.as_view(), name='metrics'),
 ]
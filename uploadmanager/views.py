@@ -1,15 +1,57 @@
+import os
+import time
+
+from asgiref.sync import sync_to_async
 from django.core.exceptions import ValidationError
-from django.http import HttpResponseRedirect
+from django.core.files import File as DjangoFile
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header
 from django.views import View
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-
-from .models import Folder, File
+from django.core.paginator import Paginator
+
+from . import search
+from .archives import get_folder_entries, stream_zip
+from .bulkupload import bulk_upload, create_folder_tree
+from .caching import (LISTING_CACHE_TIMEOUT, aget_cached_listing_page, get_conditional_listing_response,
+                      get_listing_cache_key, get_listing_etag, set_listing_headers)
+from .deletion import trash
+from .downloads import iterate_in_thread, serve_file
+from .listings import get_listing_page
+from .metrics import record_upload
+from .models import Folder, File, StorageUsage, UploadSession, get_max_file_size, inspect_file
+from .profiling import annotate_upload, stage, traced_upload
 from uploadmanager.forms import FileUploadForm, FileUpdateForm, FolderCreateForm, FolderUpdateForm
 
 
-class HomeView(LoginRequiredMixin, View):
+def get_quota_error(usage):
+    """
+    Returns the message shown when an upload does not fit in the user's storage quota.
+    """
+    return (f"Not enough storage space: {usage.get_available_bytes() // (1024 * 1024)} MB "
+            f"of your {usage.get_quota() // (1024 * 1024)} MB quota is left.")
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """
+    LoginRequiredMixin for views with async handlers.
+
+    The user is loaded with the async ORM before the login check, as the lazy `request.user`
+    cannot query the database from the event loop.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+
+class HomeView(AsyncLoginRequiredMixin, View):
     """
     View for displaying the homepage with a list of files and folders for the logged-in user.
 
@@ -23,30 +65,47 @@ class HomeView(LoginRequiredMixin, View):
     Context:
         - files: List of files without a parent folder.
         - folders: List of top-level folders.
+        - next_cursor: Cursor of the next page of the listing, if any.
         - upload_form: Form for uploading files.
         - create_folder: Form for creating new folders.
         - is_empty: Boolean flag indicating if no files or folders exist.
+        - listing_cache_key: Key the rendered rows of the listing are cached under.
+
+    The listing and its rendered rows are cached under the version of the user's top level,
+    which changes whenever its contents do, and the version also serves as the page's ETag.
+    The view is async: cache hits are served from the event loop, and the listing queries and
+    the rendering run in the request's sync thread. Its queries are served by a read replica,
+    unless the user has just written something.
     """
     template_name = 'uploadmanager/home.html'
+    use_read_replica = True
+
+    async def get(self, request, *args, **kwargs):
+        cursor = request.GET.get('cursor')
+        page, version = await aget_cached_listing_page(request.user, cursor=cursor)
+
+        etag = get_listing_etag(request, version, cursor)
+        not_modified = await sync_to_async(get_conditional_listing_response)(request, etag)
+        if not_modified:
+            return not_modified
 
-    def get(self, request, *args, **kwargs):
         upload_form = FileUploadForm()
         create_folder = FolderCreateForm()
 
-        files = File.objects.filter(user=request.user, folder__isnull=True).order_by('-created_at')
-        folders = Folder.objects.filter(user=request.user, is_parent=None).order_by('-created_at')
-
-        is_empty = not files.exists() and not folders.exists()
+        is_empty = not page.files and not page.folders
 
         context = {
-            "files": files,
-            "folders": folders,
+            "files": page.files,
+            "folders": page.folders,
+            "next_cursor": page.next_cursor,
             "upload_form": upload_form,
             "create_folder": create_folder,
             "is_empty": is_empty,
+            "listing_cache_key": get_listing_cache_key(request.user.pk, None, version, cursor),
+            "listing_cache_timeout": LISTING_CACHE_TIMEOUT,
         }
 
-        return render(request, self.template_name, context)
+        return set_listing_headers(await sync_to_async(render)(request, self.template_name, context), etag)
 
 
 class FileUploadView(LoginRequiredMixin, View):
@@ -66,15 +125,19 @@ class FileUploadView(LoginRequiredMixin, View):
     """
     form_class = FileUploadForm
     template_name = 'uploadmanager/home.html'
+    enforce_quota = True
 
     def get(self, request, *args, **kwargs):
+        page = get_listing_page(request.user)
         context = {
             'upload_form': self.form_class(),
-            'files': File.objects.filter(user=request.user, folder__isnull=True),
-            'folders': Folder.objects.filter(user=request.user, is_parent=None),
+            'files': page.files,
+            'folders': page.folders,
+            'next_cursor': page.next_cursor,
         }
         return render(request, self.template_name, context)
 
+    @traced_upload('form')
     def post(self, request, *args, **kwargs):
         """
         Handles POST requests. Saves the uploaded file to the specified folder, or to the root folder if no folder is specified.
@@ -84,38 +147,314 @@ class FileUploadView(LoginRequiredMixin, View):
             - 'files': List of files in the selected folder or the user's files.
             - 'folders': List of folders in the selected folder or the user's folders.
             - 'folder': The folder the file is being uploaded to.
+            - 'nested_path': The folders leading to it, for the breadcrumb.
 
         Redirects:
             - Redirects to the folder detail page if a folder is specified, or the home page if no folder is specified.
+
+        The user's quota is checked by ValidatingUploadHandler against the size of the request,
+        before its body is parsed, so uploads that cannot fit are refused before their files
+        are read.
         """
+        # Reading the POST data parses the body, through the upload handlers
         folder_slug = request.POST.get('parent_slug')
+        usage = getattr(request, 'quota_exceeded', None)
+        if usage is not None:
+            form = self.form_class()
+            form.errors['file'] = form.error_class([get_quota_error(usage)])
+            page = get_listing_page(request.user)
+            context = {
+                'upload_form': form,
+                'files': page.files,
+                'folders': page.folders,
+                'next_cursor': page.next_cursor,
+            }
+            return render(request, self.template_name, context, status=413)
+
         folder = get_object_or_404(Folder, slug=folder_slug) if folder_slug else None
 
         form = self.form_class(request.POST, request.FILES)
-        if form.is_valid():
+        # Files rejected by ValidatingUploadHandler while they were still arriving
+        upload_errors = getattr(request, 'upload_errors', {})
+
+        if not upload_errors and form.is_valid():
             new_file = form.save(commit=False)
+            annotate_upload(size=new_file.file.size)
             new_file.folder = folder
             new_file.user = request.user
             new_file.save()
             return HttpResponseRedirect(f'/folder/{folder.slug}/' if folder else '/')
 
+        for field, message in upload_errors.items():
+            form.errors[field] = form.error_class([message])
+
+        page = get_listing_page(folder.user if folder else request.user, folder)
         context = {
             'upload_form': form,
-            'files': File.objects.filter(folder=folder) if folder else File.objects.filter(user=request.user,
-                                                                                           folder__isnull=True),
-            'folders': Folder.objects.filter(is_parent=folder) if folder else Folder.objects.filter(user=request.user,
-                                                                                                    is_parent=None),
+            'files': page.files,
+            'folders': page.folders if not folder else [],
+            'subfolders': page.folders if folder else [],
+            'next_cursor': page.next_cursor,
             'folder': folder,
+            'nested_path': folder.get_nested_path() if folder else [],
         }
-        return render(request, self.template_name, context)
+        return render(request, self.template_name, context, status=413 if upload_errors else 200)
 
 
-class FileDetailView(View):
+class FileBulkUploadView(LoginRequiredMixin, View):
+    """
+    Uploads many files in a single request, optionally recreating their directory tree.
+
+    POST request:
+        - Expects the files in the 'files' field and, optionally, the path of each file relative
+          to the uploaded directory (e.g. 'DCIM/2024/IMG_0001.JPG') in the 'paths' field, in the
+          same order. Missing folders are created below the folder given in 'parent_slug', or
+          at the top level.
+        - Returns the created files, and the skipped files with the reason they were skipped.
+          Invalid files do not prevent the others from being stored.
+    """
+    skip_invalid_files = True
+    enforce_quota = True
+
+    @traced_upload('bulk')
+    def post(self, request, *args, **kwargs):
+        folder_slug = request.POST.get('parent_slug')
+        usage = getattr(request, 'quota_exceeded', None)
+        if usage is not None:
+            return JsonResponse({'error': get_quota_error(usage)}, status=413)
+
+        folder = get_object_or_404(Folder, slug=folder_slug, user=request.user) if folder_slug else None
+
+        files = iter(request.FILES.getlist('files'))
+        paths = request.POST.getlist('paths')
+        # Files rejected by ValidatingUploadHandler while they were arriving are missing from
+        # request.FILES, so the paths are matched with the files by position
+        rejected = {position: reason for (field, position), reason in getattr(request, 'rejected_uploads', {}).items()
+                    if field == 'files'}
+        uploads = []
+        errors = []
+        for position in range(len(request.FILES.getlist('files')) + len(rejected)):
+            path = paths[position] if position < len(paths) else ''
+            if position in rejected:
+                name, message = rejected[position]
+                errors.append({'path': path or name, 'error': message})
+            else:
+                uploads.append((path, next(files)))
+
+        result = bulk_upload(request.user, uploads, folder)
+        errors += [{'path': error.path, 'error': error.message} for error in result.errors]
+
+        return JsonResponse({
+            'files': [
+                {
+                    'id': file.id,
+                    'name': file.name,
+                    'folder': file.folder.slug if file.folder else None,
+                    'url': reverse('uploadmanager:file_detail', args=[file.id]),
+                }
+                for file in result.files
+            ],
+            'errors': errors,
+        }, status=201 if result.files else 400)
+
+
+class UploadSessionCreateView(AsyncLoginRequiredMixin, View):
+    """
+    Starts a resumable, chunked upload.
+
+    POST request:
+        - Expects the total size in the 'Upload-Length' header, the file name in the 'filename'
+          field and optionally the target folder in 'parent_slug'.
+        - Creates the upload session and its staging file, and returns its URL in the
+          'Location' header.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            length = int(request.headers.get('Upload-Length', ''))
+        except ValueError:
+            return JsonResponse({'error': 'A valid Upload-Length header is required.'}, status=400)
+
+        filename = os.path.basename(request.POST.get('filename', '').strip())
+        if length < 0 or not filename:
+            return JsonResponse({'error': 'A file name and a non-negative length are required.'}, status=400)
+        if length > get_max_file_size(None):
+            return JsonResponse({
+                'error': f"File size exceeds the maximum limit of {get_max_file_size(None) // (1024 * 1024)} MB."
+            }, status=413)
+
+        usage = await StorageUsage.afor_user(request.user)
+        if length > usage.get_available_bytes():
+            return JsonResponse({'error': get_quota_error(usage)}, status=413)
+
+        folder_slug = request.POST.get('parent_slug')
+        folder = await aget_object_or_404(Folder, slug=folder_slug, user=request.user) if folder_slug else None
+
+        session = await UploadSession.objects.acreate(user=request.user, folder=folder, filename=filename,
+                                                      length=length)
+        await sync_to_async(session.allocate, thread_sensitive=False)()
+
+        response = JsonResponse({'id': str(session.id), 'offset': 0, 'length': length}, status=201)
+        response['Location'] = reverse('uploadmanager:upload_session', args=[session.id])
+        response['Upload-Offset'] = 0
+        response['Upload-Length'] = length
+        return response
+
+
+class UploadSessionView(AsyncLoginRequiredMixin, View):
+    """
+    Receives the chunks of a resumable upload.
+
+    HEAD request:
+        - Returns the number of contiguous bytes received so far in the 'Upload-Offset' header.
+
+    PATCH request:
+        - Writes the request body into the staging file at the offset given in the
+          'Upload-Offset' header. Chunks may be retried and sent in parallel.
+
+    DELETE request:
+        - Cancels the upload and removes its staging file.
+
+    The view is async, so a slow client sending a chunk holds no thread while the body is
+    being received; only the copy into the staging file runs in a worker thread.
+    """
+
+    async def head(self, request, session_id):
+        session = await aget_object_or_404(UploadSession, id=session_id, user=request.user)
+        response = HttpResponse(status=200)
+        response['Upload-Offset'] = await session.aget_offset()
+        response['Upload-Length'] = session.length
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    @traced_upload('chunk')
+    async def patch(self, request, session_id):
+        session = await aget_object_or_404(UploadSession, id=session_id, user=request.user)
+        if session.file_id:
+            return JsonResponse({'error': 'This upload has already been finalized.'}, status=409)
+
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return JsonResponse({'error': 'A valid Upload-Offset header is required.'}, status=400)
+
+        start = time.perf_counter()
+        try:
+            written = await session.awrite_chunk(offset, request)
+        except ValidationError as error:
+            return JsonResponse({'error': error.messages}, status=400)
+        record_upload('chunked', written, time.perf_counter() - start)
+        annotate_upload(session=str(session.id), offset=offset, size=written)
+
+        response = HttpResponse(status=204)
+        response['Upload-Offset'] = await session.aget_offset()
+        response['Upload-Length'] = session.length
+        return response
+
+    async def delete(self, request, session_id):
+        session = await aget_object_or_404(UploadSession, id=session_id, user=request.user)
+        await sync_to_async(session.discard, thread_sensitive=False)()
+        await session.adelete()
+        return HttpResponse(status=204)
+
+
+class UploadSessionFinalizeView(AsyncLoginRequiredMixin, View):
+    """
+    Completes a resumable upload.
+
+    POST request:
+        - Validates the assembled staging file and creates the `File` row from it.
+        - Finalizing an already finalized session returns the same file again, also when both
+          requests run at the same time: the file is created with the session row locked.
+
+    The MIME sniffing and checksumming pass over the staging file runs in a worker thread,
+    off the event loop, and the file is then saved with the results, without reading it again.
+    """
+
+    @traced_upload('finalize')
+    async def post(self, request, session_id):
+        session = await aget_object_or_404(UploadSession.objects.select_related('folder'), id=session_id,
+                                           user=request.user)
+
+        if not session.file_id:
+            offset = await session.aget_offset()
+            if offset < session.length:
+                await session.arefresh_from_db(fields=['file'])
+                if not session.file_id:
+                    return JsonResponse({'error': 'The upload is not complete yet.', 'offset': offset}, status=409)
+
+        if not session.file_id:
+            # Other uploads may have used up the quota since this session was started
+            usage = await StorageUsage.afor_user(request.user)
+            if session.length > usage.get_available_bytes():
+                return JsonResponse({'error': get_quota_error(usage)}, status=413)
+
+            try:
+                inspection = await sync_to_async(self.inspect, thread_sensitive=False)(session)
+                created = await sync_to_async(self.create_file)(session, inspection)
+            except FileNotFoundError:
+                # A concurrent request finalized the session and removed its staging file
+                await session.arefresh_from_db(fields=['file'])
+                if not session.file_id:
+                    raise
+                created = False
+            except ValidationError as error:
+                return JsonResponse({'error': error.messages}, status=400)
+            except IntegrityError:
+                return JsonResponse({'error': 'A file with this name already exists in this folder.'}, status=409)
+
+            if created:
+                await session.chunks.all().adelete()
+                await sync_to_async(session.discard, thread_sensitive=False)()
+
+        return JsonResponse({
+            'id': session.file_id,
+            'url': reverse('uploadmanager:file_detail', args=[session.file_id]),
+        }, status=201)
+
+    @staticmethod
+    def inspect(session):
+        """
+        Validates the type and size of the assembled staging file, and checksums it.
+        """
+        annotate_upload(session=str(session.id), size=session.length)
+        with stage('inspect_file'), open(session.staging_path, 'rb') as staging_file:
+            return inspect_file(DjangoFile(staging_file, name=session.filename))
+
+    @staticmethod
+    def create_file(session, inspection):
+        """
+        Creates the `File` of a session from its inspected staging file, and links them.
+
+        The session row is locked and checked again first, so of concurrent requests finalizing
+        the same session, only one creates the file; the others get the file it created.
+
+        Returns:
+            bool: Whether the file was created, rather than by a concurrent request.
+        """
+        with transaction.atomic():
+            finalized_file_id = (UploadSession.objects.select_for_update().values_list('file_id', flat=True)
+                                 .get(pk=session.pk))
+            if finalized_file_id:
+                session.file_id = finalized_file_id
+                return False
+
+            with open(session.staging_path, 'rb') as staging_file:
+                new_file = File(file=DjangoFile(staging_file, name=session.filename), folder=session.folder,
+                                user_id=session.user_id, size=inspection.size, checksum=inspection.checksum)
+                new_file.type = new_file._choose_file_type(inspection.mime_type)
+                new_file.save()
+            session.file = new_file
+            session.save(update_fields=['file', 'updated_at'])
+        return True
+
+
+class FileDetailView(LoginRequiredMixin, View):
     """
     View for displaying the details of a specific file.
 
     Handles:
-        - GET request: Displays the file's details like name, size, type, etc.
+        - GET request: Displays the file's details like name, size, type, etc. Only the owner can see the file.
 
     Template:
         'uploadmanager/file-detail.html'
@@ -123,14 +462,37 @@ class FileDetailView(View):
     Context:
         - file: The file instance to display.
     """
+    use_read_replica = True
 
     def get(self, request, *args, **kwargs):
         file_id = kwargs.get('file_id')
-        file = get_object_or_404(File, id=file_id)
+        file = get_object_or_404(File, id=file_id, user=request.user)
 
         return render(request, 'uploadmanager/file-detail.html', {'file': file})
 
 
+class FileDownloadView(AsyncLoginRequiredMixin, View):
+    """
+    View for downloading the content of a file.
+
+    Handles:
+        - GET request: Sends the file to its owner, supporting Range and conditional requests.
+          The byte transfer is handed to the front proxy when DOWNLOAD_OFFLOAD is set.
+          Adding '?download=1' asks the browser to save the file instead of displaying it.
+
+    Without DOWNLOAD_OFFLOAD, the file is read in worker threads and streamed by an async
+    iterator, so slow downloads hold no thread, but every byte goes through Python: uvicorn has
+    no sendfile. The docker-compose deployment hands the transfer to nginx instead.
+    """
+    use_read_replica = True
+
+    async def get(self, request, pk):
+        file = await aget_object_or_404(File, pk=pk, user=request.user)
+        return await sync_to_async(serve_file, thread_sensitive=False)(
+            request, file.file.path, file.name, etag=file.checksum or None,
+            as_attachment=bool(request.GET.get('download')), asynchronous=True)
+
+
 class FileUpdateView(LoginRequiredMixin, View):
     """
     View for updating the details of a file (e.g., name, description, etc.).
@@ -190,7 +552,7 @@ class FileDeleteView(LoginRequiredMixin, View):
 
         if request.user.is_authenticated and request.user == file.user:
             folder = file.folder
-            file.delete()
+            trash(request.user, files=[file.pk])
             messages.success(request, 'File deleted successfully.', 'success')
 
             if folder:
@@ -202,6 +564,30 @@ class FileDeleteView(LoginRequiredMixin, View):
             return redirect('uploadmanager:home')
 
 
+class BulkDeleteView(LoginRequiredMixin, View):
+    """
+    Deletes several files and folders selected together.
+
+    POST request:
+        - Expects the ids of the files in the 'files' field and the slugs of the folders in the
+          'folders' field, each of which may be repeated.
+        - Hides the selection and its contents right away and leaves the removal of the rows and
+          stored files to the background purger, so it returns quickly however much is deleted.
+        - Returns the number of folders and files deleted. Items not owned by the user are ignored.
+    """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            file_ids = [int(file_id) for file_id in request.POST.getlist('files')]
+        except ValueError:
+            return JsonResponse({'error': 'File ids must be integers.'}, status=400)
+
+        folders = Folder.objects.filter(slug__in=request.POST.getlist('folders'), user=request.user)
+        deleted_folders, deleted_files = trash(request.user, folders=folders, files=file_ids)
+
+        return JsonResponse({'folders': deleted_folders, 'files': deleted_files})
+
+
 class FolderCreateView(LoginRequiredMixin, View):
     """
     Handles the creation of new folders for the user.
@@ -224,6 +610,7 @@ class FolderCreateView(LoginRequiredMixin, View):
             - 'upload_form': The file upload form.
             - 'form': The folder creation form with potential validation errors.
             - 'folder': The parent folder if a subfolder is being created.
+            - 'nested_path': The folders leading to the parent folder, for the breadcrumb.
             - 'folders': List of top-level folders (if no parent folder is specified).
             - 'subfolders': List of subfolders under the parent folder.
             - 'files': List of files under the parent folder.
@@ -247,22 +634,57 @@ class FolderCreateView(LoginRequiredMixin, View):
             return redirect('uploadmanager:folder_detail', slug=parent_slug) if parent_folder else redirect(
                 'uploadmanager:home')
 
-        folders = Folder.objects.filter(user=request.user, is_parent=None) if not parent_folder else []
-        subfolders = Folder.objects.filter(is_parent=parent_folder) if parent_folder else []
-        files = File.objects.filter(folder=parent_folder) if parent_folder else []
+        page = get_listing_page(parent_folder.user if parent_folder else request.user, parent_folder)
 
         context = {
             'upload_form': FileUploadForm(),
             'form': form,
             'folder': parent_folder,
-            'folders': folders,
-            'subfolders': subfolders,
-            'files': files,
+            'nested_path': parent_folder.get_nested_path() if parent_folder else [],
+            'folders': page.folders if not parent_folder else [],
+            'subfolders': page.folders if parent_folder else [],
+            'files': page.files,
+            'next_cursor': page.next_cursor,
         }
 
         return render(request, self.template_name, context)
 
 
+class FolderTreeCreateView(LoginRequiredMixin, View):
+    """
+    Creates a whole tree of folders in a single request, for clients syncing a directory.
+
+    POST request:
+        - Expects the folder paths relative to the folder given in 'parent_slug', or to the top
+          level, in the 'paths' field, which may be repeated (e.g. 'DCIM/2024').
+        - Creates the missing folders of every path and reuses the existing ones, so sending the
+          same paths again, even concurrently, creates nothing new.
+        - Returns the folder at the end of each path, or the validation error if a folder name
+          is invalid, in which case no folder is created.
+    """
+
+    def post(self, request, *args, **kwargs):
+        parent_slug = request.POST.get('parent_slug')
+        parent_folder = get_object_or_404(Folder, slug=parent_slug, user=request.user) if parent_slug else None
+
+        try:
+            folders = create_folder_tree(request.user, request.POST.getlist('paths'), parent_folder)
+        except ValidationError as error:
+            return JsonResponse({'error': error.messages}, status=400)
+
+        return JsonResponse({
+            'folders': [
+                {
+                    'path': path,
+                    'name': folder.name,
+                    'slug': folder.slug,
+                    'url': reverse('uploadmanager:folder_detail', args=[folder.slug]),
+                }
+                for path, folder in folders.items()
+            ],
+        }, status=201)
+
+
 class FolderDetailView(View):
     """
     View for displaying the details of a specific folder.
@@ -275,26 +697,71 @@ class FolderDetailView(View):
 
     Context:
         - folder: The folder being viewed.
+        - nested_path: The folders leading to it, for the breadcrumb.
         - files: The list of files inside the folder.
         - subfolders: The list of subfolders inside the folder.
+        - next_cursor: Cursor of the next page of the listing, if any.
         - upload_form: The file upload form.
+        - listing_cache_key: Key the rendered rows of the listing are cached under.
+
+    The listing and its rendered rows are cached under the version of the folder, which
+    changes whenever its contents do. The ETag of the page combines that version with the
+    breadcrumb, as renaming an ancestor changes the page without touching the folder.
+    The view is async, and read from a replica, like HomeView.
     """
     template_name = 'uploadmanager/home.html'
+    use_read_replica = True
+
+    async def get(self, request, slug, *args, **kwargs):
+        request.user = await request.auser()
+        folder = await aget_object_or_404(Folder.objects.select_related('user'), slug=slug)
+        cursor = request.GET.get('cursor')
+        page, version = await aget_cached_listing_page(folder.user, folder, cursor=cursor)
+
+        nested_path = await sync_to_async(folder.get_nested_path)()
+        etag = get_listing_etag(request, version, cursor, nested_path)
+        not_modified = await sync_to_async(get_conditional_listing_response)(request, etag)
+        if not_modified:
+            return not_modified
 
-    def get(self, request, slug, *args, **kwargs):
-        folder = get_object_or_404(Folder, slug=slug)
-        files = File.objects.filter(folder=folder)
-        subfolders = Folder.objects.filter(is_parent=folder)
         upload_form = FileUploadForm()
 
         context = {
             'folder': folder,
-            'files': files,
-            'subfolders': subfolders,
+            'nested_path': nested_path,
+            'files': page.files,
+            'subfolders': page.folders,
+            'next_cursor': page.next_cursor,
             'upload_form': upload_form,
+            'listing_cache_key': get_listing_cache_key(folder.user_id, folder.pk, version, cursor),
+            'listing_cache_timeout': LISTING_CACHE_TIMEOUT,
         }
 
-        return render(request, self.template_name, context)
+        return set_listing_headers(await sync_to_async(render)(request, self.template_name, context), etag)
+
+
+class FolderDownloadView(AsyncLoginRequiredMixin, View):
+    """
+    View for downloading a folder and its whole subtree as a ZIP archive.
+
+    Handles:
+        - GET request: Streams the archive to the folder's owner while it is being generated,
+          so memory use stays constant and nothing is written to disk, whatever the folder size.
+
+    The archive is produced in the request's sync thread, which holds the database cursor the
+    files are read from, and handed to the event loop part by part.
+    """
+    use_read_replica = True
+
+    async def get(self, request, slug):
+        folder = await aget_object_or_404(Folder, slug=slug, user=request.user)
+
+        archive = iterate_in_thread(stream_zip(get_folder_entries(folder)), thread_sensitive=True)
+        response = StreamingHttpResponse(archive, content_type='application/zip')
+        response['Content-Disposition'] = content_disposition_header(True, f"{folder.name}.zip")
+        response['Cache-Control'] = 'private, no-store'
+        response['X-Accel-Buffering'] = 'no'  # Ask nginx to pass the archive on as it is generated
+        return response
 
 
 class FolderUpdateView(LoginRequiredMixin, View):
@@ -342,6 +809,7 @@ class FolderDeleteView(LoginRequiredMixin, View):
 
     Handles:
         - POST request: Deletes the folder and its contents, and redirects to the appropriate parent folder or homepage.
+          The folder disappears right away; its rows and stored files are removed in the background.
 
     Context:
         - success message if the folder was deleted.
@@ -352,7 +820,7 @@ class FolderDeleteView(LoginRequiredMixin, View):
 
         if request.user.is_authenticated and request.user == folder.user:
             parent_folder = folder.is_parent
-            folder.delete()
+            trash(request.user, folders=[folder])
             messages.success(request, 'Folder deleted successfully.', 'success')
 
             if parent_folder:
@@ -367,7 +835,12 @@ class FolderDeleteView(LoginRequiredMixin, View):
 class SearchView(View):
     """
     View for searching files and folders based on a query string.
+
+    Files and folders are searched through their full-text and trigram indexes and merged
+    into a single list ranked by relevance, which is paginated.
     """
+    paginate_by = 50
+    use_read_replica = True
 
     def get(self, request, *args, **kwargs):
         """
@@ -378,29 +851,17 @@ class SearchView(View):
         """
         search_query = self.request.GET.get("search", "").strip()
 
-        # Filter files and folders based on the search query and user ownership
-        files = File.objects.filter(
-            user=request.user, name__icontains=search_query
-        ).order_by("name")
-        folders = Folder.objects.filter(
-            user=request.user, name__icontains=search_query
-        ).order_by("name")
-
-        # Build the full path for each folder, including parent folders
-        for folder in folders:
-            path = self.get_folder_path(folder)
-            folder.path = path  # Add the folder path to the search results
-
-        # Build the full path for each file based on its parent folder
-        for file in files:
-            path = self.get_folder_path(file.folder)  # Handle cases where the file might be in a folder
-            file.path = path  # Add the file path to the search results
+        # Rank the user's files and folders together, then load only the current page
+        page = Paginator(search.search(request.user, search_query), self.paginate_by).get_page(
+            request.GET.get("page")
+        )
+        results = search.resolve(page.object_list)
 
         # Prepare a title for the search results
         search_title = f'Search results for: "{search_query}"' if search_query else "Search results"
 
         # Check if no results were found
-        no_results = not files.exists() and not folders.exists()
+        no_results = not results
 
         if no_results:
             messages.info(request, "No results found.", "info")  # Notify the user if nothing matches the search
@@ -408,35 +869,10 @@ class SearchView(View):
         # Render the search results page with relevant context
         context = {
             "search_title": search_title,
-            "files": files,
-            "folders": folders,
+            "search_query": search_query,
+            "results": results,
+            "page_obj": page,
             "no_results": no_results,
         }
 
         return render(request, "uploadmanager/search-list.html", context)
-
-    def get_folder_path(self, folder):
-        """
-        Recursively get the full path of a folder including all parent folders.
-
-        Args:
-            folder (Folder): The folder instance for which the path is to be determined.
-
-        Returns:
-            str: A string representing the folder path in the format "Parent / Subfolder / Folder".
-                If the folder is None, returns "Home" or another suitable indicator.
-        """
-        if not folder:
-            return "Home"  # Use "Home" or another suitable placeholder for top-level files
-
-        path_parts = [folder.name]
-        parent_folder = folder.is_parent
-
-        # Traverse up the hierarchy to build the full path
-        while parent_folder:
-            if not parent_folder.name:
-                break  # Exit the loop if the parent folder is invalid
-            path_parts.insert(0, parent_folder.name)  # Add the parent folder's name to the beginning of the path
-            parent_folder = parent_folder.is_parent  # Move up to the next parent folder
-
-        return " / ".join(path_parts)  # Combine all parts into a single path string